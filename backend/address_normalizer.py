@@ -0,0 +1,280 @@
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, Tuple
+
+# 正規化・バリエーション生成の結果を保持する件数（CSV 取り込みやジオコーディングで同じ住所を何度も処理するため）
+ADDRESS_CACHE_SIZE = int(os.getenv("ADDRESS_CACHE_SIZE", "8192"))
+
+# NFKC の後に置換する文字（1回の translate でまとめて置換する）
+# NFKC で全角数字・全角ハイフン・全角スペース・全角括弧などは既に半角になっているため、
+# ここでは NFKC で変わらない長音符・波ダッシュ・かぎ括弧・句読点などを扱う
+_TRANSLATION = str.maketrans({
+    '？': '-',
+    '?': '-',
+    '　': ' ',  # 全角スペースを半角に
+    'ー': '-',  # 全角ハイフンを半角に
+    '－': '-',  # 全角ハイフンを半角に
+    '〜': '-',  # 全角チルダを半角ハイフンに
+    '～': '-',  # 全角チルダを半角ハイフンに
+    '（': '(',  # 全角括弧を半角に
+    '）': ')',
+    '【': '[',
+    '】': ']',
+    '「': '"',
+    '」': '"',
+    '『': '"',
+    '』': '"',
+    '、': ',',
+    '。': '.',
+    '・': ' ',
+})
+
+_WHITESPACE = re.compile(r'\s+')
+
+# 建物名や部屋番号（例：江古田マンション 1F、練馬区役所内２０Ｆ）
+_BUILDING_SUFFIXES = [
+    'マンション', 'ビル', 'タワー', 'プラザ', 'センター', 'ホール', '内', 'F', '階', '号', '室',
+]
+_BUILDING_PATTERNS = [re.compile(r'\s+[A-Za-z0-9]+' + suffix + '.*') for suffix in _BUILDING_SUFFIXES]
+# create_address_variations では公園内の施設も削除する
+_VARIATION_BUILDING_PATTERNS = _BUILDING_PATTERNS + [re.compile(r'\s+[A-Za-z0-9]+公園内.*')]
+# どれか1つでも当てはまるかを1回で調べる（建物名を含まない大半の住所は個別のパターンを試さない）
+_BUILDING_PREFILTER = re.compile(
+    r'\s[A-Za-z0-9]+(?:' + '|'.join(_BUILDING_SUFFIXES + ['公園内']) + ')'
+)
+
+_CHOME = re.compile(r'\d+丁目')
+_BLOCK3 = re.compile(r'\d+-\d+-\d+')
+_BLOCK3_TRIM = re.compile(r'(\d+-\d+)-\d+')
+_BLOCK2 = re.compile(r'\d+-\d+')
+_BLOCK2_TRIM = re.compile(r'(\d+)-\d+')
+_DIGITS = re.compile(r'\d+')
+_TOWN = re.compile(r'[町村]')
+_TOWN_TRIM = re.compile(r'[町村][^区市]*')
+
+
+# 漢数字（住所の丁目・番地で使われる範囲）
+_KANJI_DIGITS = {'〇': 0, '零': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_KANJI_UNITS = {'十': 10, '百': 100, '千': 1000}
+_KANJI_NUMBER = re.compile(r'[〇零一二三四五六七八九十百千]+(?=丁目|番地?|号|地割|$|-)')
+
+
+def kanji_to_int(text: str) -> int:
+    """漢数字を整数に変換する（「十二」「二十三」「百五」「一〇五」など。不正な文字は ValueError）"""
+    if not text:
+        raise ValueError("空の漢数字です")
+    if all(char in _KANJI_DIGITS for char in text):
+        # 位取りの「一〇五」形式
+        return int(''.join(str(_KANJI_DIGITS[char]) for char in text))
+    total = 0
+    digit = 0
+    for char in text:
+        if char in _KANJI_DIGITS:
+            digit = _KANJI_DIGITS[char]
+        elif char in _KANJI_UNITS:
+            total += (digit or 1) * _KANJI_UNITS[char]
+            digit = 0
+        else:
+            raise ValueError(f"漢数字ではありません: {text}")
+    return total + digit
+
+
+def convert_kanji_numerals(address: str) -> str:
+    """丁目・番地・号の前の漢数字を算用数字にする（例：豊玉北六丁目十二番 → 豊玉北6丁目12番）
+
+    町名に含まれる漢数字（例：三軒茶屋、六本木）は変えない。
+    """
+    return _KANJI_NUMBER.sub(lambda match: str(kanji_to_int(match.group(0))), address)
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def normalize_address(address: str) -> str:
+    """住所の全角文字を半角に変換し、特殊文字を置換"""
+    if not address:
+        return ""
+
+    # 全角英数字・記号を半角に変換し、残りの特殊文字をまとめて置換
+    address = unicodedata.normalize('NFKC', address).translate(_TRANSLATION)
+
+    # 連続するスペースを1つにし、先頭と末尾の空白を削除
+    return _WHITESPACE.sub(' ', address).strip()
+
+
+def _building_variations(address: str, patterns) -> List[str]:
+    if not _BUILDING_PREFILTER.search(address):
+        return []
+    return [pattern.sub('', address) for pattern in patterns if pattern.search(address)]
+
+
+def _unique(addresses: List[str]) -> Tuple[str, ...]:
+    # 重複を削除（順序保持）し、空文字列を除外
+    return tuple(addr.strip() for addr in dict.fromkeys(addresses) if addr.strip())
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _address_variations(address: str) -> Tuple[str, ...]:
+    variations = [address]
+
+    # 東京都を省略
+    if address.startswith('東京都'):
+        variations.append(address.replace('東京都', '').strip())
+
+    # 練馬区を省略（練馬区の住所の場合）
+    if '練馬区' in address:
+        variations.append(address.replace('練馬区', '').strip())
+
+    # 丁目を削除
+    if '丁目' in address:
+        variations.append(_CHOME.sub('', address))
+
+    # 番地を段階的に削除
+    if _BLOCK3.search(address):
+        variations.append(_BLOCK3_TRIM.sub(r'\1', address))
+        variations.append(_BLOCK3.sub('', address))
+
+    if _BLOCK2.search(address):
+        variations.append(_BLOCK2_TRIM.sub(r'\1', address))
+        variations.append(_BLOCK2.sub('', address))
+
+    # 建物名や部屋番号を削除
+    variations += _building_variations(address, _VARIATION_BUILDING_PATTERNS)
+
+    return _unique(variations)
+
+
+def create_address_variations(address: str) -> List[str]:
+    """住所のバリエーションを作成"""
+    return list(_address_variations(address))
+
+
+@lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _simplified_addresses(address: str) -> Tuple[str, ...]:
+    simplified = [address]
+
+    # 建物名や部屋番号を削除
+    simplified += _building_variations(address, _BUILDING_PATTERNS)
+
+    # 番地を削除（例：1-2-3 → 1-2）
+    if _BLOCK3.search(address):
+        simplified.append(_BLOCK3_TRIM.sub(r'\1', address))
+
+    # 番地をさらに削除（例：1-2 → 1）
+    if _BLOCK2.search(address):
+        simplified.append(_BLOCK2_TRIM.sub(r'\1', address))
+
+    # 丁目を削除
+    if '丁目' in address:
+        simplified.append(_CHOME.sub('', address))
+
+    # 番地を完全に削除
+    if _DIGITS.search(address):
+        simplified.append(_DIGITS.sub('', address))
+
+    # 町名を削除（最後の手段）
+    if _TOWN.search(address):
+        simplified.append(_TOWN_TRIM.sub('', address))
+
+    return _unique(simplified)
+
+
+def simplify_address(address: str) -> List[str]:
+    """住所を段階的に簡略化してリストで返す"""
+    return list(_simplified_addresses(address))
+
+
+def cache_stats() -> dict:
+    """正規化・バリエーション生成のキャッシュの統計"""
+    stats = {}
+    for name, func in (
+        ("normalize", normalize_address),
+        ("variations", _address_variations),
+        ("simplify", _simplified_addresses),
+    ):
+        info = func.cache_info()
+        stats[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+    return stats
+
+
+if __name__ == "__main__":
+    # 現在の出力を固定するゴールデンテストと、正規化・バリエーション生成のベンチマーク
+    import random
+    import time
+
+    GOLDEN = [
+        ('東京都練馬区豊玉北６-12-１練馬区役所内２０Ｆ', '東京都練馬区豊玉北6-12-1練馬区役所内20F',
+         ['東京都練馬区豊玉北6-12-1練馬区役所内20F', '練馬区豊玉北6-12-1練馬区役所内20F', '東京都豊玉北6-12-1役所内20F', '東京都練馬区豊玉北6-12練馬区役所内20F', '東京都練馬区豊玉北練馬区役所内20F', '東京都練馬区豊玉北6-1練馬区役所内20F', '東京都練馬区豊玉北-1練馬区役所内20F'],
+         ['東京都練馬区豊玉北6-12-1練馬区役所内20F', '東京都練馬区豊玉北6-12練馬区役所内20F', '東京都練馬区豊玉北6-1練馬区役所内20F', '東京都練馬区豊玉北--練馬区役所内F']),
+        ('東京都練馬区光が丘4丁目1-1', '東京都練馬区光が丘4丁目1-1',
+         ['東京都練馬区光が丘4丁目1-1', '練馬区光が丘4丁目1-1', '東京都光が丘4丁目1-1', '東京都練馬区光が丘1-1', '東京都練馬区光が丘4丁目1', '東京都練馬区光が丘4丁目'],
+         ['東京都練馬区光が丘4丁目1-1', '東京都練馬区光が丘4丁目1', '東京都練馬区光が丘1-1', '東京都練馬区光が丘丁目-']),
+        ('東京都練馬区石神井台1丁目26-1', '東京都練馬区石神井台1丁目26-1',
+         ['東京都練馬区石神井台1丁目26-1', '練馬区石神井台1丁目26-1', '東京都石神井台1丁目26-1', '東京都練馬区石神井台26-1', '東京都練馬区石神井台1丁目26', '東京都練馬区石神井台1丁目'],
+         ['東京都練馬区石神井台1丁目26-1', '東京都練馬区石神井台1丁目26', '東京都練馬区石神井台26-1', '東京都練馬区石神井台丁目-']),
+        ('　東京都練馬区栄町３４ー５　江古田マンション 1F ', '東京都練馬区栄町34-5 江古田マンション 1F',
+         ['東京都練馬区栄町34-5 江古田マンション 1F', '練馬区栄町34-5 江古田マンション 1F', '東京都栄町34-5 江古田マンション 1F', '東京都練馬区栄町34 江古田マンション 1F', '東京都練馬区栄町 江古田マンション 1F', '東京都練馬区栄町34-5 江古田マンション'],
+         ['東京都練馬区栄町34-5 江古田マンション 1F', '東京都練馬区栄町34-5 江古田マンション', '東京都練馬区栄町34 江古田マンション 1F', '東京都練馬区栄町- 江古田マンション F', '東京都練馬区栄']),
+        ('東京都練馬区旭丘1-2-3 ABCビル 3階', '東京都練馬区旭丘1-2-3 ABCビル 3階',
+         ['東京都練馬区旭丘1-2-3 ABCビル 3階', '練馬区旭丘1-2-3 ABCビル 3階', '東京都旭丘1-2-3 ABCビル 3階', '東京都練馬区旭丘1-2 ABCビル 3階', '東京都練馬区旭丘 ABCビル 3階', '東京都練馬区旭丘1-3 ABCビル 3階', '東京都練馬区旭丘-3 ABCビル 3階', '東京都練馬区旭丘1-2-3', '東京都練馬区旭丘1-2-3 ABCビル'],
+         ['東京都練馬区旭丘1-2-3 ABCビル 3階', '東京都練馬区旭丘1-2-3', '東京都練馬区旭丘1-2-3 ABCビル', '東京都練馬区旭丘1-2 ABCビル 3階', '東京都練馬区旭丘1-3 ABCビル 3階', '東京都練馬区旭丘-- ABCビル 階']),
+        ('東京都練馬区向山３丁目２５−１（としまえん跡地）', '東京都練馬区向山3丁目25−1(としまえん跡地)',
+         ['東京都練馬区向山3丁目25−1(としまえん跡地)', '練馬区向山3丁目25−1(としまえん跡地)', '東京都向山3丁目25−1(としまえん跡地)', '東京都練馬区向山25−1(としまえん跡地)'],
+         ['東京都練馬区向山3丁目25−1(としまえん跡地)', '東京都練馬区向山25−1(としまえん跡地)', '東京都練馬区向山丁目−(としまえん跡地)']),
+        ('練馬区石神井町5-12？3 石神井公園内', '練馬区石神井町5-12-3 石神井公園内',
+         ['練馬区石神井町5-12-3 石神井公園内', '石神井町5-12-3 石神井公園内', '練馬区石神井町5-12 石神井公園内', '練馬区石神井町 石神井公園内', '練馬区石神井町5-3 石神井公園内', '練馬区石神井町-3 石神井公園内'],
+         ['練馬区石神井町5-12-3 石神井公園内', '練馬区石神井町5-12 石神井公園内', '練馬区石神井町5-3 石神井公園内', '練馬区石神井町-- 石神井公園内', '練馬区石神井']),
+        ('東京都豊島区南長崎', '東京都豊島区南長崎',
+         ['東京都豊島区南長崎', '豊島区南長崎'],
+         ['東京都豊島区南長崎']),
+        ('東京都練馬区桜台4〜5・6番地「テスト」、。', '東京都練馬区桜台4-5 6番地"テスト",.',
+         ['東京都練馬区桜台4-5 6番地"テスト",.', '練馬区桜台4-5 6番地"テスト",.', '東京都桜台4-5 6番地"テスト",.', '東京都練馬区桜台4 6番地"テスト",.', '東京都練馬区桜台 6番地"テスト",.'],
+         ['東京都練馬区桜台4-5 6番地"テスト",.', '東京都練馬区桜台4 6番地"テスト",.', '東京都練馬区桜台- 番地"テスト",.']),
+        ('', '', [], []),
+    ]
+
+    failures = 0
+    for raw, normalized, variations, simplified in GOLDEN:
+        for name, actual, expected in (
+            ("normalize_address", normalize_address(raw), normalized),
+            ("create_address_variations", create_address_variations(normalized), variations),
+            ("simplify_address", simplify_address(normalized), simplified),
+        ):
+            if actual != expected:
+                failures += 1
+                print(f"NG {name}({raw!r})\n  expected: {expected!r}\n  actual:   {actual!r}")
+    print(f"golden: {failures} failures in {len(GOLDEN)} addresses")
+
+    random.seed(0)
+    towns = ["豊玉北", "光が丘", "石神井台", "旭丘", "桜台", "向山", "栄町", "練馬", "大泉学園町", "関町北"]
+    buildings = ["", "", "", " ABCマンション 2F", " 練馬ビル 3階", "内２０Ｆ"]
+    addresses = [
+        f"東京都練馬区{random.choice(towns)}{random.randint(1, 8)}丁目{random.randint(1, 40)}ー{random.randint(1, 20)}"
+        f"{random.choice(buildings)}"
+        for _ in range(2000)
+    ]
+    # CSV の取り込みでは同じ住所が何度も出てくる
+    workload = addresses * 5
+    random.shuffle(workload)
+
+    def run():
+        for address in workload:
+            normalized = normalize_address(address)
+            create_address_variations(normalized)
+            simplify_address(normalized)
+
+    def uncached():
+        for address in workload:
+            normalized = normalize_address.__wrapped__(address)
+            _address_variations.__wrapped__(normalized)
+            _simplified_addresses.__wrapped__(normalized)
+
+    for label, func in (("uncached", uncached), ("cached (cold)", run), ("cached (warm)", run)):
+        if label == "cached (cold)":
+            normalize_address.cache_clear()
+            _address_variations.cache_clear()
+            _simplified_addresses.cache_clear()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        print(f"{label:14s} {elapsed * 1000:7.1f}ms  {elapsed / len(workload) * 1e6:6.2f}us/address")
@@ -0,0 +1,107 @@
+import os
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware, IdentityResponder
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# brotli は任意（pip install brotli で Accept-Encoding: br に対応）
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# このサイズ（バイト）未満のレスポンスは圧縮しない
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+GZIP_COMPRESS_LEVEL = int(os.getenv("GZIP_COMPRESS_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+# このサイズ以上の本文はスレッドで圧縮し、イベントループを止めない
+COMPRESSION_THREAD_MINIMUM_SIZE = 128 * 1024
+
+# Starlette の IdentityResponder が圧縮処理の差し替え（apply_compression）に対応している場合のみ brotli を使う
+BROTLI_AVAILABLE = brotli is not None and hasattr(IdentityResponder, "apply_compression")
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """Accept-Encoding が encoding を受け付けるか（q=0 は拒否とみなす）"""
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() != encoding:
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+class BrotliResponder(IdentityResponder):
+    """レスポンス本文を brotli で圧縮する（ストリーミングにも対応）"""
+
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int = BROTLI_QUALITY, **kwargs):
+        super().__init__(app, minimum_size, **kwargs)
+        self.quality = quality
+        self._compressor = None
+
+    def _compress(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        data = self._compressor.process(body)
+        return data + (self._compressor.flush() if more_body else self._compressor.finish())
+
+    async def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if len(body) >= COMPRESSION_THREAD_MINIMUM_SIZE:
+            return await anyio.to_thread.run_sync(self._compress, body, more_body)
+        return self._compress(body, more_body)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Accept-Encoding に応じて brotli / gzip で圧縮するミドルウェア
+
+    brotli を受け付けるクライアントには brotli、それ以外は Starlette の gzip 圧縮を使う。
+    minimum_size 未満のレスポンスと、画像・Server-Sent Events などは圧縮しない。
+    圧縮したレスポンスの強い ETag は弱い ETag（W/"..."）にする。強い ETag はバイト列が同じことを
+    表すため、identity / gzip / br で同じ値を返せない（If-None-Match は弱い比較で照合する）。
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        compresslevel: int = GZIP_COMPRESS_LEVEL,
+        brotli_quality: int = BROTLI_QUALITY,
+    ) -> None:
+        super().__init__(app, minimum_size=minimum_size, compresslevel=compresslevel)
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await super().__call__(scope, receive, send)
+            return
+
+        async def send_with_weak_etag(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                etag = headers.get("etag")
+                if etag and "content-encoding" in headers and not etag.startswith("W/"):
+                    headers["etag"] = "W/" + etag
+            await send(message)
+
+        if BROTLI_AVAILABLE:
+            headers = Headers(scope=scope)
+            if accepts_encoding(headers.get("accept-encoding", ""), "br"):
+                responder = BrotliResponder(
+                    self.app,
+                    self.minimum_size,
+                    quality=self.brotli_quality,
+                    exclude_content_types=self.exclude_content_types,
+                )
+                await responder(scope, receive, send_with_weak_etag)
+                return
+        await super().__call__(scope, receive, send_with_weak_etag)
@@ -0,0 +1,313 @@
+import codecs
+import csv
+import io
+import logging
+import os
+from typing import Awaitable, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Spot
+from geocode_pipeline import geocode_addresses
+from metrics import span
+from scheduler import parse_opening_hours_text
+
+logger = logging.getLogger(__name__)
+
+# エンコーディング判定に使う先頭バイト数
+ENCODING_SAMPLE_SIZE = 64 * 1024
+
+# 判定候補（cp932 は shift_jis の上位互換のため先に試す）
+ENCODING_CANDIDATES = ['utf-8', 'cp932', 'shift_jis', 'euc-jp', 'iso-2022-jp']
+
+# 何行ごとにジオコーディングとデータベースへの反映を行うか
+CSV_IMPORT_BATCH_SIZE = int(os.getenv("CSV_IMPORT_BATCH_SIZE", "500"))
+
+# 1回の INSERT（executemany）で登録する行数
+CSV_INSERT_BATCH_SIZE = int(os.getenv("CSV_INSERT_BATCH_SIZE", "500"))
+
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+Resolver = Callable[[str], Awaitable[Tuple[Optional[float], Optional[float]]]]
+
+# バッチごとの進捗通知（取り込み結果, 処理済みの行数）
+BatchCallback = Callable[[dict, int], Awaitable[None]]
+
+
+def detect_encoding(sample: bytes) -> Optional[str]:
+    """先頭のサンプルから文字エンコーディングを判定（判別できない場合は None）"""
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in ENCODING_CANDIDATES:
+        try:
+            # サンプル末尾で切れたマルチバイト文字はエラーにしない
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return None
+
+
+def open_csv_stream(binary: BinaryIO) -> Tuple[io.TextIOWrapper, str]:
+    """バイナリストリームのエンコーディングを判定し、逐次デコードするテキストストリームを返す"""
+    sample = binary.read(ENCODING_SAMPLE_SIZE)
+    binary.seek(0)
+    encoding = detect_encoding(sample)
+    if encoding is None:
+        raise ValueError("CSVファイルの文字エンコーディングを判別できませんでした")
+    return io.TextIOWrapper(binary, encoding=encoding, newline=''), encoding
+
+
+def iter_batches(rows: Iterable[Dict[str, str]], size: int = CSV_IMPORT_BATCH_SIZE) -> Iterator[List[Tuple[int, Dict[str, str]]]]:
+    """(行番号, 行) を size 件ずつまとめて返す（行番号はヘッダー行を1行目とする）"""
+    batch = []
+    for row_num, row in enumerate(rows, start=2):  # ヘッダー行を除く
+        batch.append((row_num, row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def count_csv_rows(binary: BinaryIO) -> int:
+    """ヘッダー行を除いたデータ行数を数える（引用符内の改行も1行として扱う。進捗表示の分母用）"""
+    text_stream, _ = open_csv_stream(binary)
+    try:
+        return max(sum(1 for _ in csv.reader(text_stream)) - 1, 0)
+    finally:
+        text_stream.detach()
+
+
+async def load_existing_spots(db: AsyncSession) -> Dict[str, Tuple[int, str]]:
+    """登録済みスポットの 名前 -> (ID, 住所) を1回のクエリで取得"""
+    result = await db.execute(select(Spot.id, Spot.name, Spot.address))
+    return {name: (spot_id, address) for spot_id, name, address in result}
+
+
+async def insert_spots(db: AsyncSession, spot_rows: List[dict], batch_size: int = CSV_INSERT_BATCH_SIZE) -> List[int]:
+    """スポットを executemany でまとめて登録し、入力順に ID を返す"""
+    ids: List[int] = []
+    for start in range(0, len(spot_rows), batch_size):
+        chunk = spot_rows[start:start + batch_size]
+        inserted = await db.execute(
+            insert(Spot).returning(Spot.id, sort_by_parameter_order=True),
+            chunk
+        )
+        ids.extend(inserted.scalars().all())
+    return ids
+
+
+async def import_spot_batch(
+    db: AsyncSession,
+    batch: List[Tuple[int, Dict[str, str]]],
+    resolver: Resolver,
+    result: dict,
+    existing_spots: Dict[str, Tuple[int, str]],
+    insert_batch_size: int = CSV_INSERT_BATCH_SIZE,
+) -> None:
+    """1バッチ分の行を検証・ジオコーディングしてデータベースへ反映する
+
+    existing_spots は登録済みスポットの 名前 -> (ID, 住所)。このバッチで登録した
+    スポットも追加されるため、同じファイル内の重複も検出できる。
+    result の created_spots / skipped_duplicates / errors に結果を追記する。
+    """
+    created_spots = result['created_spots']
+    skipped_duplicates = result['skipped_duplicates']
+    errors = result['errors']
+
+    # 1. 必須項目の検証
+    rows = []
+    for row_num, row in batch:
+        if not row.get('name') or not row.get('address'):
+            rows.append((row_num, row, f"行 {row_num}: 名前と住所は必須です"))
+            continue
+        rows.append((row_num, row, None))
+
+    # 2. ジオコーディング（座標が未設定で、重複でない行のみ並行に解決）
+    addresses_to_geocode = []
+    seen_names = set()
+    for row_num, row, error in rows:
+        if error or row['name'] in seen_names or row['name'] in existing_spots:
+            continue
+        seen_names.add(row['name'])
+        if row.get('latitude') and row.get('longitude'):
+            continue
+        addresses_to_geocode.append(row['address'])
+    geocoded = await geocode_addresses(addresses_to_geocode, resolver)
+
+    # 3. 行の順序どおりに登録内容を決定（同じバッチ内の重複は登録予定の行を参照する）
+    pending: Dict[str, int] = {}  # 名前 -> spot_rows のインデックス
+    pending_duplicates = []  # (skipped_duplicates のエントリ, spot_rows のインデックス)
+    spot_rows: List[dict] = []
+    for row_num, row, error in rows:
+        if error:
+            errors.append(error)
+            continue
+        try:
+            # 重複チェック（同じ名前のスポットが既に存在するかチェック）
+            if row['name'] in existing_spots or row['name'] in pending:
+                duplicate = {
+                    'row': row_num,
+                    'name': row['name'],
+                    'address': row['address'],
+                    'existing_id': None,
+                    'existing_address': None
+                }
+                if row['name'] in existing_spots:
+                    duplicate['existing_id'], duplicate['existing_address'] = existing_spots[row['name']]
+                else:
+                    pending_duplicates.append((duplicate, pending[row['name']]))
+                skipped_duplicates.append(duplicate)
+                continue
+
+            # 座標が未設定の場合はジオコーディング結果を使用
+            latitude = row.get('latitude')
+            longitude = row.get('longitude')
+
+            if not latitude or not longitude:
+                lat, lon = geocoded.get(row['address'], (None, None))
+                if lat and lon:
+                    latitude = lat
+                    longitude = lon
+                else:
+                    errors.append(f"行 {row_num}: 住所 '{row['address']}' の座標が見つかりませんでした")
+                    continue
+
+            # プラン名の処理（新規プランの場合はそのまま使用）
+            plan_name = (row.get('plan') or '').strip()
+
+            # スポットを作成
+            spot_data = {
+                'name': row['name'],
+                'address': row['address'],
+                'latitude': float(latitude) if latitude else None,
+                'longitude': float(longitude) if longitude else None,
+                'description': row.get('description', ''),
+                'plan': plan_name,
+                'image_url': row.get('image_url', ''),
+                'visit_duration': int(row['visit_duration']) if row.get('visit_duration') else None,
+                'opening_hours': parse_opening_hours_text(row.get('opening_hours')),
+                'category': (row.get('category') or '').strip() or None,
+                'rating': float(row['rating']) if row.get('rating') else None
+            }
+            pending[row['name']] = len(spot_rows)
+            spot_rows.append(spot_data)
+
+        except Exception as e:
+            errors.append(f"行 {row_num}: {str(e)}")
+
+    # 4. まとめて登録し、採番された ID を反映
+    ids = await insert_spots(db, spot_rows, insert_batch_size)
+    for spot_id, spot_data in zip(ids, spot_rows):
+        existing_spots[spot_data['name']] = (spot_id, spot_data['address'])
+        created_spots.append({'id': spot_id, **spot_data})
+    for duplicate, index in pending_duplicates:
+        duplicate['existing_id'] = ids[index]
+        duplicate['existing_address'] = spot_rows[index]['address']
+
+
+async def import_spots_from_stream(
+    db: AsyncSession,
+    binary: BinaryIO,
+    resolver: Resolver,
+    batch_size: int = CSV_IMPORT_BATCH_SIZE,
+    insert_batch_size: int = CSV_INSERT_BATCH_SIZE,
+    on_batch: Optional[BatchCallback] = None,
+) -> dict:
+    """CSVのバイナリストリームを逐次読み込み、バッチごとにスポットを登録する
+
+    ファイル全体をメモリに読み込まないため、ファイルサイズに関わらずメモリ使用量は
+    バッチサイズ分に抑えられる。重複判定用の既存スポット名は最初に1回だけ取得する。
+    既存スポットの取得直後に一度コミットし、ジオコーディングの間は書き込み用の接続を保持しない
+    （SQLite の書き込み用の接続は1本のため、保持したままだと他の書き込みがプールの待ちで失敗する）。
+    各バッチはジオコーディングを終えてからデータベースに登録するので、on_batch でコミットすれば
+    接続を使うのは INSERT とコミットの間だけになる。on_batch を指定しない場合の最後のコミットは呼び出し側で行う。
+    """
+    text_stream, encoding = open_csv_stream(binary)
+    logger.info("CSVファイルを %s エンコーディングで読み込みます", encoding)
+
+    result = {
+        'encoding': encoding,
+        'created_spots': [],
+        'skipped_duplicates': [],
+        'errors': [],
+    }
+    try:
+        existing_spots = await load_existing_spots(db)
+        await db.commit()
+        reader = csv.DictReader(text_stream)
+        processed = 0
+        for batch in iter_batches(reader, batch_size):
+            with span("import.batch"):
+                await import_spot_batch(db, batch, resolver, result, existing_spots, insert_batch_size)
+            processed += len(batch)
+            if on_batch is not None:
+                await on_batch(result, processed)
+    finally:
+        # 元のファイルは呼び出し側で閉じるため、ラッパーだけを切り離す
+        text_stream.detach()
+    return result
+
+
+if __name__ == "__main__":
+    # 10,000 行の取り込みベンチマーク（一時 SQLite、座標入りでジオコーディングなし）
+    import asyncio
+    import tempfile
+    import time
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from database import Base
+
+    rows = 10_000
+    content = "name,address,latitude,longitude,plan,visit_duration\n" + "".join(
+        f"スポット{i},東京都練馬区豊玉北{i % 6 + 1}-{i % 20 + 1},35.73,139.65,散歩,30\n" for i in range(rows)
+    )
+    # 既存スポットとの重複・ファイル内の重複を少し混ぜる
+    content += "スポット1,重複,35.73,139.65,散歩,30\n" * 100
+
+    async def no_geocode(address):
+        return None, None
+
+    async def bulk_import(url):
+        async_engine = create_async_engine(url)
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(async_engine)() as db:
+            started = time.perf_counter()
+            result = await import_spots_from_stream(db, io.BytesIO(content.encode("utf-8")), no_geocode)
+            await db.commit()
+            elapsed = time.perf_counter() - started
+        await async_engine.dispose()
+        return result, elapsed
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result, elapsed = asyncio.run(bulk_import(f"sqlite+aiosqlite:///{tmp}/bulk.db"))
+        print(f"bulk:    {rows} rows in {elapsed * 1000:8.1f}ms "
+              f"(created={len(result['created_spots'])}, duplicates={len(result['skipped_duplicates'])})")
+
+        # 従来の1行ずつの重複チェック + flush との比較
+        engine = create_engine(f"sqlite:///{tmp}/per_row.db")
+        Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        started = time.perf_counter()
+        for row in csv.DictReader(io.StringIO(content)):
+            if db.query(Spot).filter(Spot.name == row['name']).first():
+                continue
+            db.add(Spot(name=row['name'], address=row['address'],
+                        latitude=float(row['latitude']), longitude=float(row['longitude']),
+                        plan=row['plan'], visit_duration=int(row['visit_duration'])))
+            db.flush()
+        db.commit()
+        elapsed = time.perf_counter() - started
+        print(f"per-row: {rows} rows in {elapsed * 1000:8.1f}ms")
+        db.close()
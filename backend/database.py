@@ -1,21 +1,143 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, Text, DateTime, Boolean
+from sqlalchemy import create_engine, event, inspect, Column, Integer, String, Float, Text, DateTime, Boolean, JSON
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import logging
 import os
+import time
 
-# SQLiteデータベースファイルのパス
-DATABASE_URL = "sqlite:///./database.db"
+from metrics import db_query_duration
 
-# SQLAlchemyエンジンを作成
+logger = logging.getLogger(__name__)
+
+# データベースURL（デフォルトは SQLite ファイル。Postgres を使う場合は postgresql://... を指定し、asyncpg をインストールする）
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./database.db")
+
+# 非同期ドライバ付きのURL
+ASYNC_DATABASE_URL = DATABASE_URL
+if ASYNC_DATABASE_URL.startswith("sqlite:///"):
+    ASYNC_DATABASE_URL = ASYNC_DATABASE_URL.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+elif ASYNC_DATABASE_URL.startswith(("postgresql://", "postgres://")):
+    ASYNC_DATABASE_URL = "postgresql+asyncpg://" + ASYNC_DATABASE_URL.split("://", 1)[1]
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# コネクションプールの設定
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# SQLite の本番向け設定（接続ごとに PRAGMA を適用する。SQLITE_PRODUCTION_PROFILE=false で無効化）
+SQLITE_PRODUCTION_PROFILE = os.getenv("SQLITE_PRODUCTION_PROFILE", "true").lower() == "true"
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # 負の値は KiB 単位（64MB）
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# 読み取り専用プールの接続数（GET エンドポイント用）
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", str(DB_POOL_SIZE)))
+
+# 読み取り用のURL（Postgres のレプリカなどを使う場合に指定。未指定なら書き込みと同じDB）
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+
+
+def _apply_sqlite_pragmas(dbapi_connection, read_only: bool = False):
+    """SQLite 接続に本番向けの PRAGMA を設定する
+
+    WAL モードでは読み取りが書き込みをブロックしないため、CSV 取り込み中も地図の表示が止まらない。
+    journal_mode はデータベースファイルに保存されるので、書き込み側の接続でのみ設定する。
+    """
+    if not SQLITE_PRODUCTION_PROFILE:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        if not read_only:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+
+# SQLAlchemyエンジンを作成（スクリプトや管理作業用の同期エンジン）
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False}  # SQLite用の設定
+    connect_args={"check_same_thread": False} if IS_SQLITE else {}  # SQLite用の設定
 )
 
 # セッションファクトリーを作成
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# APIエンドポイント用の非同期エンジン（書き込み用）
+# SQLite は同時に1つしか書き込めないため、書き込み用の接続は1本にしてロック待ちをプール側で直列化する
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=1 if IS_SQLITE else DB_POOL_SIZE,
+    max_overflow=0 if IS_SQLITE else DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+)
+
+# 読み取り専用の非同期エンジン（GET エンドポイント用）
+if IS_SQLITE or DATABASE_READ_URL:
+    read_engine = create_async_engine(
+        DATABASE_READ_URL or ASYNC_DATABASE_URL,
+        pool_size=DB_READ_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+else:
+    read_engine = async_engine
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _on_write_connect(dbapi_connection, connection_record):
+        _apply_sqlite_pragmas(dbapi_connection)
+
+    @event.listens_for(read_engine.sync_engine, "connect")
+    def _on_read_connect(dbapi_connection, connection_record):
+        _apply_sqlite_pragmas(dbapi_connection, read_only=True)
+
+# クエリの実行時間を記録する（operation は SELECT / INSERT / UPDATE / DELETE / OTHER）
+QUERY_OPERATIONS = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+def _track_query_duration(sync_engine, engine_label: str):
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is None:
+            return
+        operation = statement.lstrip()[:6].upper()
+        db_query_duration.observe(
+            time.perf_counter() - started,
+            engine=engine_label,
+            operation=operation if operation in QUERY_OPERATIONS else "OTHER",
+        )
+
+_track_query_duration(async_engine.sync_engine, "write")
+if read_engine is not async_engine:
+    _track_query_duration(read_engine.sync_engine, "read")
+
+# 非同期セッションファクトリーを作成（コミット後も属性を参照できるよう expire_on_commit=False）
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(read_engine, autoflush=False, expire_on_commit=False)
+
 # ベースクラスを作成
 Base = declarative_base()
 
@@ -32,6 +154,9 @@ class Spot(Base):
     plan = Column(String(100), nullable=True, index=True)
     image_url = Column(String(500), nullable=True)
     visit_duration = Column(Integer, nullable=True)  # 訪問時間（分）
+    opening_hours = Column(JSON, nullable=True)  # 営業時間（曜日 -> "9:00-17:00" など）
+    category = Column(String(100), nullable=True)  # カテゴリ（公園・自然、文化施設 など）
+    rating = Column(Float, nullable=True)  # 評価（0〜5）
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -44,20 +169,62 @@ class CSVUpload(Base):
     upload_date = Column(DateTime, default=datetime.utcnow)
     spot_count = Column(Integer, nullable=True)
     success = Column(Boolean, default=True)
+    # バックグラウンドの取り込みジョブ（queued / running / completed / failed / cancelled。NULL は従来の同期取り込み）
+    status = Column(String(20), nullable=True)
+    total_rows = Column(Integer, nullable=True)
+    processed_rows = Column(Integer, nullable=True)
+    duplicate_count = Column(Integer, nullable=True)
+    error_count = Column(Integer, nullable=True)
+    errors = Column(JSON, nullable=True)  # 行ごとのエラー（"行 N: ..." のリスト。件数は IMPORT_JOB_MAX_STORED_ERRORS まで）
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+def add_missing_columns(connection) -> list:
+    """モデルに追加されたカラムのうち、既存のテーブルにないものを ALTER TABLE で追加する
+
+    create_all は既存のテーブルを変更しないため、後から追加した NULL 許容のカラムはここで反映する。
+    追加したカラム名（テーブル名.カラム名）のリストを返す。
+    """
+    inspector = inspect(connection)
+    existing_tables = set(inspector.get_table_names())
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}')
+            added.append(f"{table.name}.{column.name}")
+    return added
 
 # データベーステーブルを作成
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+async def create_tables():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(add_missing_columns)
+    if added:
+        logger.info("カラムを追加しました: %s", ", ".join(added))
 
 # データベースセッションを取得
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# 読み取り専用のデータベースセッションを取得（GET エンドポイント用）
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # データベース初期化
-def init_db():
-    create_tables()
-    print("データベースが初期化されました。")
+async def init_db():
+    await create_tables()
+    logger.info("データベースが初期化されました。")
+
+# データベース接続を閉じる
+async def close_db():
+    if read_engine is not async_engine:
+        await read_engine.dispose()
+    await async_engine.dispose()
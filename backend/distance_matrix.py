@@ -0,0 +1,99 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # 地球の半径（km）— main.calculate_distance と同じ値
+
+# 移動手段ごとの速度（km/h）— main.calculate_travel_time と同じ値
+TRAVEL_SPEEDS_KMH = {
+    "walking": 4,
+    "cycling": 15,
+    "driving": 30,
+}
+DEFAULT_TRAVEL_SPEED_KMH = 4
+
+# 中間配列のメモリを抑えるため、出発地をこの行数ごとに分割して計算する
+CHUNK_ROWS = 1024
+
+
+def _to_radians(points: Sequence[Sequence[float]]) -> np.ndarray:
+    """[[lat, lng], ...] をラジアンの (n, 2) 配列に変換"""
+    array = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return np.radians(array)
+
+
+def haversine_matrix(
+    origins: Sequence[Sequence[float]],
+    destinations: Optional[Sequence[Sequence[float]]] = None,
+    dtype=np.float64,
+) -> np.ndarray:
+    """多対多のハヴァサイン距離行列（km）を一括で計算する
+
+    origins / destinations は [[lat, lng], ...]。destinations を省略すると
+    origins 同士の正方行列を返す。dtype=np.float32 を指定すると出力のメモリが半分になる。
+    """
+    origin_rad = _to_radians(origins)
+    dest_rad = origin_rad if destinations is None else _to_radians(destinations)
+
+    dest_lat = dest_rad[:, 0].astype(dtype)
+    dest_lon = dest_rad[:, 1].astype(dtype)
+    cos_dest_lat = np.cos(dest_lat)
+
+    result = np.empty((len(origin_rad), len(dest_rad)), dtype=dtype)
+    for start in range(0, len(origin_rad), CHUNK_ROWS):
+        chunk = origin_rad[start:start + CHUNK_ROWS].astype(dtype)
+        lat = chunk[:, 0:1]
+        lon = chunk[:, 1:2]
+        sin_dlat = np.sin((dest_lat - lat) / 2)
+        sin_dlon = np.sin((dest_lon - lon) / 2)
+        a = sin_dlat * sin_dlat + np.cos(lat) * cos_dest_lat * sin_dlon * sin_dlon
+        np.clip(a, 0, 1, out=a)
+        result[start:start + CHUNK_ROWS] = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+    return result
+
+
+def travel_time_matrix(distances: np.ndarray, transport_mode: str) -> np.ndarray:
+    """距離行列（km）から移動時間行列（分、整数）を計算する"""
+    speed = TRAVEL_SPEEDS_KMH.get(transport_mode, DEFAULT_TRAVEL_SPEED_KMH)
+    return (distances * (60 / speed)).astype(np.int32)
+
+
+if __name__ == "__main__":
+    # スカラー版（main.calculate_distance と同じ式）とのベンチマーク
+    import math
+    import time
+
+    def calculate_distance(lat1, lon1, lat2, lon2):
+        lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(math.radians, (lat1, lon1, lat2, lon2))
+        a = math.sin((lat2_rad - lat1_rad) / 2) ** 2 + \
+            math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin((lon2_rad - lon1_rad) / 2) ** 2
+        return EARTH_RADIUS_KM * 2 * math.asin(math.sqrt(a))
+
+    rng = np.random.default_rng(0)
+    for n in (100, 1000, 5000):
+        points = np.column_stack([
+            35.70 + rng.random(n) * 0.10,
+            139.55 + rng.random(n) * 0.15,
+        ]).tolist()
+
+        started = time.perf_counter()
+        vectorised = haversine_matrix(points)
+        vector_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        vectorised32 = haversine_matrix(points, dtype=np.float32)
+        vector32_seconds = time.perf_counter() - started
+
+        # スカラー版は大きい n では時間がかかるため、先頭の行だけ計測して全体を推定する
+        sample_rows = min(n, 100)
+        started = time.perf_counter()
+        scalar = [[calculate_distance(a[0], a[1], b[0], b[1]) for b in points] for a in points[:sample_rows]]
+        scalar_seconds = (time.perf_counter() - started) * n / sample_rows
+
+        max_error = float(np.max(np.abs(vectorised[:sample_rows] - np.array(scalar))))
+        max_error32 = float(np.max(np.abs(vectorised32[:sample_rows] - np.array(scalar))))
+        print(
+            f"n={n:5d}  scalar={scalar_seconds * 1000:9.1f}ms"
+            f"  numpy64={vector_seconds * 1000:8.1f}ms ({vectorised.nbytes / 1e6:.1f}MB, err={max_error:.1e})"
+            f"  numpy32={vector32_seconds * 1000:8.1f}ms ({vectorised32.nbytes / 1e6:.1f}MB, err={max_error32:.1e})"
+        )
@@ -0,0 +1,387 @@
+import array
+import csv
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from address_normalizer import convert_kanji_numerals, normalize_address
+from csv_import import open_csv_stream
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# 起動時に読み込むバイナリファイル。存在しない（またはソースより古い）場合は GAZETTEER_SOURCES から作成する
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "./gazetteer.bin")
+
+# 作成元の CSV（位置参照情報の大字・町丁目 CSV と、別名（施設名など）の CSV。カンマ区切りで複数指定可）
+GAZETTEER_SOURCES = os.getenv(
+    "GAZETTEER_SOURCES",
+    ",".join([os.path.join(DATA_DIR, "gazetteer_towns.csv"), os.path.join(DATA_DIR, "gazetteer_aliases.csv")]),
+)
+
+MAGIC = b"NWGZ"
+VERSION = 1
+_HEADER = struct.Struct("<4sHHIIII")  # magic, version, 予約, ノード数, 辺数, 項目数, 名前のバイト数
+
+# 精度（数値が大きいほど詳細）
+LEVELS = ("town", "chome", "landmark")
+
+_CHOME = re.compile(r"(\d+)丁目")
+
+
+@dataclass
+class GazetteerMatch:
+    """住所に一致した地名（key は一致した部分、level は town / chome / landmark）"""
+    key: str
+    latitude: float
+    longitude: float
+    level: str
+
+
+def canonical_address(address: str) -> str:
+    """照合用の表記（正規化・漢数字の変換をし、「6丁目」を「6-」、空白を除去）"""
+    text = convert_kanji_numerals(normalize_address(address))
+    return _CHOME.sub(r"\1-", text).replace(" ", "")
+
+
+# 作成
+def _read_csv(path: str) -> Iterable[Dict[str, str]]:
+    with open(path, "rb") as binary:
+        text, _ = open_csv_stream(binary)
+        yield from csv.DictReader(text)
+
+
+def collect_entries(
+    town_csvs: Sequence[str] = (),
+    alias_csvs: Sequence[str] = (),
+) -> Dict[str, Tuple[float, float, str]]:
+    """位置参照情報の大字・町丁目 CSV と別名 CSV から 照合キー -> (緯度, 経度, 精度) を作る
+
+    大字・町丁目 CSV は国土交通省「位置参照情報」の形式（市区町村名, 大字町丁目名, 緯度, 経度 の列を使う）。
+    キーは「練馬区豊玉北6」（丁目）と「練馬区豊玉北」（町。丁目の代表点の平均）で、
+    区をまたいで同じ名前がない町は区を省いた「豊玉北6」「豊玉北」でも引けるようにする。
+    別名 CSV は name, latitude, longitude の列を持ち、施設名などをそのまま登録する。
+    """
+    chome: Dict[Tuple[str, str, int], Tuple[float, float]] = {}
+    towns: Dict[Tuple[str, str], Tuple[float, float]] = {}
+    for path in town_csvs:
+        for row in _read_csv(path):
+            city = normalize_address(row.get("市区町村名") or "")
+            name = canonical_address(row.get("大字町丁目名") or "").rstrip("-")
+            try:
+                point = (float(row["緯度"]), float(row["経度"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if not city or not name:
+                continue
+            match = re.match(r"^(.*?)(\d+)$", name)
+            if match and match.group(1):
+                chome.setdefault((city, match.group(1), int(match.group(2))), point)
+            else:
+                towns.setdefault((city, name), point)
+
+    # 丁目の代表点の平均を町の代表点にする（町そのものの行がある場合はそちらを使う）
+    sums: Dict[Tuple[str, str], List[float]] = {}
+    for (city, town, _), (lat, lon) in chome.items():
+        total = sums.setdefault((city, town), [0.0, 0.0, 0])
+        total[0] += lat
+        total[1] += lon
+        total[2] += 1
+    for key, (lat, lon, count) in sums.items():
+        towns.setdefault(key, (lat / count, lon / count))
+
+    # 区を省いた名前が一意かどうか
+    cities_by_town: Dict[str, set] = {}
+    for city, town in towns:
+        cities_by_town.setdefault(town, set()).add(city)
+
+    entries: Dict[str, Tuple[float, float, str]] = {}
+    for (city, town), (lat, lon) in towns.items():
+        entries[city + town] = (lat, lon, "town")
+        if len(cities_by_town[town]) == 1:
+            entries.setdefault(town, (lat, lon, "town"))
+    for (city, town, number), (lat, lon) in chome.items():
+        entries[f"{city}{town}{number}"] = (lat, lon, "chome")
+        if len(cities_by_town[town]) == 1:
+            entries.setdefault(f"{town}{number}", (lat, lon, "chome"))
+
+    for path in alias_csvs:
+        for row in _read_csv(path):
+            name = canonical_address(row.get("name") or "")
+            try:
+                point = (float(row["latitude"]), float(row["longitude"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if name:
+                entries[name] = (*point, "landmark")
+    return entries
+
+
+def write_gazetteer(path: str, entries: Dict[str, Tuple[float, float, str]]) -> None:
+    """照合キーのトライ木と座標をバイナリファイルに書き出す（一時ファイルに書いてから置き換える）
+
+    ノードごとの子の範囲（CSR）、子への辺の文字コード（ノード内で昇順）と行き先、
+    各ノードの項目番号、項目の座標・精度・名前を、それぞれ8バイト境界に揃えて並べる。
+    """
+    keys = sorted(entries)
+    trie: List[Dict[str, int]] = [{}]
+    values = [-1]
+    for index, key in enumerate(keys):
+        node = 0
+        for char in key:
+            child = trie[node].get(char)
+            if child is None:
+                child = len(trie)
+                trie[node][char] = child
+                trie.append({})
+                values.append(-1)
+            node = child
+        values[node] = index
+
+    edge_start = array.array("I", [0])
+    edge_char = array.array("I")
+    edge_child = array.array("I")
+    for children in trie:
+        for char in sorted(children):
+            edge_char.append(ord(char))
+            edge_child.append(children[char])
+        edge_start.append(len(edge_char))
+
+    names = bytearray()
+    name_offset = array.array("I", [0])
+    for key in keys:
+        names += key.encode("utf-8")
+        name_offset.append(len(names))
+
+    sections = [
+        edge_start,
+        array.array("i", values),
+        edge_char,
+        edge_child,
+        array.array("d", [entries[key][0] for key in keys]),
+        array.array("d", [entries[key][1] for key in keys]),
+        name_offset,
+        array.array("B", [LEVELS.index(entries[key][2]) for key in keys]),
+    ]
+    if sys.byteorder != "little":
+        for section in sections:
+            section.byteswap()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as output:
+        output.write(_HEADER.pack(MAGIC, VERSION, 0, len(trie), len(edge_char), len(keys), len(names)))
+        for section in sections:
+            output.write(section.tobytes())
+            output.write(b"\0" * (-output.tell() % 8))
+        output.write(names)
+    os.replace(tmp_path, path)
+
+
+# 読み込み・検索
+class Gazetteer:
+    """メモリマップしたバイナリファイル上のトライ木で住所中の地名を最長一致で探す"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        magic, version, _, nodes, edges, count, names_size = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"地名辞書のファイル形式が正しくありません: {path}")
+        self.entry_count = count
+        self._offset = _HEADER.size
+        self._views: List[memoryview] = []
+        self.edge_start = self._section("I", nodes + 1)
+        self.node_value = self._section("i", nodes)
+        self.edge_char = self._section("I", edges)
+        self.edge_child = self._section("I", edges)
+        self.latitudes = self._section("d", count)
+        self.longitudes = self._section("d", count)
+        self.name_offset = self._section("I", count + 1)
+        self.levels = self._section("B", count)
+        self.names = self._view[self._offset:self._offset + names_size]
+        self._views.append(self.names)
+        self.node_count = nodes
+        self.edge_count = edges
+
+    def _section(self, fmt: str, count: int):
+        size = struct.calcsize(fmt) * count
+        raw = self._view[self._offset:self._offset + size]
+        self._offset += size + (-size % 8)
+        if sys.byteorder != "little" and fmt != "B":
+            values = array.array(fmt, raw.tobytes())
+            values.byteswap()
+            raw.release()
+            return values
+        view = raw.cast(fmt)
+        self._views += [raw, view]
+        return view
+
+    def close(self) -> None:
+        for view in reversed(getattr(self, "_views", [])):
+            view.release()
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def _entry(self, index: int) -> Tuple[str, float, float, str]:
+        name = bytes(self.names[self.name_offset[index]:self.name_offset[index + 1]]).decode("utf-8")
+        return name, self.latitudes[index], self.longitudes[index], LEVELS[self.levels[index]]
+
+    def match_canonical(self, text: str) -> Optional[GazetteerMatch]:
+        """照合用の表記の中で最も長く一致する地名（数字で終わる地名は直後が数字でない場合のみ一致）"""
+        edge_start = self.edge_start
+        edge_char = self.edge_char
+        edge_child = self.edge_child
+        node_value = self.node_value
+        root_lo, root_hi = edge_start[0], edge_start[1]
+        length = len(text)
+        best_index = -1
+        best_length = 0
+        for start in range(length):
+            if length - start <= best_length:
+                break
+            node = 0
+            lo, hi = root_lo, root_hi
+            for position in range(start, length):
+                code = ord(text[position])
+                edge = bisect_left(edge_char, code, lo, hi)
+                if edge == hi or edge_char[edge] != code:
+                    break
+                node = edge_child[edge]
+                lo, hi = edge_start[node], edge_start[node + 1]
+                value = node_value[node]
+                if value >= 0 and position + 1 - start > best_length:
+                    if not (text[position].isdigit() and position + 1 < length and text[position + 1].isdigit()):
+                        best_index = value
+                        best_length = position + 1 - start
+        if best_index < 0:
+            return None
+        return GazetteerMatch(*self._entry(best_index))
+
+    def lookup(self, address: str) -> Optional[GazetteerMatch]:
+        """住所に含まれる最も詳細な地名の座標"""
+        return self.match_canonical(canonical_address(address))
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "entries": self.entry_count,
+            "trie_nodes": self.node_count,
+            "file_bytes": len(self._mmap),
+        }
+
+
+class GazetteerHolder:
+    """アプリ全体で共有する地名辞書（最初の検索時、または起動時に読み込む）"""
+
+    def __init__(self, path: str = GAZETTEER_PATH, sources: str = GAZETTEER_SOURCES):
+        self.path = path
+        self.sources = [source for source in sources.split(",") if source]
+        self.gazetteer: Optional[Gazetteer] = None
+        self._lock = threading.Lock()
+
+    def _needs_build(self) -> bool:
+        if not os.path.exists(self.path):
+            return True
+        built = os.path.getmtime(self.path)
+        return any(os.path.exists(source) and os.path.getmtime(source) > built for source in self.sources)
+
+    def load(self) -> Gazetteer:
+        """ファイルを読み込む（ソースの CSV の方が新しい場合は作り直す）"""
+        with self._lock:
+            if self._needs_build():
+                towns = [source for source in self.sources if not source.endswith("aliases.csv")]
+                aliases = [source for source in self.sources if source.endswith("aliases.csv")]
+                write_gazetteer(self.path, collect_entries(
+                    [source for source in towns if os.path.exists(source)],
+                    [source for source in aliases if os.path.exists(source)],
+                ))
+            previous = self.gazetteer
+            self.gazetteer = Gazetteer(self.path)
+        if previous is not None:
+            previous.close()
+        return self.gazetteer
+
+    def lookup(self, address: str) -> Optional[GazetteerMatch]:
+        gazetteer = self.gazetteer or self.load()
+        return gazetteer.lookup(address)
+
+    def stats(self) -> dict:
+        gazetteer = self.gazetteer
+        if gazetteer is None:
+            return {"loaded": False}
+        return {"loaded": True, **gazetteer.stats()}
+
+
+gazetteer = GazetteerHolder()
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    if len(sys.argv) >= 3 and sys.argv[1] == "build":
+        # python gazetteer.py build 出力.bin 大字町丁目.csv ... [--aliases 別名.csv ...]
+        args = sys.argv[3:]
+        towns = args[:args.index("--aliases")] if "--aliases" in args else args
+        aliases = args[args.index("--aliases") + 1:] if "--aliases" in args else []
+        started = time.perf_counter()
+        entries = collect_entries(towns, aliases)
+        write_gazetteer(sys.argv[2], entries)
+        built = Gazetteer(sys.argv[2])
+        print(f"built {sys.argv[2]} in {time.perf_counter() - started:.2f}s: {built.stats()}")
+        built.close()
+        sys.exit(0)
+
+    # 合成データ（23区 x 60町 x 5丁目 = 6,900 丁目）での読み込み・検索のベンチマーク
+    import random
+
+    random.seed(0)
+    kanji = "一二三四五"
+    syllables = "あいうえおかきくけこさしすせそたちつてとなにぬねの光石神井豊玉北南東西台町丘原沢田谷"
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "towns.csv")
+        addresses = []
+        with open(source, "w", encoding="cp932", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(["都道府県コード", "都道府県名", "市区町村コード", "市区町村名", "大字町丁目コード",
+                             "大字町丁目名", "緯度", "経度", "原典資料コード", "大字・字・丁目区分コード"])
+            for ward in range(23):
+                city = f"第{ward + 1}区"
+                for town_number in range(60):
+                    town = "".join(random.choice(syllables) for _ in range(3))
+                    for chome in range(5):
+                        writer.writerow(["13", "東京都", f"131{ward:02d}", city, f"{town_number:06d}",
+                                         f"{town}{kanji[chome]}丁目", 35.6 + random.random() * 0.2,
+                                         139.5 + random.random() * 0.3, "1", "3"])
+                        addresses.append(f"東京都{city}{town}{chome + 1}丁目{random.randint(1, 30)}-{random.randint(1, 20)}")
+
+        started = time.perf_counter()
+        entries = collect_entries([source])
+        path = os.path.join(tmp, "gazetteer.bin")
+        write_gazetteer(path, entries)
+        print(f"build: {(time.perf_counter() - started) * 1000:.0f}ms  {len(entries)} keys  {os.path.getsize(path) / 1024:.0f}KB")
+
+        started = time.perf_counter()
+        loaded = Gazetteer(path)
+        print(f"load (mmap): {(time.perf_counter() - started) * 1e6:.0f}us")
+
+        canonical = [canonical_address(address) for address in addresses]
+        started = time.perf_counter()
+        matches = [loaded.match_canonical(text) for text in canonical]
+        elapsed = time.perf_counter() - started
+        resolved = sum(1 for match in matches if match is not None and match.level == "chome")
+        print(f"lookup: {elapsed / len(canonical) * 1e6:.1f}us/address  chome-level {resolved}/{len(canonical)}")
+        started = time.perf_counter()
+        for address in addresses:
+            loaded.lookup(address)
+        print(f"lookup incl. normalisation: {(time.perf_counter() - started) / len(addresses) * 1e6:.1f}us/address")
+        loaded.close()
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+# ジオコーディングキャッシュの保存先（database.db と同じディレクトリ）
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "./geocode_cache.db")
+
+# 成功結果の有効期間（秒）: デフォルト30日
+GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600)))
+
+# 取得失敗（ネガティブキャッシュ）の有効期間（秒）: デフォルト1日
+GEOCODE_CACHE_NEGATIVE_TTL = int(os.getenv("GEOCODE_CACHE_NEGATIVE_TTL", str(24 * 3600)))
+
+
+class GeocodeCache:
+    """正規化済み住所をキーにした永続ジオコーディングキャッシュ（SQLite）"""
+
+    def __init__(self, path: str = GEOCODE_CACHE_PATH,
+                 ttl: int = GEOCODE_CACHE_TTL,
+                 negative_ttl: int = GEOCODE_CACHE_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocode_cache (
+                address TEXT PRIMARY KEY,
+                latitude REAL,
+                longitude REAL,
+                provider TEXT,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, address: str) -> Optional[Tuple[Optional[float], Optional[float], Optional[str]]]:
+        """キャッシュを参照する。
+
+        未登録・期限切れの場合は None、ネガティブキャッシュの場合は (None, None, provider) を返す。
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT latitude, longitude, provider, expires_at FROM geocode_cache WHERE address = ?",
+                (address,)
+            ).fetchone()
+            if row is None or row[3] < now:
+                self.misses += 1
+                return None
+            if row[0] is None or row[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return row[0], row[1], row[2]
+
+    def set(self, address: str, lat: Optional[float], lon: Optional[float], provider: Optional[str]) -> None:
+        """結果を保存する（lat/lon が None の場合はネガティブキャッシュ）"""
+        now = time.time()
+        ttl = self.ttl if lat is not None and lon is not None else self.negative_ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode_cache "
+                "(address, latitude, longitude, provider, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (address, lat, lon, provider, now, now + ttl)
+            )
+            self._conn.commit()
+
+    async def aset(self, address: str, lat: Optional[float], lon: Optional[float], provider: Optional[str]) -> None:
+        """set の async 版（SQLite への書き込みと commit をスレッドで行い、イベントループを止めない）"""
+        await asyncio.to_thread(self.set, address, lat, lon, provider)
+
+    def purge_expired(self) -> int:
+        """期限切れのエントリを削除し、削除件数を返す"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM geocode_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        """キャッシュのヒット・ミス数とプロバイダ別件数を返す"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT COALESCE(provider, 'none'), COUNT(*) FROM geocode_cache GROUP BY provider"
+            ).fetchall()
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            "entries_by_provider": {provider: count for provider, count in rows},
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# アプリ全体で共有するキャッシュインスタンス
+geocode_cache = GeocodeCache()
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Coordinates = Tuple[Optional[float], Optional[float]]
+
+
+class ProviderLimiter:
+    """プロバイダごとの同時実行数とリクエストレートを制限する"""
+
+    def __init__(self, concurrency: int, rate_per_second: float):
+        self.concurrency = max(1, concurrency)
+        self.rate_per_second = rate_per_second
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._rate_lock = asyncio.Lock()
+        self._next_slot = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await self._wait_for_slot()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+    async def _wait_for_slot(self):
+        if self.rate_per_second <= 0:
+            return
+        interval = 1.0 / self.rate_per_second
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# プロバイダごとの制限（Nominatim の利用規約は 1リクエスト/秒）
+provider_limiters: Dict[str, ProviderLimiter] = {
+    "nominatim": ProviderLimiter(
+        concurrency=int(os.getenv("NOMINATIM_CONCURRENCY", "1")),
+        rate_per_second=float(os.getenv("NOMINATIM_RATE_PER_SECOND", "1")),
+    ),
+    "google": ProviderLimiter(
+        concurrency=int(os.getenv("GOOGLE_MAPS_CONCURRENCY", "10")),
+        rate_per_second=float(os.getenv("GOOGLE_MAPS_RATE_PER_SECOND", "25")),
+    ),
+}
+
+# パイプライン全体で同時に解決する住所数
+GEOCODE_PIPELINE_CONCURRENCY = int(os.getenv("GEOCODE_PIPELINE_CONCURRENCY", "8"))
+
+
+async def geocode_addresses(
+    addresses: Iterable[str],
+    resolver: Callable[[str], Awaitable[Coordinates]],
+    concurrency: int = GEOCODE_PIPELINE_CONCURRENCY,
+) -> Dict[str, Coordinates]:
+    """住所の集合を並行に解決し、住所 -> (緯度, 経度) の辞書を返す
+
+    同じ住所は一度だけ解決する。プロバイダごとの制限は resolver 側の
+    provider_limiters で掛かるため、ここでは全体の同時実行数だけを制御する。
+    """
+    unique_addresses = list(dict.fromkeys(addresses))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def resolve(address: str) -> Coordinates:
+        async with semaphore:
+            try:
+                return await resolver(address)
+            except Exception as e:
+                logger.warning("ジオコーディングパイプラインでエラー: '%s': %s", address, e)
+                return None, None
+
+    results = await asyncio.gather(*(resolve(address) for address in unique_addresses))
+    return dict(zip(unique_addresses, results))
+
+
+# ヘッジ付き並行解決の設定
+GEOCODE_HEDGE_STAGGER = float(os.getenv("GEOCODE_HEDGE_STAGGER", "0.2"))
+GEOCODE_BUDGET_SECONDS = float(os.getenv("GEOCODE_BUDGET_SECONDS", "10"))
+GEOCODE_MAX_VARIATIONS = int(os.getenv("GEOCODE_MAX_VARIATIONS", "6"))
+# 1つのプロバイダへ同時に問い合わせる住所パターンの数（プロバイダの同時実行数の上限を超えない）
+GEOCODE_FANOUT_VARIATIONS = int(os.getenv("GEOCODE_FANOUT_VARIATIONS", "3"))
+
+# (プロバイダ名, 制限（無ければ None）, 住所 -> 座標 の関数)
+HedgedProvider = Tuple[str, Optional[ProviderLimiter], Callable[[str], Awaitable[Coordinates]]]
+
+
+async def resolve_hedged(
+    addresses: List[str],
+    providers: List[HedgedProvider],
+    stagger: float = GEOCODE_HEDGE_STAGGER,
+    budget_seconds: float = GEOCODE_BUDGET_SECONDS,
+    fanout: int = GEOCODE_FANOUT_VARIATIONS,
+) -> Optional[Tuple[float, float, str, str]]:
+    """具体的な住所パターンを複数のプロバイダへ並行に問い合わせ、優先度が最上位の成功結果を返す
+
+    addresses は住所パターン、providers はプロバイダを、それぞれ優先度の高い順に並べたもの。
+    各プロバイダには上位の住所パターンから min(fanout, 制限の同時実行数) 件ずつ並行に問い合わせ、
+    1件終わるごとに次のパターンを開始する。Nominatim のように同時実行数が1のプロバイダは
+    1件ずつ順に試すことになり、制限の待ち行列に同じ住所の問い合わせを積まない。
+    i 番目のプロバイダは i * stagger 秒後に開始する。優先度は（住所パターンの順位, プロバイダの順位）で、
+    「より優先度の高い試行がすべて失敗した上で成功した最上位の試行」を採用するため、
+    応答の速さに関係なく同じ入力には同じ結果を返す。採用が決まった時点で残りは取り消す。
+    予算時間はプロバイダごとに、問い合わせ中（制限の枠を得てから応答まで）の時間だけを数え、
+    他の住所の問い合わせで枠を待つ時間は含めない。各問い合わせは開始時点の残り予算で打ち切り、
+    予算を使い切ったプロバイダはそこで止める。その場合は完了している成功結果のうち最上位を返し、
+    成功結果が無ければ asyncio.TimeoutError を送出する。
+    戻り値は (緯度, 経度, プロバイダ名, 住所)、全て失敗した場合は None。
+    """
+    if not addresses or not providers:
+        return None
+
+    loop = asyncio.get_running_loop()
+    # (住所の順位, プロバイダの順位) -> 座標（失敗は (None, None)）
+    results: Dict[Tuple[int, int], Coordinates] = {}
+    timed_out: List[str] = []
+    progress = asyncio.Event()
+
+    def best_success() -> Optional[Tuple[int, int]]:
+        successes = [rank for rank, (lat, lon) in results.items() if lat is not None and lon is not None]
+        return min(successes) if successes else None
+
+    def superseded(rank: Tuple[int, int]) -> bool:
+        best = best_success()
+        return best is not None and best < rank
+
+    def decided_winner() -> Optional[Tuple[int, int]]:
+        best = best_success()
+        if best is None:
+            return None
+        for variation_rank in range(best[0] + 1):
+            for provider_rank in range(len(providers)):
+                rank = (variation_rank, provider_rank)
+                if rank >= best:
+                    return best
+                if rank not in results:
+                    return None
+        return best
+
+    async def run(provider_rank: int) -> None:
+        provider, limiter, func = providers[provider_rank]
+        width = max(1, min(fanout, limiter.concurrency) if limiter is not None else fanout)
+        window = asyncio.Semaphore(width)
+        # 問い合わせ中の時間の合計（同時に問い合わせている時間は重ねて数えない）
+        spent = 0.0
+        active = 0
+        busy_since = 0.0
+        exhausted = False
+
+        async def call(address: str) -> Optional[Coordinates]:
+            nonlocal spent, active, busy_since
+            now = loop.time()
+            remaining = budget_seconds - spent - (now - busy_since if active else 0.0)
+            if not active:
+                busy_since = now
+            active += 1
+            try:
+                return await asyncio.wait_for(func(address), timeout=max(0.0, remaining))
+            except asyncio.TimeoutError:
+                return None
+            except Exception as e:
+                logger.warning("ジオコーディング試行でエラー: %s", e)
+                return None, None
+            finally:
+                active -= 1
+                if not active:
+                    spent += loop.time() - busy_since
+
+        async def attempt(rank: Tuple[int, int], address: str) -> None:
+            nonlocal exhausted
+            try:
+                if limiter is None:
+                    result = await call(address)
+                else:
+                    async with limiter:
+                        # 枠を待つ間に上位の試行が成功していれば問い合わせない
+                        if superseded(rank) or exhausted:
+                            return
+                        result = await call(address)
+                if result is None:
+                    exhausted = True
+                    if provider not in timed_out:
+                        timed_out.append(provider)
+                    return
+                results[rank] = result
+            finally:
+                window.release()
+                progress.set()
+
+        if provider_rank and stagger > 0:
+            await asyncio.sleep(provider_rank * stagger)
+        attempts = []
+        try:
+            for variation_rank, address in enumerate(addresses):
+                await window.acquire()
+                rank = (variation_rank, provider_rank)
+                if superseded(rank) or exhausted:
+                    window.release()
+                    break
+                attempts.append(asyncio.create_task(attempt(rank, address)))
+            await asyncio.gather(*attempts)
+        finally:
+            for task in attempts:
+                task.cancel()
+            if attempts:
+                await asyncio.gather(*attempts, return_exceptions=True)
+
+    def as_result(rank: Tuple[int, int]) -> Tuple[float, float, str, str]:
+        lat, lon = results[rank]
+        return lat, lon, providers[rank[1]][0], addresses[rank[0]]
+
+    lanes = [asyncio.create_task(run(provider_rank)) for provider_rank in range(len(providers))]
+    try:
+        while True:
+            # 結果が記録されるたび（プロバイダの処理が終わるのを待たず）に採用できるかを判定する
+            progress.clear()
+            winner = decided_winner()
+            if winner is not None:
+                return as_result(winner)
+            pending = {lane for lane in lanes if not lane.done()}
+            if not pending:
+                break
+            waiter = asyncio.ensure_future(progress.wait())
+            try:
+                await asyncio.wait(pending | {waiter}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+        for lane in lanes:
+            if not lane.cancelled() and lane.exception() is not None:
+                logger.warning("ジオコーディングでエラー: %s", lane.exception())
+        best = best_success()
+        if best is not None:
+            return as_result(best)
+        if timed_out:
+            raise asyncio.TimeoutError(
+                f"ジオコーディングの予算時間 {budget_seconds} 秒を超えました（{', '.join(timed_out)}）"
+            )
+        return None
+    finally:
+        pending = [lane for lane in lanes if not lane.done()]
+        for lane in pending:
+            lane.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,376 @@
+import heapq
+import math
+from typing import Iterable, List, Optional, Sequence
+
+import numpy as np
+
+# Web メルカトルでズーム0のときの赤道上の 1px あたりのメートル数（256px タイル）
+METERS_PER_PIXEL_Z0 = 156543.03392
+
+# 許容誤差（画面上のピクセル数）。これより小さいずれは地図上で見分けられない
+SIMPLIFY_PIXEL_TOLERANCE = 1.0
+
+EARTH_RADIUS_M = 6371000
+
+SIMPLIFY_ALGORITHMS = ("douglas-peucker", "visvalingam")
+GEOMETRY_FORMATS = ("geojson", "polyline", "delta")
+
+
+def tolerance_for_zoom(zoom: float, latitude: float, pixels: float = SIMPLIFY_PIXEL_TOLERANCE) -> float:
+    """ズームレベルでの許容誤差（メートル）"""
+    return pixels * METERS_PER_PIXEL_Z0 * math.cos(math.radians(latitude)) / (2 ** zoom)
+
+
+def _project(coords: np.ndarray) -> np.ndarray:
+    """[[lng, lat], ...] を中心緯度で正距円筒図法のメートル座標に変換する"""
+    lat0 = math.radians(float(coords[:, 1].mean()))
+    scale = math.pi * EARTH_RADIUS_M / 180
+    return np.column_stack([coords[:, 0] * scale * math.cos(lat0), coords[:, 1] * scale])
+
+
+# この頂点数未満の区間は numpy の呼び出しコストの方が大きいため Python のループで処理する
+DOUGLAS_PEUCKER_VECTOR_MIN = 64
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Douglas-Peucker 法で残す頂点の真偽値マスクを返す（points はメートル座標）
+
+    距離は区間の両端を結ぶ直線への垂線の長さ。割り算を避けるため、外積 |AP×AB| を
+    tolerance·|AB| と比較する。
+    """
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    xs = points[:, 0].tolist()
+    ys = points[:, 1].tolist()
+    tolerance_sq = tolerance * tolerance
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        ax, ay = xs[start], ys[start]
+        dx, dy = xs[end] - ax, ys[end] - ay
+        length_sq = dx * dx + dy * dy
+        if length_sq == 0.0:
+            # 両端が同じ点（周回する区間）の場合は端点からの距離
+            segment = points[start + 1:end]
+            distances_sq = (segment[:, 0] - ax) ** 2 + (segment[:, 1] - ay) ** 2
+            index = int(np.argmax(distances_sq))
+            farthest_sq = float(distances_sq[index])
+            threshold = tolerance_sq
+        elif end - start >= DOUGLAS_PEUCKER_VECTOR_MIN:
+            segment = points[start + 1:end]
+            cross = np.abs((segment[:, 0] - ax) * dy - (segment[:, 1] - ay) * dx)
+            index = int(np.argmax(cross))
+            farthest_sq = float(cross[index]) ** 2
+            threshold = tolerance_sq * length_sq
+        else:
+            farthest = -1.0
+            index = 0
+            for i in range(start + 1, end):
+                cross = (xs[i] - ax) * dy - (ys[i] - ay) * dx
+                if cross < 0:
+                    cross = -cross
+                if cross > farthest:
+                    farthest = cross
+                    index = i - start - 1
+            farthest_sq = farthest * farthest
+            threshold = tolerance_sq * length_sq
+        if farthest_sq > threshold:
+            split = start + 1 + index
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return keep
+
+
+def visvalingam(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """Visvalingam-Whyatt 法で残す頂点の真偽値マスクを返す
+
+    隣接する2点と作る三角形の面積が tolerance² 未満の頂点を、面積の小さい順に取り除く。
+    """
+    n = len(points)
+    keep = [True] * n
+    if n <= 2:
+        return np.ones(n, dtype=bool)
+    min_area = tolerance * tolerance
+    xs = points[:, 0].tolist()
+    ys = points[:, 1].tolist()
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+
+    def area(i: int) -> float:
+        a, c = prev[i], nxt[i]
+        ax, ay = xs[a], ys[a]
+        return abs((xs[i] - ax) * (ys[c] - ay) - (xs[c] - ax) * (ys[i] - ay)) / 2
+
+    areas = [0.0] * n
+    heap = []
+    for i in range(1, n - 1):
+        areas[i] = area(i)
+        heap.append((areas[i], i))
+    heapq.heapify(heap)
+
+    while heap:
+        current, i = heapq.heappop(heap)
+        if not keep[i] or current != areas[i]:
+            continue  # 削除済み、または面積が更新された古いエントリ
+        if current >= min_area:
+            break
+        keep[i] = False
+        left, right = prev[i], nxt[i]
+        nxt[left] = right
+        prev[right] = left
+        # 両隣の面積を更新（削除した頂点の面積より小さくしないことで、順序を保つ）
+        for j in (left, right):
+            if 0 < j < n - 1:
+                areas[j] = max(area(j), current)
+                heapq.heappush(heap, (areas[j], j))
+    return np.array(keep, dtype=bool)
+
+
+def simplify_mask(
+    coords: Sequence[Sequence[float]],
+    tolerance: float,
+    algorithm: str = "douglas-peucker",
+    anchors: Iterable[int] = (),
+) -> np.ndarray:
+    """[[lng, lat], ...] の線を tolerance（メートル）で単純化したときに残す頂点の真偽値マスク
+
+    anchors の頂点（経由地や案内の区切りなど）は必ず残す。アンカーで区切った区間ごとに
+    単純化するため、区間の中でも許容誤差は保たれる。
+    """
+    n = len(coords)
+    if n <= 2 or tolerance <= 0:
+        return np.ones(n, dtype=bool)
+    points = _project(np.asarray(coords, dtype=np.float64)[:, :2])
+    simplify = visvalingam if algorithm == "visvalingam" else douglas_peucker
+    bounds = sorted({0, n - 1} | {index for index in anchors if 0 < index < n - 1})
+    keep = np.zeros(n, dtype=bool)
+    for start, end in zip(bounds, bounds[1:]):
+        keep[start:end + 1] |= simplify(points[start:end + 1], tolerance)
+    return keep
+
+
+def simplify_coordinates(
+    coords: Sequence[Sequence[float]],
+    tolerance: float,
+    algorithm: str = "douglas-peucker",
+    anchors: Iterable[int] = (),
+) -> List[List[float]]:
+    """[[lng, lat], ...] の線を tolerance（メートル）で単純化する（anchors の頂点は必ず残す）"""
+    if len(coords) <= 2 or tolerance <= 0:
+        return [list(point) for point in coords]
+    keep = simplify_mask(coords, tolerance, algorithm, anchors)
+    return np.asarray(coords, dtype=np.float64)[:, :2][keep].tolist()
+
+
+def encode_polyline(coords: Sequence[Sequence[float]], precision: int = 5) -> str:
+    """[[lng, lat], ...] を Google のエンコード済みポリライン（緯度・経度の順）に変換する"""
+    factor = 10 ** precision
+    output = []
+    prev_lat = prev_lng = 0
+    for lng, lat in ((point[0], point[1]) for point in coords):
+        lat_int = int(round(lat * factor))
+        lng_int = int(round(lng * factor))
+        for value in (lat_int - prev_lat, lng_int - prev_lng):
+            value = ~(value << 1) if value < 0 else value << 1
+            while value >= 0x20:
+                output.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            output.append(chr(value + 63))
+        prev_lat, prev_lng = lat_int, lng_int
+    return "".join(output)
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> List[List[float]]:
+    """エンコード済みポリラインを [[lng, lat], ...] に戻す"""
+    factor = 10 ** precision
+    coords = []
+    index = lat = lng = 0
+    while index < len(encoded):
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        coords.append([lng / factor, lat / factor])
+    return coords
+
+
+def delta_encode(coords: Sequence[Sequence[float]], precision: int = 5) -> List[int]:
+    """[[lng, lat], ...] を整数化し、先頭以外を前の点との差分にした平坦な配列 [lng0, lat0, dlng1, dlat1, ...] にする"""
+    if not len(coords):
+        return []
+    scaled = np.rint(np.asarray(coords, dtype=np.float64)[:, :2] * 10 ** precision).astype(np.int64)
+    scaled[1:] = np.diff(scaled, axis=0)
+    return scaled.ravel().tolist()
+
+
+def _line_parts(geometry: dict) -> Optional[List[list]]:
+    if geometry.get("type") == "LineString":
+        return [geometry["coordinates"]]
+    if geometry.get("type") == "MultiLineString":
+        return geometry["coordinates"]
+    return None
+
+
+def _vertex_references(properties: dict) -> List[list]:
+    """ORS のプロパティのうち、頂点のインデックスを持つ配列（way_points と各 step の way_points）"""
+    references = []
+    if isinstance(properties.get("way_points"), list):
+        references.append(properties["way_points"])
+    for segment in properties.get("segments") or []:
+        for step in segment.get("steps") or []:
+            if isinstance(step.get("way_points"), list):
+                references.append(step["way_points"])
+    return references
+
+
+def transform_route_geojson(
+    geojson: dict,
+    zoom: Optional[float] = None,
+    algorithm: str = "douglas-peucker",
+    geometry_format: str = "geojson",
+    precision: int = 5,
+) -> dict:
+    """ルートの GeoJSON の線を単純化し、指定した形式でエンコードする
+
+    zoom を指定するとその縮尺で見分けられない頂点を取り除く。LineString の場合、properties の
+    way_points と segments[].steps[].way_points が指す頂点は残し、単純化後のインデックスに付け替える。
+    geometry_format が polyline / delta の場合、LineString の geometry は
+    {"type": "LineString", "encoding": ..., "precision": ..., "coordinates": ...} になる
+    （MultiLineString の場合は coordinates が線ごとのリスト）。
+    """
+    original_points = 0
+    simplified_points = 0
+    tolerance = None
+    for feature in geojson.get("features", []):
+        geometry = feature.get("geometry") or {}
+        parts = _line_parts(geometry)
+        if parts is None:
+            continue
+        if zoom is not None:
+            latitude = float(np.mean([point[1] for part in parts for point in part])) if any(parts) else 0.0
+            tolerance = tolerance_for_zoom(zoom, latitude)
+            if geometry["type"] == "LineString" and len(parts[0]) > 2:
+                references = _vertex_references(feature.get("properties") or {})
+                keep = simplify_mask(parts[0], tolerance, algorithm, {index for ref in references for index in ref})
+                new_index = np.cumsum(keep) - 1
+                for ref in references:
+                    ref[:] = [int(new_index[index]) if 0 <= index < len(keep) else index for index in ref]
+                new_parts = [np.asarray(parts[0], dtype=np.float64)[:, :2][keep].tolist()]
+            else:
+                new_parts = [simplify_coordinates(part, tolerance, algorithm) for part in parts]
+        else:
+            new_parts = parts
+        original_points += sum(len(part) for part in parts)
+        simplified_points += sum(len(part) for part in new_parts)
+
+        if geometry_format == "polyline":
+            encoded = [encode_polyline(part, precision) for part in new_parts]
+        elif geometry_format == "delta":
+            encoded = [delta_encode(part, precision) for part in new_parts]
+        else:
+            encoded = [[[round(value, precision) for value in point[:2]] for point in part] for part in new_parts] \
+                if zoom is not None else new_parts
+
+        if geometry_format == "geojson":
+            geometry["coordinates"] = encoded[0] if geometry["type"] == "LineString" else encoded
+        else:
+            feature["geometry"] = {
+                "type": geometry["type"],
+                "encoding": geometry_format,
+                "precision": precision,
+                "coordinates": encoded[0] if geometry["type"] == "LineString" else encoded,
+            }
+
+    geojson["simplification"] = {
+        "zoom": zoom,
+        "algorithm": algorithm if zoom is not None else None,
+        "tolerance_m": round(tolerance, 3) if tolerance is not None else None,
+        "geometry_format": geometry_format,
+        "original_points": original_points,
+        "simplified_points": simplified_points,
+    }
+    return geojson
+
+
+if __name__ == "__main__":
+    # 5,000 頂点の徒歩ルートでの転送量とパース時間のベンチマーク
+    import json
+    import random
+    import time
+
+    random.seed(0)
+    coords = []
+    lng, lat = 139.6516, 35.7356
+    heading = 0.0
+    for _ in range(5000):
+        # 数メートル間隔で少しずつ向きを変える（道路に沿った ORS のジオメトリに近い形）
+        heading += random.gauss(0, 0.15)
+        lng += math.cos(heading) * 0.00004
+        lat += math.sin(heading) * 0.00003
+        coords.append([round(lng, 6), round(lat, 6)])
+    route = {
+        "type": "FeatureCollection",
+        "features": [{"type": "Feature", "properties": {}, "geometry": {"type": "LineString", "coordinates": coords}}],
+    }
+    raw = json.dumps(route).encode("utf-8")
+
+    def parse_time(body: bytes, decode=None, repeat=20) -> float:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            data = json.loads(body)
+            if decode:
+                decode(data)
+        return (time.perf_counter() - started) / repeat
+
+    print(f"raw             : {len(raw) / 1024:7.1f}KB  points={len(coords)}  parse={parse_time(raw) * 1000:.2f}ms")
+    for zoom in (14, 16):
+        for algorithm in SIMPLIFY_ALGORITHMS:
+            for geometry_format in GEOMETRY_FORMATS:
+                elapsed = float("inf")
+                for _ in range(5):
+                    geojson = json.loads(raw)
+                    started = time.perf_counter()
+                    result = transform_route_geojson(geojson, zoom, algorithm, geometry_format)
+                    elapsed = min(elapsed, time.perf_counter() - started)
+                body = json.dumps(result).encode("utf-8")
+                decode = None
+                if geometry_format == "polyline":
+                    decode = lambda data: decode_polyline(data["features"][0]["geometry"]["coordinates"])
+                print(f"z{zoom} {algorithm:15s} {geometry_format:8s}: {len(body) / 1024:6.1f}KB  "
+                      f"points={result['simplification']['simplified_points']:5d}  "
+                      f"simplify={elapsed * 1000:6.2f}ms  parse={parse_time(body, decode) * 1000:.2f}ms")
+
+    # エンコード・デコードの往復確認
+    encoded = encode_polyline(coords)
+    assert all(abs(a - b) < 1e-5 for p, q in zip(coords, decode_polyline(encoded)) for a, b in zip(p, q))
+
+    # 単純化後も way_points と step の way_points が同じ地点を指すことの確認
+    way_points = [0, 1234, 2500, 4999]
+    steps = [{"way_points": [a, b]} for a, b in zip(range(0, 4999, 97), list(range(97, 4999, 97)) + [4999])]
+    for algorithm in SIMPLIFY_ALGORITHMS:
+        route = {"type": "FeatureCollection", "features": [{
+            "type": "Feature",
+            "properties": {"way_points": list(way_points), "segments": [{"steps": [dict(step, way_points=list(step["way_points"])) for step in steps]}]},
+            "geometry": {"type": "LineString", "coordinates": coords},
+        }]}
+        feature = transform_route_geojson(route, 14, algorithm, "geojson", 6)["features"][0]
+        simplified = feature["geometry"]["coordinates"]
+        assert [simplified[i] for i in feature["properties"]["way_points"]] == [coords[i] for i in way_points]
+        for step, original in zip(feature["properties"]["segments"][0]["steps"], steps):
+            assert [simplified[i] for i in step["way_points"]] == [coords[i] for i in original["way_points"]]
+    print("way_points remapped after simplification")
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+import aiohttp
+import httpx
+
+from metrics import provider_duration, provider_errors
+
+# 接続プールの設定
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+ORS_READ_TIMEOUT = float(os.getenv("ORS_READ_TIMEOUT", "20"))
+
+# プロバイダ名 -> クライアント種別
+AIOHTTP_PROVIDERS = ("nominatim", "google")
+HTTPX_PROVIDERS = ("ors",)
+
+
+class TrackedCall:
+    """track() の中で行ったリクエストの結果（HTTP ステータス）"""
+
+    def __init__(self):
+        self.status: Optional[int] = None
+
+
+class HTTPClientPool:
+    """外部プロバイダごとに共有する HTTP クライアントの管理"""
+
+    def __init__(self):
+        self._aiohttp: Dict[str, aiohttp.ClientSession] = {}
+        self._httpx: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, dict] = {
+            provider: {"requests": 0, "errors": 0, "cancelled": 0, "in_flight": 0, "peak_in_flight": 0}
+            for provider in AIOHTTP_PROVIDERS + HTTPX_PROVIDERS
+        }
+
+    async def start(self):
+        """全プロバイダのクライアントを作成（lifespan の起動時に呼ぶ）"""
+        for provider in AIOHTTP_PROVIDERS:
+            self.aiohttp_session(provider)
+        for provider in HTTPX_PROVIDERS:
+            self.httpx_client(provider)
+
+    async def close(self):
+        """全クライアントを閉じる（lifespan のシャットダウン時に呼ぶ）"""
+        for session in self._aiohttp.values():
+            await session.close()
+        for client in self._httpx.values():
+            await client.aclose()
+        self._aiohttp.clear()
+        self._httpx.clear()
+
+    def aiohttp_session(self, provider: str) -> aiohttp.ClientSession:
+        """プロバイダ用の aiohttp セッションを取得（未作成なら作成）"""
+        session = self._aiohttp.get(provider)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                use_dns_cache=True,
+            )
+            timeout = aiohttp.ClientTimeout(
+                connect=HTTP_CONNECT_TIMEOUT,
+                sock_read=HTTP_READ_TIMEOUT,
+            )
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._aiohttp[provider] = session
+        return session
+
+    def httpx_client(self, provider: str) -> httpx.AsyncClient:
+        """プロバイダ用の httpx クライアントを取得（未作成なら作成）"""
+        client = self._httpx.get(provider)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_LIMIT,
+                    max_keepalive_connections=HTTP_POOL_LIMIT_PER_HOST,
+                    keepalive_expiry=HTTP_KEEPALIVE_TIMEOUT,
+                ),
+                timeout=httpx.Timeout(ORS_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            )
+            self._httpx[provider] = client
+        return client
+
+    @asynccontextmanager
+    async def track(self, provider: str):
+        """リクエスト数・同時実行数・エラー数と所要時間を記録する
+
+        HTTP のステータスは yield したオブジェクトの status に設定する（4xx / 5xx もエラーとして数える）。
+        呼び出し側の取り消し（ヘッジで不要になった試行など）はエラーではなく cancelled として数える。
+        """
+        stats = self._stats.setdefault(
+            provider, {"requests": 0, "errors": 0, "cancelled": 0, "in_flight": 0, "peak_in_flight": 0}
+        )
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+        call = TrackedCall()
+        outcome = "ok"
+        started = time.perf_counter()
+        try:
+            yield call
+            if call.status is not None and call.status >= 400:
+                outcome = "error"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            stats["in_flight"] -= 1
+            provider_duration.observe(time.perf_counter() - started, provider=provider, outcome=outcome)
+            if outcome == "error":
+                stats["errors"] += 1
+                provider_errors.inc(provider=provider)
+            elif outcome == "cancelled":
+                stats["cancelled"] += 1
+
+    def stats(self) -> dict:
+        """プールの利用状況を返す"""
+        result = {}
+        for provider, stats in self._stats.items():
+            if provider in self._aiohttp:
+                open_ = not self._aiohttp[provider].closed
+            elif provider in self._httpx:
+                open_ = not self._httpx[provider].is_closed
+            else:
+                open_ = False
+            result[provider] = {
+                **stats,
+                "open": open_,
+                "limit": HTTP_POOL_LIMIT,
+                "limit_per_host": HTTP_POOL_LIMIT_PER_HOST,
+                "utilisation": round(stats["in_flight"] / HTTP_POOL_LIMIT_PER_HOST, 3),
+            }
+        return result
+
+
+# アプリ全体で共有するクライアントプール
+http_clients = HTTPClientPool()
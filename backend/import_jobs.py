@@ -0,0 +1,361 @@
+import asyncio
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional
+
+from sqlalchemy import select
+
+from csv_import import Resolver, count_csv_rows, import_spots_from_stream
+from database import AsyncSessionLocal, CSVUpload
+from response_cache import catalog_cache
+from serialization import dumps_json
+from spatial_index import spot_index
+
+logger = logging.getLogger(__name__)
+
+# 取り込みを並行して処理するワーカー数（SQLite は書き込みが1つずつのため多くしすぎない）
+IMPORT_JOB_WORKERS = int(os.getenv("IMPORT_JOB_WORKERS", "2"))
+
+# アップロードされた CSV を処理が終わるまで保存するディレクトリ（再起動後の再開にも使う）
+IMPORT_JOB_DIR = os.getenv("IMPORT_JOB_DIR", "./import_jobs")
+
+# データベースに保存する行ごとのエラーの最大件数（error_count は全件を数える）
+IMPORT_JOB_MAX_STORED_ERRORS = int(os.getenv("IMPORT_JOB_MAX_STORED_ERRORS", "1000"))
+
+# 進捗の Server-Sent Events で、更新がないときに接続維持のコメントを送る間隔（秒）
+IMPORT_JOB_HEARTBEAT_SECONDS = float(os.getenv("IMPORT_JOB_HEARTBEAT_SECONDS", "15"))
+
+# 終了したジョブをメモリに残す件数（それより古いジョブはデータベースから参照する）
+IMPORT_JOB_RETAINED = 100
+
+ACTIVE_STATUSES = ("queued", "running")
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def upload_status(upload: CSVUpload, include_errors: bool = False) -> dict:
+    """取り込みジョブ（csv_uploads の1行）の状態をレスポンス用の dict にする"""
+    # status が NULL の行は従来の同期取り込みで、記録された時点で完了している
+    status = upload.status or "completed"
+    total_rows = upload.total_rows
+    processed_rows = upload.processed_rows or 0
+    errors = upload.errors or []
+    status_dict = {
+        "job_id": upload.id,
+        "filename": upload.filename,
+        "status": status,
+        "total_rows": total_rows,
+        "processed_rows": processed_rows,
+        "progress": round(processed_rows / total_rows, 4) if total_rows else None,
+        "spot_count": upload.spot_count or 0,
+        "duplicate_count": upload.duplicate_count or 0,
+        "error_count": upload.error_count or 0,
+        "message": errors[-1] if status == "failed" and errors else None,
+        "upload_date": _isoformat(upload.upload_date),
+        "started_at": _isoformat(upload.started_at),
+        "finished_at": _isoformat(upload.finished_at),
+    }
+    if include_errors:
+        status_dict["errors"] = errors
+    return status_dict
+
+
+def progress_event(snapshot: dict) -> bytes:
+    """ジョブの状態を Server-Sent Events の1イベントにする"""
+    return b"event: progress\ndata: " + dumps_json(snapshot) + b"\n\n"
+
+
+class ImportJob:
+    """実行中・待機中の取り込みジョブ（進捗の通知と取り消しに使う。状態は csv_uploads テーブルに保存する）"""
+
+    def __init__(self, upload: CSVUpload, keep_results: bool = False):
+        self.id = upload.id
+        # True の場合は登録したスポット・重複・エラーの一覧を result に残す（同期の /api/upload/csv 用）
+        self.keep_results = keep_results
+        self.result: Optional[dict] = None
+        # 失敗時に返す HTTP ステータス（400: CSV の形式の誤り、500: その他）
+        self.error_status: Optional[int] = None
+        self.cancel_requested = False
+        self.task: Optional[asyncio.Task] = None
+        self.done = asyncio.Event()
+        self.changed = asyncio.Event()
+        self.snapshot = upload_status(upload)
+
+    @property
+    def status(self) -> str:
+        return self.snapshot["status"]
+
+    def notify(self, upload: CSVUpload) -> None:
+        """状態を更新し、進捗を待っている SSE の接続を起こす"""
+        self.snapshot = upload_status(upload)
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+        if self.status in TERMINAL_STATUSES:
+            self.done.set()
+
+
+class ImportJobQueue:
+    """CSV の取り込みをワーカーで処理するジョブキュー
+
+    アップロードされたファイルは IMPORT_JOB_DIR に保存し、ジョブ ID（csv_uploads.id）を
+    キューに積んですぐに返す。ワーカーはバッチ（CSV_IMPORT_BATCH_SIZE 行）ごとにコミットし、
+    進捗・件数・行ごとのエラーを csv_uploads に記録する。取り消した場合や失敗した場合も
+    それまでにコミットしたバッチのスポットは残る。
+    """
+
+    def __init__(self, workers: int = IMPORT_JOB_WORKERS, spool_dir: str = IMPORT_JOB_DIR):
+        self.workers = workers
+        self.spool_dir = spool_dir
+        self._jobs: "OrderedDict[int, ImportJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._resolver: Optional[Resolver] = None
+        self.rows_processed = 0
+        self.spots_created = 0
+        self.finished = {status: 0 for status in TERMINAL_STATUSES}
+
+    async def start(self, resolver: Resolver) -> None:
+        """ワーカーを起動する（lifespan の起動時に呼ぶ）。前回のプロセスで終わらなかったジョブは再開する"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._resolver = resolver
+        self._queue = asyncio.Queue()
+        await self._resume_interrupted()
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        """ワーカーを止める（lifespan のシャットダウン時に呼ぶ）。実行中のジョブは次回の起動時に再開する"""
+        running = [job.task for job in self._jobs.values() if job.task is not None and not job.task.done()]
+        for task in self._worker_tasks + running:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, *running, return_exceptions=True)
+        self._worker_tasks = []
+
+    def spool_path(self, job_id: int) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.csv")
+
+    def get(self, job_id: int) -> Optional[ImportJob]:
+        return self._jobs.get(job_id)
+
+    async def submit(self, filename: str, binary: BinaryIO, keep_results: bool = False) -> ImportJob:
+        """アップロードされたファイルを保存し、ジョブをキューに積む"""
+        async with AsyncSessionLocal() as db:
+            upload = CSVUpload(
+                filename=filename,
+                spot_count=0,
+                success=None,
+                status="queued",
+                processed_rows=0,
+                duplicate_count=0,
+                error_count=0,
+                errors=[],
+            )
+            db.add(upload)
+            await db.commit()
+            try:
+                await asyncio.to_thread(self._spool, binary, self.spool_path(upload.id))
+            except Exception as e:
+                await self._finish(db, upload, "failed", f"アップロードされたファイルを保存できませんでした: {str(e)}")
+                raise
+        job = ImportJob(upload, keep_results)
+        self._remember(job)
+        self._queue.put_nowait(job.id)
+        return job
+
+    def _spool(self, binary: BinaryIO, path: str) -> None:
+        binary.seek(0)
+        with open(path, "wb") as spool:
+            shutil.copyfileobj(binary, spool, 1024 * 1024)
+
+    def _remember(self, job: ImportJob) -> None:
+        self._jobs[job.id] = job
+        finished = [job_id for job_id, known in self._jobs.items() if known.status in TERMINAL_STATUSES]
+        for job_id in finished[:max(len(finished) - IMPORT_JOB_RETAINED, 0)]:
+            del self._jobs[job_id]
+
+    async def cancel(self, job_id: int) -> Optional[dict]:
+        """待機中・実行中のジョブを取り消し、取り消し後の状態を返す（終了済みなど取り消せない場合は None）"""
+        job = self._jobs.get(job_id)
+        if job is None or job.status not in ACTIVE_STATUSES or job.cancel_requested:
+            return None
+        job.cancel_requested = True
+        if job.task is not None:
+            job.task.cancel()
+            await asyncio.wait({job.task})
+        if job.status not in TERMINAL_STATUSES:
+            # まだワーカーが取り出していない場合（取り出したワーカーは cancel_requested を見て読み飛ばす）や、
+            # タスクが開始前に取り消された場合は _run が終了を記録しないため、ここで記録する
+            async with AsyncSessionLocal() as db:
+                upload = await db.get(CSVUpload, job_id)
+                await self._finish(db, upload, "cancelled", job=job)
+        return job.snapshot
+
+    async def events(self, job: ImportJob) -> AsyncIterator[bytes]:
+        """ジョブの進捗を Server-Sent Events として返す（終了した時点で閉じる）"""
+        changed = job.changed
+        yield progress_event(job.snapshot)
+        while job.status not in TERMINAL_STATUSES:
+            try:
+                await asyncio.wait_for(changed.wait(), IMPORT_JOB_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            changed = job.changed
+            yield progress_event(job.snapshot)
+
+    async def _resume_interrupted(self) -> None:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(CSVUpload).where(CSVUpload.status.in_(ACTIVE_STATUSES)).order_by(CSVUpload.id)
+            )
+            for upload in result.scalars().all():
+                if not os.path.exists(self.spool_path(upload.id)):
+                    await self._finish(db, upload, "failed", "アップロードされたファイルが見つからないため再開できませんでした")
+                    continue
+                upload.status = "queued"
+                await db.commit()
+                self._remember(ImportJob(upload))
+                self._queue.put_nowait(upload.id)
+                logger.info("CSV取り込みジョブ %s（%s）を再開します", upload.id, upload.filename)
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self._jobs.get(job_id)
+            if job is None or job.cancel_requested:
+                continue
+            # ジョブ単位で取り消せるよう別のタスクで実行する
+            job.task = asyncio.create_task(self._run(job))
+            await asyncio.wait({job.task})
+
+    async def _run(self, job: ImportJob) -> None:
+        async with AsyncSessionLocal() as db:
+            try:
+                # 行数はデータベースに触れる前に数える（書き込み用の接続を保持したまま待たない）
+                try:
+                    with open(self.spool_path(job.id), "rb") as binary:
+                        total_rows = await asyncio.to_thread(count_csv_rows, binary)
+                except (OSError, ValueError):
+                    total_rows = None
+                upload = await db.get(CSVUpload, job.id)
+            except asyncio.CancelledError:
+                if not job.cancel_requested:
+                    raise
+                # 取り消しは cancel() 側で記録する（まだ running にしていないため巻き戻すものはない）
+                return
+            try:
+                # 再開した場合、前回までに登録した行は重複として数えられる
+                upload.status = "running"
+                upload.started_at = datetime.utcnow()
+                upload.processed_rows = 0
+                upload.duplicate_count = 0
+                upload.error_count = 0
+                upload.errors = []
+                upload.total_rows = total_rows
+                with open(self.spool_path(job.id), "rb") as binary:
+                    await db.commit()
+                    job.notify(upload)
+
+                    counted = {"created_spots": 0, "skipped_duplicates": 0, "errors": 0}
+
+                    async def on_batch(result: dict, processed: int) -> None:
+                        new_spots = result["created_spots"][counted["created_spots"]:]
+                        new_errors = result["errors"][counted["errors"]:]
+                        upload.processed_rows = processed
+                        upload.spot_count = (upload.spot_count or 0) + len(new_spots)
+                        upload.duplicate_count += len(result["skipped_duplicates"]) - counted["skipped_duplicates"]
+                        upload.error_count += len(new_errors)
+                        room = IMPORT_JOB_MAX_STORED_ERRORS - len(upload.errors)
+                        if new_errors and room > 0:
+                            upload.errors = upload.errors + new_errors[:room]
+                        await db.commit()
+
+                        for spot in new_spots:
+                            spot_index.upsert(spot['id'], spot['latitude'], spot['longitude'], spot['plan'])
+                        if new_spots:
+                            catalog_cache.bump()
+                        self.rows_processed += processed - (job.snapshot["processed_rows"] or 0)
+                        self.spots_created += len(new_spots)
+                        job.notify(upload)
+
+                        if job.keep_results:
+                            counted.update({key: len(result[key]) for key in counted})
+                        else:
+                            # 一覧は保持せず件数だけを残す（大きなファイルでもメモリを使い続けない）
+                            for key in counted:
+                                result[key].clear()
+
+                    result = await import_spots_from_stream(db, binary, self._resolver, on_batch=on_batch)
+
+                if job.keep_results:
+                    job.result = result
+                upload.success = upload.error_count == 0
+                await self._finish(db, upload, "completed", job=job)
+            except asyncio.CancelledError:
+                await db.rollback()
+                if not job.cancel_requested:
+                    # シャットダウン：状態は running のまま残し、次回の起動時に再開する
+                    raise
+                await db.refresh(upload)
+                await self._finish(db, upload, "cancelled", job=job)
+            except ValueError as e:
+                await db.rollback()
+                await db.refresh(upload)
+                job.error_status = 400
+                if isinstance(e, UnicodeDecodeError):
+                    message = f"CSVファイルの途中に {e.encoding} として読めない文字があります"
+                else:
+                    message = str(e)
+                await self._finish(db, upload, "failed", message, job=job)
+            except Exception as e:
+                await db.rollback()
+                await db.refresh(upload)
+                job.error_status = 500
+                await self._finish(db, upload, "failed", f"CSVファイルの処理中にエラーが発生しました: {str(e)}", job=job)
+
+    async def _finish(
+        self,
+        db,
+        upload: CSVUpload,
+        status: str,
+        message: Optional[str] = None,
+        job: Optional[ImportJob] = None,
+    ) -> None:
+        upload.status = status
+        upload.finished_at = datetime.utcnow()
+        if status != "completed":
+            upload.success = False
+        if message is not None:
+            upload.errors = (upload.errors or []) + [message]
+        await db.commit()
+        if os.path.exists(self.spool_path(upload.id)):
+            os.remove(self.spool_path(upload.id))
+        self.finished[status] += 1
+        if job is not None:
+            job.notify(upload)
+        logger.info(
+            "CSV取り込みジョブ %s（%s）: %s（登録 %s 件、エラー %s 件）",
+            upload.id, upload.filename, status, upload.spot_count or 0, upload.error_count or 0,
+            extra={"job_id": upload.id, "status": status},
+        )
+
+    def stats(self) -> dict:
+        statuses: Dict[str, int] = {status: 0 for status in ACTIVE_STATUSES}
+        for job in self._jobs.values():
+            if job.status in ACTIVE_STATUSES:
+                statuses[job.status] += 1
+        return {
+            "workers": self.workers,
+            **statuses,
+            "finished": dict(self.finished),
+            "rows_processed": self.rows_processed,
+            "spots_created": self.spots_created,
+        }
+
+
+import_jobs = ImportJobQueue()
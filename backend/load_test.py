@@ -0,0 +1,232 @@
+"""ルート生成エンドポイントの負荷テスト
+
+アプリをプロセス内（ASGI）で起動し、/api/route に同時リクエストを送って
+レイテンシとイベントループの遅延（ブロッキングの有無）を計測する。
+--mode mixed では GET /api/spots の読み取りと PUT /api/spots/{id} の書き込みを混ぜて送る
+（SQLITE_PRODUCTION_PROFILE=false と比較すると WAL などの効果を確認できる）。
+--mode import では CSV 取り込みジョブの実行中（ジオコーディング中）に POST /api/spots が
+書き込み用の接続を待たずに成功することを確認する（ジオコーディングは遅延を入れた模擬）。
+あわせて、行数を数えている間に取り消したジョブが cancelled で終わることも確認する。
+
+    python load_test.py --requests 500 --concurrency 50
+    python load_test.py --mode mixed --requests 2000 --concurrency 50 --write-ratio 0.2
+    DB_POOL_TIMEOUT=2 python load_test.py --mode import --requests 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+import database
+import import_jobs as import_jobs_module
+import main
+from database import AsyncSessionLocal, CSVUpload, Spot
+from import_jobs import import_jobs
+from sqlalchemy import delete, select
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float, lags: list):
+    """イベントループが interval ごとに起床できるかを計測する"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - started - interval)
+
+
+def print_latency(label: str, latencies: list):
+    latencies.sort()
+    print(f"{label:10s}  n={len(latencies):5d} p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms "
+          f"max={latencies[-1] * 1000:.1f}ms")
+
+
+async def run_mixed(requests: int, concurrency: int, write_ratio: float):
+    """読み取りと書き込みを混ぜた負荷をかけ、それぞれのレイテンシを計測する"""
+    async with main.lifespan(main.app):
+        async with AsyncSessionLocal() as db:
+            spot_ids = (await db.scalars(select(Spot.id).limit(50))).all()
+        if not spot_ids:
+            print("スポットがありません")
+            return
+
+        transport = httpx.ASGITransport(app=main.app)
+        semaphore = asyncio.Semaphore(concurrency)
+        read_latencies = []
+        write_latencies = []
+        write_every = max(1, round(1 / write_ratio)) if write_ratio > 0 else 0
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test") as client:
+            async def one_request(i: int):
+                async with semaphore:
+                    started = time.perf_counter()
+                    if write_every and i % write_every == 0:
+                        spot_id = spot_ids[i % len(spot_ids)]
+                        response = await client.put(f"/api/spots/{spot_id}", json={"description": f"load test {i}"})
+                        write_latencies.append(time.perf_counter() - started)
+                    else:
+                        response = await client.get("/api/spots", params={"limit": 100, "view": "list"})
+                        read_latencies.append(time.perf_counter() - started)
+                    response.raise_for_status()
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one_request(i) for i in range(requests)))
+            elapsed = time.perf_counter() - started
+
+        print(f"mode=mixed requests={requests} concurrency={concurrency} write_ratio={write_ratio} "
+              f"sqlite_profile={database.SQLITE_PRODUCTION_PROFILE}")
+        print(f"throughput: {requests / elapsed:8.1f} req/s ({elapsed:.2f}s)")
+        if read_latencies:
+            print_latency("read", read_latencies)
+        if write_latencies:
+            print_latency("write", write_latencies)
+
+
+async def run_import(requests: int, rows: int, geocode_delay: float):
+    """取り込みジョブの実行中に POST /api/spots を送り、全て成功することを確認する"""
+    async def slow_geocoder(address: str):
+        await asyncio.sleep(geocode_delay)
+        return 35.7356, 139.6516
+
+    prefix = "load-test-import-"
+    async with main.lifespan(main.app):
+        import_jobs._resolver = slow_geocoder
+        content = "name,address\n" + "".join(f"{prefix}csv-{i},東京都練馬区豊玉北{i}\n" for i in range(rows))
+        transport = httpx.ASGITransport(app=main.app)
+        latencies = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test") as client:
+            response = await client.post(
+                "/api/upload/csv", params={"background": "true"},
+                files={"file": ("load-test.csv", content.encode("utf-8"), "text/csv")},
+            )
+            response.raise_for_status()
+            job = import_jobs.get(response.json()["job_id"])
+
+            failures = 0
+            for i in range(requests):
+                started = time.perf_counter()
+                response = await client.post("/api/spots", json={
+                    "name": f"{prefix}api-{i}", "address": "東京都練馬区豊玉北6-12-1",
+                    "latitude": 35.7356, "longitude": 139.6516,
+                })
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failures += 1
+                    print(f"POST /api/spots failed: {response.status_code} {response.text[:200]}")
+                running = job.status == "running"
+                await asyncio.sleep(geocode_delay)
+            await job.done.wait()
+            await check_cancel_while_counting(client, prefix)
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(delete(Spot).where(Spot.name.startswith(prefix)))
+            await db.commit()
+
+    print(f"mode=import rows={rows} geocode_delay={geocode_delay}s pool_timeout={database.DB_POOL_TIMEOUT}s "
+          f"job={job.status} still_running_at_last_write={running}")
+    print_latency("write", latencies)
+    print(f"failures: {failures}/{requests}")
+    assert failures == 0, "取り込みジョブの実行中に書き込みが失敗しました"
+
+
+async def check_cancel_while_counting(client: httpx.AsyncClient, prefix: str):
+    """行数を数えている間に取り消したジョブが cancelled で終わり、待っている処理が止まらないことを確認する"""
+    counting = asyncio.Event()
+    original_count = import_jobs_module.count_csv_rows
+    loop = asyncio.get_running_loop()
+
+    def slow_count(binary):
+        # スレッドで呼ばれるため、イベントはループ側で設定する
+        loop.call_soon_threadsafe(counting.set)
+        time.sleep(0.5)
+        return original_count(binary)
+
+    import_jobs_module.count_csv_rows = slow_count
+    try:
+        content = "name,address\n" + "".join(f"{prefix}cancel-{i},東京都練馬区豊玉北{i}\n" for i in range(10))
+        response = await client.post(
+            "/api/upload/csv", params={"background": "true"},
+            files={"file": ("cancel.csv", content.encode("utf-8"), "text/csv")},
+        )
+        response.raise_for_status()
+        job = import_jobs.get(response.json()["job_id"])
+        await asyncio.wait_for(counting.wait(), 5)
+
+        response = await client.post(f"/api/imports/{job.id}/cancel")
+        assert response.status_code == 200, response.text
+        assert response.json()["status"] == "cancelled", response.json()
+        await asyncio.wait_for(job.done.wait(), 5)
+        events = [event async for event in import_jobs.events(job)]
+        assert b"cancelled" in events[-1], events
+        response = await client.post(f"/api/imports/{job.id}/cancel")
+        assert response.status_code == 409, response.text
+        async with AsyncSessionLocal() as db:
+            assert (await db.get(CSVUpload, job.id)).status == "cancelled"
+    finally:
+        import_jobs_module.count_csv_rows = original_count
+    print("cancel while counting: cancelled")
+
+
+async def run(requests: int, concurrency: int):
+    async with main.lifespan(main.app):
+        async with AsyncSessionLocal() as db:
+            spot_ids = (await db.scalars(
+                select(Spot.id).where(Spot.latitude.isnot(None), Spot.longitude.isnot(None)).limit(8)
+            )).all()
+        if not spot_ids:
+            print("座標付きのスポットがありません")
+            return
+
+        params = {
+            "start_lat": 35.7356,
+            "start_lng": 139.6516,
+            "spot_ids": ",".join(str(spot_id) for spot_id in spot_ids),
+            "optimize": "true",
+        }
+        transport = httpx.ASGITransport(app=main.app)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test") as client:
+            async def one_request():
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.get("/api/route", params=params)
+                    latencies.append(time.perf_counter() - started)
+                    response.raise_for_status()
+
+            stop = asyncio.Event()
+            lags = []
+            lag_task = asyncio.create_task(measure_loop_lag(stop, 0.005, lags))
+            started = time.perf_counter()
+            await asyncio.gather(*(one_request() for _ in range(requests)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await lag_task
+
+        latencies.sort()
+        print(f"requests={requests} concurrency={concurrency} spots={len(spot_ids)}")
+        print(f"throughput: {requests / elapsed:8.1f} req/s ({elapsed:.2f}s)")
+        print(f"latency:    p50={statistics.median(latencies) * 1000:.1f}ms "
+              f"p95={latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f}ms "
+              f"max={latencies[-1] * 1000:.1f}ms")
+        print(f"loop lag:   p50={statistics.median(lags) * 1000:.2f}ms max={max(lags) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--mode", choices=["route", "mixed", "import"], default="route")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--rows", type=int, default=600, help="--mode import で取り込む行数")
+    parser.add_argument("--geocode-delay", type=float, default=0.05, help="--mode import の模擬ジオコーディングの所要時間（秒）")
+    args = parser.parse_args()
+    if args.mode == "import":
+        asyncio.run(run_import(args.requests, args.rows, args.geocode_delay))
+    elif args.mode == "mixed":
+        asyncio.run(run_mixed(args.requests, args.concurrency, args.write_ratio))
+    else:
+        asyncio.run(run(args.requests, args.concurrency))
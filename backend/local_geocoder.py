@@ -0,0 +1,254 @@
+import csv
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Iterable, List, Optional, Sequence
+
+from csv_import import open_csv_stream
+from gazetteer import canonical_address, gazetteer
+
+# 街区レベルの住所点のデータベース（LOCAL_GEOCODER_SOURCES から作成する）
+LOCAL_GEOCODER_PATH = os.getenv("LOCAL_GEOCODER_PATH", "./address_points.db")
+
+# 作成元の位置参照情報（街区レベル）CSV（カンマ区切りで複数指定可）。未設定なら地名辞書（町・丁目）だけを使う
+LOCAL_GEOCODER_SOURCES = os.getenv("LOCAL_GEOCODER_SOURCES", "")
+
+# これより粗い精度の結果は使わず外部サービスに問い合わせる（town / chome / block）
+LOCAL_GEOCODER_MIN_PRECISION = os.getenv("LOCAL_GEOCODER_MIN_PRECISION", "town")
+
+# 精度の順位（施設名は地点そのものなので街区と同じ扱い）
+PRECISION_RANK = {"town": 0, "chome": 1, "block": 2, "landmark": 2}
+
+# 1回の INSERT（executemany）で登録する行数
+INGEST_BATCH_SIZE = 5000
+
+# 照合に使う番号の区切りの数（「6-12-1」なら3つ）
+MAX_NUMBER_PARTS = 6
+
+_PREFIX = re.compile(r"^(?:〒?\d{3}-?\d{4})?(?:東京都|北海道|(?:京都|大阪)府|[^\d-]{2,3}県)?")
+_NUMBER = re.compile(r"\d+")
+
+
+@dataclass
+class LocalGeocodeResult:
+    """ローカルのジオコーディング結果（precision は block / chome / town / landmark）"""
+    latitude: float
+    longitude: float
+    precision: str
+    key: str
+
+
+def _read_rows(path: str) -> Iterable[dict]:
+    with open(path, "rb") as binary:
+        text, _ = open_csv_stream(binary)
+        yield from csv.DictReader(text)
+
+
+def ingest_address_points(sources: Sequence[str], path: str) -> int:
+    """位置参照情報（街区レベル）の CSV を SQLite に取り込み、登録したキーの数を返す
+
+    キーは照合用の表記で「練馬区豊玉北6-12」（丁目 + 街区符号）、住居表示のない地域は
+    「練馬区大泉学園町1234」（大字 + 地番）。区をまたいで同じ名前がない町は区を省いたキーも登録する。
+    一時ファイルに作成してから置き換えるため、取り込み中も古いデータベースで検索できる。
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE address_points (key TEXT PRIMARY KEY, latitude REAL NOT NULL, longitude REAL NOT NULL) WITHOUT ROWID"
+        )
+        conn.execute("CREATE TEMP TABLE pending (key TEXT, latitude REAL, longitude REAL, town TEXT, city TEXT)")
+
+        batch: List[tuple] = []
+        representative: List[tuple] = []
+
+        def flush():
+            # 代表点（代表フラグ=1）を優先し、それ以外は最初の点を使う
+            conn.executemany("INSERT OR REPLACE INTO address_points VALUES (?, ?, ?)", [row[:3] for row in representative])
+            conn.executemany("INSERT OR IGNORE INTO address_points VALUES (?, ?, ?)", [row[:3] for row in batch])
+            conn.executemany("INSERT INTO pending VALUES (?, ?, ?, ?, ?)", representative + batch)
+            representative.clear()
+            batch.clear()
+
+        for source in sources:
+            for row in _read_rows(source):
+                city = canonical_address(row.get("市区町村名") or "")
+                town = canonical_address((row.get("大字・丁目名") or "") + (row.get("小字・通称名") or ""))
+                block = (row.get("街区符号・地番") or "").strip()
+                if not city or not town or not block.isdigit():
+                    continue
+                try:
+                    latitude, longitude = float(row["緯度"]), float(row["経度"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                record = (city + town + str(int(block)), latitude, longitude, town, city)
+                (representative if row.get("代表フラグ") == "1" else batch).append(record)
+                if len(batch) + len(representative) >= INGEST_BATCH_SIZE:
+                    flush()
+        flush()
+
+        # 区を省いたキー（町名が1つの区にしかない場合のみ）
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO address_points
+            SELECT substr(key, length(city) + 1), latitude, longitude FROM pending
+            WHERE town IN (SELECT town FROM pending GROUP BY town HAVING COUNT(DISTINCT city) = 1)
+            """
+        )
+        conn.commit()
+        count = conn.execute("SELECT COUNT(*) FROM address_points").fetchone()[0]
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+    return count
+
+
+def candidate_keys(text: str) -> List[str]:
+    """照合用の表記から、番号の区切りごとの先頭部分（長い順）を作る（例：練馬区豊玉北6-12-1 → …6-12-1, …6-12, …6）"""
+    text = _PREFIX.sub("", text, count=1)
+    keys = [text[:match.end()] for match in _NUMBER.finditer(text)][:MAX_NUMBER_PARTS]
+    return keys[::-1]
+
+
+class LocalGeocoder:
+    """外部サービスを使わずに住所から座標を求める（街区 → 丁目・町・施設名の順に探す）"""
+
+    def __init__(
+        self,
+        path: str = LOCAL_GEOCODER_PATH,
+        sources: str = LOCAL_GEOCODER_SOURCES,
+        min_precision: str = LOCAL_GEOCODER_MIN_PRECISION,
+    ):
+        self.path = path
+        self.sources = [source for source in sources.split(",") if source]
+        self.min_rank = PRECISION_RANK.get(min_precision, 0)
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self.hits = {precision: 0 for precision in PRECISION_RANK}
+        self.misses = 0
+
+    def _needs_ingest(self) -> bool:
+        if not self.sources:
+            return False
+        if not os.path.exists(self.path):
+            return True
+        built = os.path.getmtime(self.path)
+        return any(os.path.exists(source) and os.path.getmtime(source) > built for source in self.sources)
+
+    def load(self) -> None:
+        """地名辞書と住所点のデータベースを開く（ソースの CSV の方が新しい場合は取り込み直す）"""
+        gazetteer.load()
+        if self._needs_ingest():
+            ingest_address_points([source for source in self.sources if os.path.exists(source)], self.path)
+        conn = None
+        if os.path.exists(self.path):
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        with self._lock:
+            previous, self._conn = self._conn, conn
+        if previous is not None:
+            previous.close()
+
+    def lookup_block(self, text: str) -> Optional[LocalGeocodeResult]:
+        """照合用の表記から街区レベルの住所点を探す"""
+        if self._conn is None:
+            return None
+        keys = candidate_keys(text)
+        if not keys:
+            return None
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, latitude, longitude FROM address_points WHERE key IN ({placeholders})", keys
+            ).fetchall()
+        if not rows:
+            return None
+        key, latitude, longitude = max(rows, key=lambda row: len(row[0]))
+        return LocalGeocodeResult(latitude, longitude, "block", key)
+
+    def lookup(self, address: str) -> Optional[LocalGeocodeResult]:
+        """住所から最も詳細な座標を求める（LOCAL_GEOCODER_MIN_PRECISION より粗い場合は None）"""
+        text = canonical_address(address)
+        result = self.lookup_block(text)
+        if result is None:
+            match = gazetteer.lookup(address)
+            if match is not None:
+                result = LocalGeocodeResult(match.latitude, match.longitude, match.level, match.key)
+        if result is None or PRECISION_RANK[result.precision] < self.min_rank:
+            self.misses += 1
+            return None
+        self.hits[result.precision] += 1
+        return result
+
+    def stats(self) -> dict:
+        points = 0
+        if self._conn is not None:
+            with self._lock:
+                points = self._conn.execute("SELECT COUNT(*) FROM address_points").fetchone()[0]
+        return {
+            "path": self.path if self._conn is not None else None,
+            "address_points": points,
+            "min_precision": next(name for name, rank in PRECISION_RANK.items() if rank == self.min_rank),
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "gazetteer": gazetteer.stats(),
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+local_geocoder = LocalGeocoder()
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+
+    if len(sys.argv) >= 3 and sys.argv[1] == "ingest":
+        # python local_geocoder.py ingest 出力.db 街区.csv ...
+        started = time.perf_counter()
+        count = ingest_address_points(sys.argv[3:], sys.argv[2])
+        print(f"ingested {count} keys into {sys.argv[2]} in {time.perf_counter() - started:.1f}s")
+        sys.exit(0)
+
+    # 同梱のサンプル（位置参照情報の街区レベル CSV と同じ形式の抜粋）での確認とベンチマーク
+    fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "address_points_sample.csv")
+    with tempfile.TemporaryDirectory() as tmp:
+        geocoder = LocalGeocoder(os.path.join(tmp, "address_points.db"), fixture)
+        geocoder.load()
+        expected = [
+            ("東京都練馬区豊玉北６丁目１２番１号", "block", "練馬区豊玉北6-12"),
+            ("練馬区豊玉北六丁目12-1 練馬区役所", "block", "練馬区豊玉北6-12"),
+            ("〒176-8501 東京都練馬区豊玉北6-12-1", "block", "練馬区豊玉北6-12"),
+            ("光が丘4-1-1", "block", "光が丘4-1"),
+            ("東京都練馬区光が丘4丁目99-1", "chome", "練馬区光が丘4"),
+            ("東京都練馬区石神井台1丁目26-1", "block", "練馬区石神井台1-26"),
+            ("東京都豊島区南長崎3-1-1", "town", "豊島区南長崎"),
+            ("東京都新宿区西新宿2-8-1", None, None),
+        ]
+        failures = 0
+        for address, precision, key in expected:
+            result = geocoder.lookup(address)
+            actual = (result.precision, result.key) if result else (None, None)
+            if actual != (precision, key):
+                failures += 1
+                print(f"NG {address}: expected {(precision, key)}, actual {actual}")
+        print(f"fixture: {failures} failures in {len(expected)} addresses  {geocoder.stats()}")
+
+        addresses = [address for address, _, _ in expected] * 500
+        started = time.perf_counter()
+        for address in addresses:
+            geocoder.lookup(address)
+        elapsed = time.perf_counter() - started
+        print(f"lookup: {len(addresses) / elapsed:,.0f} lookups/s ({elapsed / len(addresses) * 1e6:.1f}us/address)")
+        geocoder.close()
@@ -0,0 +1,40 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+# ログレベル（DEBUG にするとジオコーディングの試行やルート計算の詳細も出力する）
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# 出力形式（text / json。json は1行1レコードで、extra に渡した項目もそのまま出力する）
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# LogRecord が標準で持つ属性（これ以外は extra で渡された項目として出力する）
+_STANDARD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """ログを1行の JSON にする"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _STANDARD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> None:
+    """アプリのログの出力先と形式を設定する（既にハンドラがある場合は変更しない）"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+    logging.basicConfig(level=level, handlers=[handler])
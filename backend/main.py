@@ -1,22 +1,46 @@
 from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import List, Optional
-import csv
-import io
-import aiohttp
 import asyncio
+import logging
 import urllib.parse
-import unicodedata
-import re
 import math
 from datetime import datetime
-import codecs
+import numpy as np
 
 # データベース関連のインポート
-from database import get_db, Spot, CSVUpload, init_db
-from models import SpotBase, SpotCreate, SpotUpdate, SpotResponse
+from database import get_db, get_read_db, Spot, CSVUpload, init_db, close_db, AsyncSessionLocal, AsyncReadSessionLocal
+from models import SpotBase, SpotCreate, SpotUpdate, SpotResponse, SpotListItem, SpotNearbyResponse, DistanceMatrixRequest, RouteBatchRequest, PlanBuildRequest
+from geocode_cache import geocode_cache
+from geocode_pipeline import (
+    provider_limiters, resolve_hedged, geocode_addresses,
+    GEOCODE_HEDGE_STAGGER, GEOCODE_BUDGET_SECONDS, GEOCODE_MAX_VARIATIONS,
+)
+from http_clients import http_clients
+from route_optimizer import ROUTE_MAX_SPOTS, optimize_visit_order, tour_length
+from distance_matrix import haversine_matrix, travel_time_matrix
+from scheduler import Stop, opening_windows, parse_clock, schedule_visits, minute_to_datetime
+from address_normalizer import normalize_address, create_address_variations, simplify_address
+from gazetteer import gazetteer
+from local_geocoder import local_geocoder
+from plan_builder import build_plan, plan_matrix_cache, DEFAULT_SPOT_RATING, DEFAULT_VISIT_DURATION
+from spatial_index import spot_index, SPATIAL_INDEX_MAX_RADIUS_KM
+from response_cache import catalog_cache
+from serialization import FastJSONResponse, negotiated_response
+from compression import CompressionMiddleware
+from routers.routing import router as routing_router, directions_cache
+from road_network import road_network, ROAD_NETWORK_PATH
+from import_jobs import import_jobs, upload_status, progress_event
+from metrics import metrics, span, geocode_results, MetricsMiddleware, PROMETHEUS_CONTENT_TYPE
+from logging_config import configure_logging
+from address_normalizer import cache_stats as address_cache_stats
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # 距離計算関数（ハヴァサイン公式）
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -83,12 +107,39 @@ from contextlib import asynccontextmanager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 起動時
-    init_db()
-    print("練馬ワンダーランド API が起動しました")
+    await init_db()
+    geocode_cache.purge_expired()
+    directions_cache.purge_expired()
+    await http_clients.start()
+    await load_spot_index()
+    await import_jobs.start(get_coordinates_from_address)
+    await asyncio.to_thread(local_geocoder.load)
+    logger.info("ローカルの住所データを読み込みました: %s", local_geocoder.stats())
+    if ROAD_NETWORK_PATH:
+        await asyncio.to_thread(road_network.load, ROAD_NETWORK_PATH)
+        logger.info("道路ネットワークを読み込みました: %s", road_network.stats())
+    logger.info("練馬ワンダーランド API が起動しました")
     yield
-    # シャットダウン時（必要に応じて）
+    # シャットダウン時
+    await import_jobs.close()
+    await http_clients.close()
+    await close_db()
+    geocode_cache.close()
+    directions_cache.close()
+    local_geocoder.close()
+
+async def load_spot_index():
+    """データベースのスポットから空間インデックスを構築"""
+    async with AsyncReadSessionLocal() as db:
+        result = await db.execute(select(Spot.id, Spot.latitude, Spot.longitude, Spot.plan))
+        spot_index.rebuild(result.all())
 
-app = FastAPI(title="練馬ワンダーランド API", version="1.0.0", lifespan=lifespan)
+app = FastAPI(
+    title="練馬ワンダーランド API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -110,246 +161,57 @@ app.add_middleware(
         "Authorization",
         "X-Requested-With",
     ],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
-# Pydanticモデルはmodels.pyからインポート
+# 一定サイズ以上のレスポンスを brotli / gzip で圧縮
+app.add_middleware(CompressionMiddleware)
 
-# 住所正規化関数
-def normalize_address(address: str) -> str:
-    """住所の全角文字を半角に変換し、特殊文字を置換"""
-    if not address:
-        return ""
-    
-    # 全角数字を半角に変換
-    address = unicodedata.normalize('NFKC', address)
-    
-    # 全角文字を半角に変換
-    address = address.translate(str.maketrans(
-        '０１２３４５６７８９－',
-        '0123456789-'
-    ))
-    
-    # 特殊文字の置換
-    replacements = {
-        '？': '-',
-        '?': '-',
-        '　': ' ',  # 全角スペースを半角に
-        'ー': '-',  # 全角ハイフンを半角に
-        '－': '-',  # 全角ハイフンを半角に
-        '〜': '-',  # 全角チルダを半角ハイフンに
-        '～': '-',  # 全角チルダを半角ハイフンに
-        '（': '(',  # 全角括弧を半角に
-        '）': ')',
-        '【': '[',
-        '】': ']',
-        '「': '"',
-        '」': '"',
-        '『': '"',
-        '』': '"',
-        '、': ',',
-        '。': '.',
-        '・': ' ',
-    }
-    
-    for old, new in replacements.items():
-        address = address.replace(old, new)
-    
-    # 連続するスペースを1つに
-    address = re.sub(r'\s+', ' ', address)
-    
-    # 先頭と末尾の空白を削除
-    address = address.strip()
-    
-    return address
-
-# 住所パターンマッチング関数
-def create_address_variations(address: str) -> List[str]:
-    """住所のバリエーションを作成"""
-    variations = []
-    
-    # 元の住所
-    variations.append(address)
-    
-    # 東京都を省略
-    if address.startswith('東京都'):
-        variations.append(address.replace('東京都', '').strip())
-    
-    # 練馬区を省略（練馬区の住所の場合）
-    if '練馬区' in address:
-        variations.append(address.replace('練馬区', '').strip())
-    
-    # 丁目を削除
-    if '丁目' in address:
-        variations.append(re.sub(r'\d+丁目', '', address))
-    
-    # 番地を段階的に削除
-    if re.search(r'\d+-\d+-\d+', address):
-        variations.append(re.sub(r'(\d+-\d+)-\d+', r'\1', address))
-        variations.append(re.sub(r'\d+-\d+-\d+', '', address))
-    
-    if re.search(r'\d+-\d+', address):
-        variations.append(re.sub(r'(\d+)-\d+', r'\1', address))
-        variations.append(re.sub(r'\d+-\d+', '', address))
-    
-    # 建物名や部屋番号を削除
-    building_patterns = [
-        r'\s+[A-Za-z0-9]+マンション.*',
-        r'\s+[A-Za-z0-9]+ビル.*',
-        r'\s+[A-Za-z0-9]+タワー.*',
-        r'\s+[A-Za-z0-9]+プラザ.*',
-        r'\s+[A-Za-z0-9]+センター.*',
-        r'\s+[A-Za-z0-9]+ホール.*',
-        r'\s+[A-Za-z0-9]+内.*',
-        r'\s+[A-Za-z0-9]+F.*',
-        r'\s+[A-Za-z0-9]+階.*',
-        r'\s+[A-Za-z0-9]+号.*',
-        r'\s+[A-Za-z0-9]+室.*',
-        r'\s+[A-Za-z0-9]+公園内.*',
-    ]
-    
-    for pattern in building_patterns:
-        if re.search(pattern, address):
-            variations.append(re.sub(pattern, '', address))
-    
-    # 重複を削除し、空文字列を除外
-    variations = list(dict.fromkeys(variations))
-    variations = [addr.strip() for addr in variations if addr.strip()]
-    
-    return variations
-
-# 住所簡略化関数
-def simplify_address(address: str) -> List[str]:
-    """住所を段階的に簡略化してリストで返す"""
-    simplified = []
-    
-    # 元の住所
-    simplified.append(address)
-    
-    # 建物名や部屋番号を削除（例：江古田マンション 1F、練馬区役所内２０Ｆ）
-    building_patterns = [
-        r'\s+[A-Za-z0-9]+マンション.*',
-        r'\s+[A-Za-z0-9]+ビル.*',
-        r'\s+[A-Za-z0-9]+タワー.*',
-        r'\s+[A-Za-z0-9]+プラザ.*',
-        r'\s+[A-Za-z0-9]+センター.*',
-        r'\s+[A-Za-z0-9]+ホール.*',
-        r'\s+[A-Za-z0-9]+内.*',
-        r'\s+[A-Za-z0-9]+F.*',
-        r'\s+[A-Za-z0-9]+階.*',
-        r'\s+[A-Za-z0-9]+号.*',
-        r'\s+[A-Za-z0-9]+室.*',
-    ]
-    
-    for pattern in building_patterns:
-        if re.search(pattern, address):
-            simplified.append(re.sub(pattern, '', address))
-    
-    # 番地を削除（例：1-2-3 → 1-2）
-    if re.search(r'\d+-\d+-\d+', address):
-        simplified.append(re.sub(r'(\d+-\d+)-\d+', r'\1', address))
-    
-    # 番地をさらに削除（例：1-2 → 1）
-    if re.search(r'\d+-\d+', address):
-        simplified.append(re.sub(r'(\d+)-\d+', r'\1', address))
-    
-    # 丁目を削除
-    if '丁目' in address:
-        simplified.append(re.sub(r'\d+丁目', '', address))
-    
-    # 番地を完全に削除
-    if re.search(r'\d+', address):
-        simplified.append(re.sub(r'\d+', '', address))
-    
-    # 町名を削除（最後の手段）
-    if re.search(r'[町村]', address):
-        simplified.append(re.sub(r'[町村][^区市]*', '', address))
-    
-    # 重複を削除し、空文字列を除外
-    simplified = list(dict.fromkeys(simplified))  # 重複削除（順序保持）
-    simplified = [addr.strip() for addr in simplified if addr.strip()]
-    
-    return simplified
+# リクエストの処理時間を記録（圧縮を含めて計るため最も外側に置く）
+app.add_middleware(MetricsMiddleware)
 
-# 練馬区の主要な場所の座標データベース
-NERIMA_LOCATIONS = {
-    # 光が丘エリア
-    "光が丘": (35.7589, 139.6286),
-    "光が丘4丁目": (35.7589, 139.6286),
-    "光が丘4": (35.7589, 139.6286),
-    
-    # 石神井エリア
-    "石神井台": (35.7434, 139.6064),
-    "石神井台1丁目": (35.7434, 139.6064),
-    "石神井台1": (35.7434, 139.6064),
-    
-    # 旭丘エリア
-    "旭丘": (35.7375, 139.6547),
-    "旭丘1丁目": (35.7375, 139.6547),
-    "旭丘1": (35.7375, 139.6547),
-    
-    # 豊玉エリア
-    "豊玉北": (35.7375, 139.6547),
-    "豊玉北6": (35.7375, 139.6547),
-    
-    # 桜台エリア
-    "桜台": (35.7375, 139.6547),
-    "桜台4丁目": (35.7375, 139.6547),
-    "桜台4": (35.7375, 139.6547),
-    
-    # 向山エリア
-    "向山": (35.7375, 139.6547),
-    "向山3丁目": (35.7375, 139.6547),
-    "向山3": (35.7375, 139.6547),
-    
-    # 練馬区役所
-    "練馬区役所": (35.7375, 139.6547),
-    
-    # 豊島区（隣接区）
-    "豊島区南長崎": (35.7200, 139.6800),
-    "南長崎": (35.7200, 139.6800),
-}
+# ORS ルーティング（キャッシュ付きプロキシ）
+app.include_router(routing_router)
+
+# Pydanticモデルはmodels.pyからインポート
 
 # 住所の手動補完機能
 def get_coordinates_from_database(address: str) -> tuple[Optional[float], Optional[float]]:
-    """事前定義された座標データベースから座標を取得"""
-    normalized_address = normalize_address(address)
-    
-    # 完全一致を試行
-    if normalized_address in NERIMA_LOCATIONS:
-        lat, lon = NERIMA_LOCATIONS[normalized_address]
-        print(f"✅ データベースから住所 '{normalized_address}' の座標を取得: ({lat}, {lon})")
-        return lat, lon
-    
-    # 部分一致を試行
-    for key, (lat, lon) in NERIMA_LOCATIONS.items():
-        if key in normalized_address:
-            print(f"✅ データベースから住所 '{normalized_address}' の座標を取得（部分一致: {key}）: ({lat}, {lon})")
-            return lat, lon
-    
-    return None, None
+    """ローカルの住所データ（街区 → 丁目・町・施設名の順）から座標を取得"""
+    result = local_geocoder.lookup(address)
+    if result is None:
+        return None, None
+    logger.debug(
+        "ローカルデータから住所 '%s' の座標を取得（%s: %s）: (%s, %s)",
+        address, result.precision, result.key, result.latitude, result.longitude,
+    )
+    return result.latitude, result.longitude
 
 # Nominatim を使用した座標取得
 async def get_coordinates_from_nominatim(address: str) -> tuple[Optional[float], Optional[float]]:
     """Nominatim を使用して住所から座標を取得"""
     try:
-        async with aiohttp.ClientSession() as session:
-            encoded_address = urllib.parse.quote(address)
-            url = f"https://nominatim.openstreetmap.org/search?q={encoded_address}&format=json&limit=1&countrycodes=jp"
-            
-            headers = {
-                'User-Agent': 'NerimaWonderland/1.0'
-            }
-            
+        session = http_clients.aiohttp_session("nominatim")
+        encoded_address = urllib.parse.quote(address)
+        url = f"https://nominatim.openstreetmap.org/search?q={encoded_address}&format=json&limit=1&countrycodes=jp"
+        
+        headers = {
+            'User-Agent': 'NerimaWonderland/1.0'
+        }
+        
+        # 同時実行数・レートの制限は呼び出し側（resolve_hedged）で provider_limiters["nominatim"] を使って掛ける
+        async with http_clients.track("nominatim") as call:
             async with session.get(url, headers=headers) as response:
+                call.status = response.status
                 if response.status == 200:
                     data = await response.json()
                     if data and len(data) > 0:
                         lat = float(data[0]['lat'])
                         lon = float(data[0]['lon'])
                         return lat, lon
-                        
+                    
     except Exception as e:
-        print(f"Nominatim エラー: {str(e)}")
+        logger.warning("Nominatim エラー: %s", e)
     
     return None, None
 
@@ -360,14 +222,17 @@ async def get_coordinates_from_google_maps(address: str) -> tuple[Optional[float
         # Google Maps API キーが設定されている場合のみ使用
         api_key = os.getenv("GOOGLE_MAPS_API_KEY")
         if not api_key:
-            print("Google Maps API キーが設定されていません")
+            logger.debug("Google Maps API キーが設定されていません")
             return None, None
             
-        async with aiohttp.ClientSession() as session:
-            encoded_address = urllib.parse.quote(address)
-            url = f"https://maps.googleapis.com/maps/api/geocode/json?address={encoded_address}&key={api_key}&language=ja&region=jp"
-            
+        session = http_clients.aiohttp_session("google")
+        encoded_address = urllib.parse.quote(address)
+        url = f"https://maps.googleapis.com/maps/api/geocode/json?address={encoded_address}&key={api_key}&language=ja&region=jp"
+        
+        # 同時実行数・レートの制限は呼び出し側（resolve_hedged）で provider_limiters["google"] を使って掛ける
+        async with http_clients.track("google") as call:
             async with session.get(url) as response:
+                call.status = response.status
                 if response.status == 200:
                     data = await response.json()
                     if data.get('status') == 'OK' and data.get('results'):
@@ -375,55 +240,85 @@ async def get_coordinates_from_google_maps(address: str) -> tuple[Optional[float
                         lat = float(location['lat'])
                         lon = float(location['lng'])
                         return lat, lon
-                        
+                    
     except Exception as e:
-        print(f"Google Maps エラー: {str(e)}")
+        logger.warning("Google Maps エラー: %s", e)
     
     return None, None
 
 # 住所から座標を取得
-async def get_coordinates_from_address(address: str) -> tuple[Optional[float], Optional[float]]:
-    """住所から緯度経度を取得（複数のサービスを使用）"""
+async def get_coordinates_from_address(
+    address: str,
+    max_variations: int = GEOCODE_MAX_VARIATIONS,
+    stagger: float = GEOCODE_HEDGE_STAGGER,
+    budget_seconds: float = GEOCODE_BUDGET_SECONDS,
+) -> tuple[Optional[float], Optional[float]]:
+    """住所から緯度経度を取得（複数のサービスを並行に使用）"""
+    with span("geocode.resolve"):
+        return await _resolve_coordinates(address, max_variations, stagger, budget_seconds)
+
+async def _resolve_coordinates(
+    address: str,
+    max_variations: int,
+    stagger: float,
+    budget_seconds: float,
+) -> tuple[Optional[float], Optional[float]]:
     try:
         # 住所を正規化
         normalized_address = normalize_address(address)
-        print(f"正規化前: '{address}'")
-        print(f"正規化後: '{normalized_address}'")
+        logger.debug("住所を正規化: '%s' -> '%s'", address, normalized_address)
         
-        # 1. まずデータベース検索を試行
-        print(f"\n=== データベース検索を試行 ===")
+        # 0. まずローカルの住所データを検索（外部サービスより速く、過去のネガティブキャッシュより新しい）
         lat, lon = get_coordinates_from_database(normalized_address)
         if lat is not None and lon is not None:
+            geocode_results.inc(source="local")
+            return lat, lon
+        
+        # 1. 永続キャッシュを確認（ネガティブキャッシュを含む）
+        cached = geocode_cache.get(normalized_address)
+        if cached is not None:
+            lat, lon, provider = cached
+            logger.debug("キャッシュヒット: '%s' -> (%s, %s) [%s]", normalized_address, lat, lon, provider)
+            geocode_results.inc(source="cache")
             return lat, lon
         
         # 2. 住所のバリエーションを作成
         address_variations = create_address_variations(normalized_address)
-        print(f"試行する住所パターン: {address_variations}")
+        logger.debug("試行する住所パターン: %s", address_variations)
         
-        # 3. 複数のジオコーディングサービスを試行
+        # 3. 具体的な住所パターンから、両サービスへ少しずつずらして並行に問い合わせる
+        #    （同時実行数が1の Nominatim は1件ずつ、Google は上位のパターンをまとめて問い合わせる）
+        #    優先度は（住所パターンの順位, サービスの順位）で決まり、最上位の成功結果を採用する
         services = [
-            ("Nominatim", get_coordinates_from_nominatim),
-            ("Google Maps", get_coordinates_from_google_maps),
+            ("Nominatim", provider_limiters["nominatim"], get_coordinates_from_nominatim),
+            ("Google Maps", provider_limiters["google"], get_coordinates_from_google_maps),
         ]
         
-        for service_name, service_func in services:
-            print(f"\n=== {service_name} で座標取得を試行 ===")
-            for i, addr in enumerate(address_variations):
-                if not addr.strip():
-                    continue
-                
-                lat, lon = await service_func(addr)
-                if lat is not None and lon is not None:
-                    print(f"✅ {service_name} で住所 '{addr}' の座標を取得: ({lat}, {lon})")
-                    return lat, lon
-                else:
-                    print(f"❌ {service_name} で住所 '{addr}' の座標が見つかりませんでした")
+        try:
+            result = await resolve_hedged(
+                address_variations[:max_variations], services, stagger=stagger, budget_seconds=budget_seconds,
+            )
+        except asyncio.TimeoutError as e:
+            # 予算切れは住所が存在しないとは限らないため、ネガティブキャッシュしない
+            logger.warning("住所 '%s' の座標取得がタイムアウトしました: %s", address, e)
+            geocode_results.inc(source="timeout")
+            return None, None
+        
+        if result is not None:
+            lat, lon, service_name, addr = result
+            logger.debug("%s で住所 '%s' の座標を取得: (%s, %s)", service_name, addr, lat, lon)
+            await geocode_cache.aset(normalized_address, lat, lon, service_name)
+            geocode_results.inc(source="provider")
+            return lat, lon
         
-        print(f"❌ 全てのサービスで住所 '{address}' の座標を取得できませんでした")
+        logger.info("全てのサービスで住所 '%s' の座標を取得できませんでした", address)
+        await geocode_cache.aset(normalized_address, None, None, None)
+        geocode_results.inc(source="not_found")
         return None, None
         
     except Exception as e:
-        print(f"❌ 住所 '{address}' の座標取得でエラー: {str(e)}")
+        logger.exception("住所 '%s' の座標取得でエラー: %s", address, e)
+        geocode_results.inc(source="error")
         return None, None
 
 # APIエンドポイント
@@ -435,61 +330,215 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow()}
 
+@app.get("/api/geocode/cache/stats")
+async def get_geocode_cache_stats():
+    """ジオコーディングキャッシュの統計を取得"""
+    return geocode_cache.stats()
+
+@app.get("/api/geocode/gazetteer/stats")
+async def get_gazetteer_stats():
+    """地名辞書の統計を取得"""
+    return gazetteer.stats()
+
+@app.get("/api/geocode/local")
+async def geocode_locally(address: str = Query(..., description="住所")):
+    """ローカルの住所データだけで住所の座標を取得（外部サービスは使わない。precision は block / chome / town / landmark）"""
+    result = local_geocoder.lookup(address)
+    if result is None:
+        raise HTTPException(status_code=404, detail="ローカルの住所データに該当する住所がありません")
+    return {
+        "address": address,
+        "latitude": result.latitude,
+        "longitude": result.longitude,
+        "precision": result.precision,
+        "matched": result.key,
+    }
+
+@app.get("/api/geocode/local/stats")
+async def get_local_geocoder_stats():
+    """ローカルの住所データ（街区・地名辞書）の統計を取得"""
+    return local_geocoder.stats()
+
+@app.get("/api/response-cache/stats")
+async def get_response_cache_stats():
+    """スポット・プランのレスポンスキャッシュの統計を取得"""
+    return catalog_cache.stats()
+
+@app.get("/api/http-pool/stats")
+async def get_http_pool_stats():
+    """外部プロバイダ用 HTTP クライアントプールの利用状況を取得"""
+    return http_clients.stats()
+
 # CORSプリフライトリクエスト用のエンドポイント
+
+# /metrics の取得時に各コンポーネントの統計を読み出す
+def collect_cache_metrics():
+    """キャッシュの参照数（ヒット率は rate(hit) / rate(hit + miss) で求める）"""
+    catalog = catalog_cache.stats()
+    lookups = [
+        ("geocode", geocode_cache.hits + geocode_cache.negative_hits, geocode_cache.misses),
+        ("directions", directions_cache.memory_hits + directions_cache.disk_hits, directions_cache.misses),
+        ("local_geocoder", sum(local_geocoder.hits.values()), local_geocoder.misses),
+        ("catalog", catalog["hits"], catalog["misses"]),
+    ]
+    for name, stats in address_cache_stats().items():
+        lookups.append((f"address_{name}", stats["hits"], stats["misses"]))
+    samples = []
+    for cache, hits, misses in lookups:
+        samples.append(({"cache": cache, "result": "hit"}, hits))
+        samples.append(({"cache": cache, "result": "miss"}, misses))
+    yield "nerima_cache_lookups_total", "counter", "キャッシュの参照数（result: hit / miss）", samples
+
+def collect_import_metrics():
+    """CSV取り込みジョブの処理量（スループットは rate(nerima_import_rows_processed_total)）"""
+    stats = import_jobs.stats()
+    yield "nerima_import_rows_processed_total", "counter", "取り込みジョブで処理したCSVの行数", [({}, stats["rows_processed"])]
+    yield "nerima_import_spots_created_total", "counter", "取り込みジョブで登録したスポット数", [({}, stats["spots_created"])]
+    yield "nerima_import_jobs", "gauge", "待機中・実行中の取り込みジョブ数", [
+        ({"status": status}, stats[status]) for status in ("queued", "running")
+    ]
+    yield "nerima_import_jobs_finished_total", "counter", "終了した取り込みジョブ数", [
+        ({"status": status}, count) for status, count in stats["finished"].items()
+    ]
+
+def collect_http_pool_metrics():
+    """外部プロバイダへの同時リクエスト数"""
+    yield "nerima_provider_in_flight", "gauge", "外部プロバイダへの実行中のリクエスト数", [
+        ({"provider": provider}, stats["in_flight"]) for provider, stats in http_clients.stats().items()
+    ]
+
+metrics.register_collector(collect_cache_metrics)
+metrics.register_collector(collect_import_metrics)
+metrics.register_collector(collect_http_pool_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus のテキスト形式のメトリクス（リクエスト・外部プロバイダ・DB の所要時間、キャッシュ、取り込み）"""
+    return Response(content=metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
 @app.options("/{path:path}")
 async def options_handler(path: str):
     return {"message": "OK"}
 
 # スポット関連のエンドポイント
 @app.get("/api/plans")
-async def get_plans(db: Session = Depends(get_db)):
-    """登録されているプランの一覧を取得"""
-    plans = db.query(Spot.plan).filter(Spot.plan.isnot(None), Spot.plan != "").distinct().all()
-    plan_list = [plan[0] for plan in plans if plan[0]]
-    return {"plans": plan_list}
-
-@app.get("/api/spots", response_model=List[SpotResponse])
-async def get_spots(db: Session = Depends(get_db)):
-    """全スポットを取得"""
-    spots = db.query(Spot).all()
-    # 手動でレスポンスを構築
+async def get_plans(request: Request, db: AsyncSession = Depends(get_read_db)):
+    """登録されているプランの一覧を取得（ETag 付き。変更がなければ 304）"""
+    async def build(headers):
+        result = await db.execute(
+            select(Spot.plan).where(Spot.plan.isnot(None), Spot.plan != "").distinct()
+        )
+        plans = result.all()
+        plan_list = [plan[0] for plan in plans if plan[0]]
+        return {"plans": plan_list}
+    
+    return await catalog_cache.respond(request, ("plans",), build)
+
+# GET /api/spots で選択可能な列
+SPOT_COLUMNS = {name: getattr(Spot, name) for name in SpotResponse.model_fields}
+SPOT_LIST_FIELDS = list(SpotListItem.model_fields)
+
+@app.get("/api/spots")
+async def get_spots(
+    request: Request,
+    cursor: Optional[int] = Query(None, description="このIDより後のスポットを返す（前ページの X-Next-Cursor）"),
+    limit: Optional[int] = Query(None, gt=0, le=1000, description="1ページの件数（省略時は全件）"),
+    fields: Optional[str] = Query(None, description="取得する列（カンマ区切り）"),
+    plan: Optional[str] = Query(None, description="プランで絞り込み"),
+    view: str = Query("full", pattern="^(full|list)$", description="list: 地図・一覧用の軽量表示"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """スポットを取得（IDによるキーセットページネーション・列の射影に対応。ETag 付き）"""
+    if fields:
+        field_names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = [name for name in field_names if name not in SPOT_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"不明なフィールドです: {', '.join(unknown)}")
+        # カーソルに使うため id は常に含める
+        field_names = ['id'] + [name for name in dict.fromkeys(field_names) if name != 'id']
+    elif view == "list":
+        field_names = SPOT_LIST_FIELDS
+    else:
+        field_names = list(SPOT_COLUMNS)
+    
+    async def build(headers):
+        # 必要な列だけを SELECT する
+        query = select(*[SPOT_COLUMNS[name] for name in field_names])
+        if plan is not None:
+            query = query.where(Spot.plan == plan)
+        if cursor is not None:
+            query = query.where(Spot.id > cursor)
+        query = query.order_by(Spot.id)
+        
+        if limit is None:
+            rows = (await db.execute(query)).all()
+        else:
+            # 次ページの有無を判定するため1件多く取得
+            rows = (await db.execute(query.limit(limit + 1))).all()
+            if len(rows) > limit:
+                rows = rows[:limit]
+                headers["X-Next-Cursor"] = str(rows[-1].id)
+        
+        return [dict(row._mapping) for row in rows]
+    
+    key = ("spots", tuple(field_names), plan, cursor, limit)
+    return await catalog_cache.respond(request, key, build)
+
+@app.get("/api/spots/nearby", response_model=List[SpotNearbyResponse])
+async def get_nearby_spots(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0, le=SPATIAL_INDEX_MAX_RADIUS_KM),
+    k: Optional[int] = Query(None, gt=0, le=500),
+    plan: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """指定地点の近くにあるスポットを近い順に取得（SPATIAL_INDEX_MAX_RADIUS_KM より遠いスポットは含まない）"""
+    if radius_km is None and k is None:
+        k = 20
+    nearest = spot_index.nearby(lat, lng, radius_km=radius_km, k=k, plan=plan)
+    if not nearest:
+        return []
+    
+    spots_by_id = {
+        spot.id: spot
+        for spot in (await db.scalars(select(Spot).where(Spot.id.in_([spot_id for _, spot_id in nearest]))))
+    }
     return [
-        SpotResponse(
-            id=spot.id,
-            name=spot.name,
-            address=spot.address,
-            latitude=spot.latitude,
-            longitude=spot.longitude,
-            description=spot.description,
-            plan=spot.plan,
-            image_url=spot.image_url,
-            visit_duration=spot.visit_duration,
-            created_at=spot.created_at,
-            updated_at=spot.updated_at
-        ) for spot in spots
+        SpotNearbyResponse(
+            **SpotResponse.model_validate(spots_by_id[spot_id]).model_dump(),
+            distance_km=round(distance, 3)
+        )
+        for distance, spot_id in nearest
+        if spot_id in spots_by_id
     ]
 
 @app.get("/api/spots/{spot_id}", response_model=SpotResponse)
-async def get_spot(spot_id: int, db: Session = Depends(get_db)):
+async def get_spot(spot_id: int, db: AsyncSession = Depends(get_read_db)):
     """特定のスポットを取得"""
-    spot = db.query(Spot).filter(Spot.id == spot_id).first()
+    spot = await db.get(Spot, spot_id)
     if not spot:
         raise HTTPException(status_code=404, detail="スポットが見つかりません")
     return spot
 
+SPOT_TABLE_COLUMNS = set(Spot.__table__.columns.keys())
+
 @app.post("/api/spots", response_model=SpotResponse)
-async def create_spot(spot: SpotCreate, db: Session = Depends(get_db)):
+async def create_spot(spot: SpotCreate, db: AsyncSession = Depends(get_db)):
     """新しいスポットを作成"""
-    db_spot = Spot(**spot.model_dump())
+    # SpotCreate にはデータベースに列がない項目（tags など）も含まれるため、列がある項目だけを保存する
+    db_spot = Spot(**spot.model_dump(include=SPOT_TABLE_COLUMNS))
     db.add(db_spot)
-    db.commit()
-    db.refresh(db_spot)
+    await db.commit()
+    await db.refresh(db_spot)
+    spot_index.upsert(db_spot.id, db_spot.latitude, db_spot.longitude, db_spot.plan)
+    catalog_cache.bump()
     return db_spot
 
 @app.put("/api/spots/{spot_id}", response_model=SpotResponse)
-async def update_spot(spot_id: int, spot: SpotUpdate, db: Session = Depends(get_db)):
+async def update_spot(spot_id: int, spot: SpotUpdate, db: AsyncSession = Depends(get_db)):
     """スポットを更新"""
-    db_spot = db.query(Spot).filter(Spot.id == spot_id).first()
+    db_spot = await db.get(Spot, spot_id)
     if not db_spot:
         raise HTTPException(status_code=404, detail="スポットが見つかりません")
     
@@ -497,14 +546,16 @@ async def update_spot(spot_id: int, spot: SpotUpdate, db: Session = Depends(get_
     for field, value in update_data.items():
         setattr(db_spot, field, value)
     
-    db.commit()
-    db.refresh(db_spot)
+    await db.commit()
+    await db.refresh(db_spot)
+    spot_index.upsert(db_spot.id, db_spot.latitude, db_spot.longitude, db_spot.plan)
+    catalog_cache.bump()
     return db_spot
 
 @app.put("/api/spots/{spot_id}")
-async def update_spot(spot_id: int, spot_update: SpotUpdate, db: Session = Depends(get_db)):
+async def update_spot(spot_id: int, spot_update: SpotUpdate, db: AsyncSession = Depends(get_db)):
     """スポット情報を更新"""
-    spot = db.query(Spot).filter(Spot.id == spot_id).first()
+    spot = await db.get(Spot, spot_id)
     if not spot:
         raise HTTPException(status_code=404, detail="スポットが見つかりません")
     
@@ -514,325 +565,579 @@ async def update_spot(spot_id: int, spot_update: SpotUpdate, db: Session = Depen
         setattr(spot, field, value)
     
     spot.updated_at = datetime.now()
-    db.commit()
-    db.refresh(spot)
+    await db.commit()
+    await db.refresh(spot)
+    spot_index.upsert(spot.id, spot.latitude, spot.longitude, spot.plan)
+    catalog_cache.bump()
     
     return spot
 
 @app.delete("/api/spots/{spot_id}")
-async def delete_spot(spot_id: int, db: Session = Depends(get_db)):
+async def delete_spot(spot_id: int, db: AsyncSession = Depends(get_db)):
     """スポットを削除"""
-    db_spot = db.query(Spot).filter(Spot.id == spot_id).first()
+    db_spot = await db.get(Spot, spot_id)
     if not db_spot:
         raise HTTPException(status_code=404, detail="スポットが見つかりません")
     
-    db.delete(db_spot)
-    db.commit()
+    await db.delete(db_spot)
+    await db.commit()
+    spot_index.remove(spot_id)
+    catalog_cache.bump()
     return {"message": "スポットが削除されました"}
 
 # CSVアップロードエンドポイント
 @app.post("/api/upload/csv")
-async def upload_csv(file: UploadFile = File(...), db: Session = Depends(get_db)):
-    """CSVファイルをアップロードしてスポットデータをインポート"""
+async def upload_csv(
+    response: Response,
+    file: UploadFile = File(...),
+    background: bool = Query(False, description="true の場合は取り込みジョブの ID をすぐに返す（進捗は /api/imports/{job_id}）"),
+):
+    """CSVファイルをアップロードしてスポットデータをインポート
+
+    取り込みはワーカーのジョブとして実行する。background=false（既定）の場合は完了を待って
+    従来どおりの結果を返し、background=true の場合は 202 とジョブの状態をすぐに返す。
+    """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="CSVファイルをアップロードしてください")
     
     try:
-        # CSVファイルを読み込み（文字エンコーディングを自動検出）
-        content = await file.read()
-        
-        # 文字エンコーディングを自動検出（標準ライブラリを使用）
-        # 一般的な日本語エンコーディングを順番に試行
-        encodings = ['utf-8', 'shift_jis', 'cp932', 'euc-jp', 'iso-2022-jp']
-        csv_content = None
-        detected_encoding = 'utf-8'
-        
-        print(f"エンコーディング検出を開始...")
-        
-        for encoding in encodings:
-            if encoding is None:
-                continue
-            try:
-                csv_content = content.decode(encoding)
-                print(f"CSVファイルを {encoding} エンコーディングで読み込みました")
-                break
-            except (UnicodeDecodeError, LookupError):
-                continue
-        
-        if csv_content is None:
-            raise HTTPException(status_code=400, detail="CSVファイルの文字エンコーディングを判別できませんでした")
-        
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-        
-        created_spots = []
-        errors = []
-        skipped_duplicates = []
-        
-        # CSVアップロード履歴を記録
-        csv_upload = CSVUpload(
-            filename=file.filename,
-            spot_count=0
-        )
-        db.add(csv_upload)
-        db.flush()  # IDを取得するためにflush
-        
-        for row_num, row in enumerate(csv_reader, start=2):  # ヘッダー行を除く
-            try:
-                # 必須フィールドのチェック
-                if not row.get('name') or not row.get('address'):
-                    errors.append(f"行 {row_num}: 名前と住所は必須です")
-                    continue
-                
-                # 重複チェック（同じ名前のスポットが既に存在するかチェック）
-                existing_spot = db.query(Spot).filter(Spot.name == row['name']).first()
-                if existing_spot:
-                    skipped_duplicates.append({
-                        'row': row_num,
-                        'name': row['name'],
-                        'address': row['address'],
-                        'existing_id': existing_spot.id,
-                        'existing_address': existing_spot.address
-                    })
-                    continue
-                
-                # 座標が未設定の場合は住所から取得
-                latitude = row.get('latitude')
-                longitude = row.get('longitude')
-                
-                if not latitude or not longitude:
-                    lat, lon = await get_coordinates_from_address(row['address'])
-                    if lat and lon:
-                        latitude = lat
-                        longitude = lon
-                    else:
-                        errors.append(f"行 {row_num}: 住所 '{row['address']}' の座標が見つかりませんでした")
-                        continue
-                
-                # プラン名の処理（新規プランの場合はそのまま使用）
-                plan_name = row.get('plan', '').strip()
-                
-                # スポットを作成
-                spot_data = {
-                    'name': row['name'],
-                    'address': row['address'],
-                    'latitude': float(latitude) if latitude else None,
-                    'longitude': float(longitude) if longitude else None,
-                    'description': row.get('description', ''),
-                    'plan': plan_name,
-                    'image_url': row.get('image_url', ''),
-                    'visit_duration': int(row['visit_duration']) if row.get('visit_duration') else None
-                }
-                
-                db_spot = Spot(**spot_data)
-                db.add(db_spot)
-                db.flush()  # IDを取得
-                
-                created_spots.append({
-                    'id': db_spot.id,
-                    'name': db_spot.name,
-                    'address': db_spot.address,
-                    'latitude': db_spot.latitude,
-                    'longitude': db_spot.longitude,
-                    'description': db_spot.description,
-                    'plan': db_spot.plan,
-                    'image_url': db_spot.image_url,
-                    'visit_duration': db_spot.visit_duration
-                })
-                
-            except Exception as e:
-                errors.append(f"行 {row_num}: {str(e)}")
-        
-        # CSVアップロード履歴を更新
-        csv_upload.spot_count = len(created_spots)
-        csv_upload.success = len(errors) == 0
-        
-        # 新規追加されたプラン名を取得
-        new_plans = []
-        if created_spots:
-            for spot in created_spots:
-                if spot.get('plan') and spot['plan'] not in new_plans:
-                    new_plans.append(spot['plan'])
-        
-        db.commit()
-        
-        return {
-            "message": f"CSVファイルが正常にアップロードされました",
-            "created_spots": created_spots,
-            "total_spots": len(created_spots),
-            "skipped_duplicates": skipped_duplicates,
-            "duplicate_count": len(skipped_duplicates),
-            "new_plans": new_plans,
-            "new_plan_count": len(new_plans),
-            "errors": errors,
-            "error_count": len(errors)
-        }
-        
+        job = await import_jobs.submit(file.filename, file.file, keep_results=not background)
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=f"CSVファイルの処理中にエラーが発生しました: {str(e)}")
+    
+    if background:
+        response.status_code = 202
+        return {
+            **job.snapshot,
+            "status_url": f"/api/imports/{job.id}",
+            "events_url": f"/api/imports/{job.id}/events",
+        }
+    
+    # クライアントが切断してもジョブは続行する
+    await job.done.wait()
+    if job.status == "failed":
+        raise HTTPException(status_code=job.error_status or 500, detail=job.snapshot["message"])
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail="CSVファイルの取り込みが取り消されました")
+    
+    created_spots = job.result['created_spots']
+    skipped_duplicates = job.result['skipped_duplicates']
+    errors = job.result['errors']
+    
+    # 新規追加されたプラン名を取得
+    new_plans = []
+    for spot in created_spots:
+        if spot.get('plan') and spot['plan'] not in new_plans:
+            new_plans.append(spot['plan'])
+    
+    return {
+        "message": f"CSVファイルが正常にアップロードされました",
+        "job_id": job.id,
+        "created_spots": created_spots,
+        "total_spots": len(created_spots),
+        "skipped_duplicates": skipped_duplicates,
+        "duplicate_count": len(skipped_duplicates),
+        "new_plans": new_plans,
+        "new_plan_count": len(new_plans),
+        "errors": errors,
+        "error_count": len(errors)
+    }
+
+@app.get("/api/imports")
+async def list_import_jobs(
+    limit: int = Query(20, ge=1, le=100, description="取得件数（新しい順）"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """CSV取り込みジョブの一覧（新しい順）とワーカーの状態を取得"""
+    result = await db.execute(select(CSVUpload).order_by(CSVUpload.id.desc()).limit(limit))
+    jobs = []
+    for upload in result.scalars().all():
+        job = import_jobs.get(upload.id)
+        # 実行中のジョブはコミット前の最新の進捗をメモリから返す
+        jobs.append(job.snapshot if job is not None else upload_status(upload))
+    return {"jobs": jobs, "stats": import_jobs.stats()}
+
+@app.get("/api/imports/{job_id}")
+async def get_import_job(job_id: int, db: AsyncSession = Depends(get_read_db)):
+    """CSV取り込みジョブの進捗を取得（ポーリング用。行ごとのエラーを含む）"""
+    upload = await db.get(CSVUpload, job_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="取り込みジョブが見つかりません")
+    return upload_status(upload, include_errors=True)
+
+@app.get("/api/imports/{job_id}/events")
+async def stream_import_job(job_id: int, db: AsyncSession = Depends(get_read_db)):
+    """CSV取り込みジョブの進捗を Server-Sent Events で配信（ジョブが終了した時点で閉じる）"""
+    job = import_jobs.get(job_id)
+    if job is None:
+        # 終了済みで古いジョブは現在の状態を1回だけ送る
+        upload = await db.get(CSVUpload, job_id)
+        if not upload:
+            raise HTTPException(status_code=404, detail="取り込みジョブが見つかりません")
+        events = iter([progress_event(upload_status(upload))])
+    else:
+        events = import_jobs.events(job)
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/api/imports/{job_id}/cancel")
+async def cancel_import_job(job_id: int, db: AsyncSession = Depends(get_read_db)):
+    """待機中・実行中のCSV取り込みジョブを取り消す（コミット済みのバッチのスポットは残る）"""
+    snapshot = await import_jobs.cancel(job_id)
+    if snapshot is None:
+        if import_jobs.get(job_id) is None and not await db.get(CSVUpload, job_id):
+            raise HTTPException(status_code=404, detail="取り込みジョブが見つかりません")
+        raise HTTPException(status_code=409, detail="取り込みジョブは既に終了しています")
+    return snapshot
+
+# 距離行列エンドポイント
+DISTANCE_MATRIX_MAX_CELLS = 1_000_000
+
+@app.post("/api/distance-matrix")
+async def get_distance_matrix(request: DistanceMatrixRequest):
+    """多対多の距離（km）・移動時間（分）行列を計算"""
+    destinations = request.destinations if request.destinations is not None else request.origins
+    if any(len(point) != 2 for point in request.origins + destinations):
+        raise HTTPException(status_code=400, detail="座標は [lat, lng] の形式で指定してください")
+    if len(request.origins) * len(destinations) > DISTANCE_MATRIX_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"行列のサイズは {DISTANCE_MATRIX_MAX_CELLS} 要素までです")
+    
+    distances = haversine_matrix(request.origins, request.destinations)
+    durations = travel_time_matrix(distances, request.transport_mode)
+    return {
+        "transport_mode": request.transport_mode,
+        "distances": distances.round(3).tolist(),
+        "durations": durations.tolist(),
+    }
 
 # 気分別スポット取得エンドポイント
 
+# ルート生成の共通処理
+async def ensure_spot_coordinates(spots) -> List[Spot]:
+    """座標が未設定のスポットを住所からジオコーディングして保存し、取得できなかったスポットを返す
+
+    住所の重複を除いて並行に解決し、結果は1つの書き込み用セッションでまとめて保存する。
+    """
+    missing = [spot for spot in spots if not spot.latitude or not spot.longitude]
+    if not missing:
+        return []
+    
+    geocoded = await geocode_addresses([spot.address for spot in missing], get_coordinates_from_address)
+    failed = []
+    updated = []
+    for spot in missing:
+        lat, lon = geocoded.get(spot.address, (None, None))
+        if lat and lon:
+            spot.latitude = lat
+            spot.longitude = lon
+            updated.append(spot)
+        else:
+            failed.append(spot)
+    
+    if updated:
+        # 読み取り用セッションでは書き込めないため、短い書き込み用セッションで保存する
+        async with AsyncSessionLocal() as writer:
+            for spot in updated:
+                await writer.execute(
+                    update(Spot).where(Spot.id == spot.id).values(latitude=spot.latitude, longitude=spot.longitude)
+                )
+            await writer.commit()
+        for spot in updated:
+            spot_index.upsert(spot.id, spot.latitude, spot.longitude, spot.plan)
+        catalog_cache.bump()
+    return failed
+
+@span("route.build")
+def build_route(
+    start_lat: float,
+    start_lng: float,
+    spots,
+    transport_mode: str,
+    return_to_start: bool,
+    optimize: bool,
+    dist,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+) -> dict:
+    """出発地とスポットからルートを組み立てる
+
+    dist はインデックス0を出発地、1..n を spots とする距離行列（km）。
+    optimize が False の場合は spots の順に訪問する。
+    start_time を指定すると営業時間（opening_hours）と滞在時間を考慮した時刻付きの行程を作り、
+    各地点に到着・出発時刻を付ける。時間内に訪問できないスポットは schedule.infeasible_spots に入る。
+    """
+    order = list(range(1, len(spots) + 1))
+    
+    # 営業時間を考慮したスケジュール
+    schedule = None
+    if start_time is not None:
+        weekday = start_time.weekday()
+        stops = [
+            Stop(spot.visit_duration or 0, opening_windows(spot.opening_hours, weekday))
+            for spot in spots
+        ]
+        day_start = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+        start_minute = int((start_time - day_start).total_seconds() // 60)
+        end_minute = int((end_time - day_start).total_seconds() // 60) if end_time else None
+        schedule = schedule_visits(
+            travel_time_matrix(np.asarray(dist), transport_mode).tolist(),
+            stops, start_minute, end_minute, return_to_start, optimize,
+        )
+        order = schedule.order
+    
+    # 訪問順序の最適化
+    optimization = None
+    if optimize:
+        original_distance = tour_length(dist, sorted(order), return_to_start)
+        if schedule is None:
+            order, solver = optimize_visit_order(dist, return_to_start)
+        else:
+            solver = schedule.solver
+        optimized_distance = tour_length(dist, order, return_to_start)
+        optimization = {
+            "solver": solver,
+            "original_distance": round(original_distance, 2),
+            "optimized_distance": round(optimized_distance, 2),
+            "improvement_distance": round(original_distance - optimized_distance, 2),
+            "improvement_percent": round(
+                (original_distance - optimized_distance) / original_distance * 100, 1
+            ) if original_distance > 0 else 0.0,
+        }
+    
+    # ルート計算（距離・時間計算付き）
+    route_points = [{
+        "id": "start",
+        "name": "出発地",
+        "address": "出発地",
+        "latitude": start_lat,
+        "longitude": start_lng,
+        "description": "出発地",
+        "plan": None,
+        "visit_duration": 0,
+        "distance_from_previous": 0,
+        "travel_time_from_previous": 0
+    }]
+    total_distance = 0
+    total_travel_time = 0
+    
+    prev = 0
+    for node in order:
+        spot = spots[node - 1]
+        distance = dist[prev][node]
+        travel_time = calculate_travel_time(distance, transport_mode)
+        route_points.append({
+            "id": spot.id,
+            "name": spot.name,
+            "address": spot.address,
+            "latitude": spot.latitude,
+            "longitude": spot.longitude,
+            "description": spot.description,
+            "plan": spot.plan,
+            "visit_duration": spot.visit_duration or 0,
+            "distance_from_previous": distance,
+            "travel_time_from_previous": travel_time
+        })
+        total_distance += distance
+        total_travel_time += travel_time
+        prev = node
+    
+    # 最後のスポットから出発地に戻る
+    if return_to_start:
+        distance = dist[prev][0]
+        travel_time = calculate_travel_time(distance, transport_mode)
+        route_points.append({
+            "id": "return",
+            "name": "出発地に戻る",
+            "address": "出発地",
+            "latitude": start_lat,
+            "longitude": start_lng,
+            "description": "出発地に戻りました",
+            "plan": None,
+            "visit_duration": 0,
+            "distance_from_previous": distance,
+            "travel_time_from_previous": travel_time
+        })
+        total_distance += distance
+        total_travel_time += travel_time
+    
+    # 総滞在時間を計算
+    total_visit_time = sum(point.get("visit_duration", 0) for point in route_points)
+    total_duration = total_travel_time + total_visit_time
+    
+    route = {
+        "message": "ルートが生成されました",
+        "route_points": route_points,
+        "total_points": len(route_points),
+        "transport_mode": transport_mode,
+        "return_to_start": return_to_start,
+        "total_distance": round(total_distance, 2),
+        "total_travel_time": total_travel_time,
+        "total_visit_time": total_visit_time,
+        "total_duration": total_duration,
+        "optimization": optimization
+    }
+    
+    if schedule is not None:
+        # 各地点に時刻を付ける（待ち時間を含めるため total_duration は出発から終了までの時間になる）
+        route_points[0]["departure_time"] = start_time.isoformat(timespec="minutes")
+        for point, arrival, start, departure in zip(
+            route_points[1:], schedule.arrivals, schedule.starts, schedule.departures
+        ):
+            point["arrival_time"] = minute_to_datetime(start_time, arrival).isoformat(timespec="minutes")
+            point["visit_start_time"] = minute_to_datetime(start_time, start).isoformat(timespec="minutes")
+            point["departure_time"] = minute_to_datetime(start_time, departure).isoformat(timespec="minutes")
+            point["wait_time"] = start - arrival
+        end = minute_to_datetime(start_time, schedule.end_minute)
+        if return_to_start:
+            route_points[-1]["arrival_time"] = end.isoformat(timespec="minutes")
+        route["total_duration"] = schedule.end_minute - schedule.start_minute
+        route["schedule"] = {
+            "start_time": start_time.isoformat(timespec="minutes"),
+            "end_time": end.isoformat(timespec="minutes"),
+            "total_wait_time": schedule.wait_minutes,
+            "solver": schedule.solver,
+            "infeasible_spots": [
+                {"id": spots[node - 1].id, "name": spots[node - 1].name, "reason": reason}
+                for node, reason in schedule.infeasible
+            ],
+        }
+    return route
+
+def parse_route_times(start_time: Optional[str], end_time: Optional[str]):
+    """start_time / end_time（HH:MM または ISO 8601）を datetime に変換する（不正な値は 400）"""
+    if start_time is None:
+        if end_time is not None:
+            raise HTTPException(status_code=400, detail="end_time には start_time の指定が必要です")
+        return None, None
+    try:
+        start = parse_clock(start_time)
+        end = parse_clock(end_time, start) if end_time else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_time / end_time は HH:MM または ISO 8601 形式で指定してください")
+    if end is not None:
+        # タイムゾーンの有無が異なる場合は、無い方を有る方のタイムゾーンの時刻とみなして比較できるようにする
+        if start.tzinfo is None and end.tzinfo is not None:
+            start = start.replace(tzinfo=end.tzinfo)
+        elif start.tzinfo is not None:
+            end = end.replace(tzinfo=start.tzinfo) if end.tzinfo is None else end.astimezone(start.tzinfo)
+    if end is not None and end <= start:
+        raise HTTPException(status_code=400, detail="end_time は start_time より後にしてください")
+    return start, end
+
 # ルート生成エンドポイント（GET版）
 @app.get("/api/route")
 async def generate_route(
+    request: Request,
     start_lat: float = Query(...),
     start_lng: float = Query(...),
     spot_ids: str = Query(...),
     transport_mode: str = Query("walking"),
     return_to_start: bool = Query(True),
-    db: Session = Depends(get_db)
+    optimize: bool = Query(False),
+    start_time: Optional[str] = Query(None, description="出発時刻（HH:MM または ISO 8601）。指定すると営業時間を考慮した時刻付きの行程を返す"),
+    end_time: Optional[str] = Query(None, description="終了時刻（HH:MM または ISO 8601）"),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """スポットからルートを生成"""
+    """スポットからルートを生成（optimize が False の場合はスポットID順に訪問）"""
     try:
-        print(f"DEBUG: Received request - start_lat={start_lat}, start_lng={start_lng}, spot_ids={spot_ids}")
+        logger.debug("ルート生成: start=(%s, %s), spot_ids=%s", start_lat, start_lng, spot_ids)
+        
+        start, end = parse_route_times(start_time, end_time)
         
         # スポットIDを解析
-        spot_id_list = [int(id) for id in spot_ids.split(',')]
-        print(f"DEBUG: Parsed spot IDs: {spot_id_list}")
+        try:
+            spot_id_list = [int(id) for id in spot_ids.split(',')]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="spot_ids はカンマ区切りの整数で指定してください")
+        if len(set(spot_id_list)) > ROUTE_MAX_SPOTS:
+            raise HTTPException(status_code=400, detail=f"spot_ids は {ROUTE_MAX_SPOTS} 件以下にしてください")
         
         # スポットを取得
-        db_spots = db.query(Spot).filter(Spot.id.in_(spot_id_list)).all()
-        print(f"DEBUG: Found {len(db_spots)} spots in database")
+        db_spots = (await db.scalars(
+            select(Spot).where(Spot.id.in_(spot_id_list)).order_by(Spot.id)
+        )).all()
+        logger.debug("データベースから %d 件のスポットを取得", len(db_spots))
+        # 座標の取得とルート計算の間は読み取り用の接続を使わないため、先にプールへ返す
+        await db.commit()
         
         if not db_spots:
             raise HTTPException(status_code=404, detail="指定されたスポットが見つかりません")
         
         # 座標が未設定のスポットがある場合は住所から取得
-        for spot in db_spots:
-            if not spot.latitude or not spot.longitude:
-                lat, lon = await get_coordinates_from_address(spot.address)
-                if lat and lon:
-                    spot.latitude = lat
-                    spot.longitude = lon
-                    db.commit()
-                else:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"スポット '{spot.name}' の座標を取得できませんでした"
-                    )
+        failed = await ensure_spot_coordinates(db_spots)
+        if failed:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"スポット '{failed[0].name}' の座標を取得できませんでした"
+            )
         
-        # ルート計算（距離・時間計算付き）
-        route_points = []
-        total_distance = 0
-        total_travel_time = 0
+        points = [(start_lat, start_lng)] + [(spot.latitude, spot.longitude) for spot in db_spots]
+        dist = haversine_matrix(points).tolist()
+        # 訪問順序の最適化は CPU を使うため、イベントループを止めないようスレッドで実行する
+        route = await asyncio.to_thread(
+            build_route, start_lat, start_lng, db_spots, transport_mode, return_to_start, optimize, dist, start, end,
+        )
         
-        print(f"DEBUG: ルート生成開始 - スポット数: {len(db_spots)}, 出発地: ({start_lat}, {start_lng})")
+        logger.debug(
+            "ルート生成完了 - 総距離: %.2fkm, 総移動時間: %s分, 総滞在時間: %s分",
+            route['total_distance'], route['total_travel_time'], route['total_visit_time'],
+        )
         
-        # 出発地から最初のスポット
-        if db_spots:
-            first_spot = db_spots[0]
-            distance = calculate_distance(start_lat, start_lng, first_spot.latitude, first_spot.longitude)
-            travel_time = calculate_travel_time(distance, transport_mode)
-            
-            print(f"DEBUG: 出発地から最初のスポット({first_spot.name})への距離: {distance:.2f}km, 時間: {travel_time}分")
-            
-            route_points.append({
-                "id": "start",
-                "name": "出発地",
-                "address": "出発地",
-                "latitude": start_lat,
-                "longitude": start_lng,
-                "description": "出発地",
-                "plan": None,
-                "visit_duration": 0,
-                "distance_from_previous": 0,
-                "travel_time_from_previous": 0
-            })
-            
-            route_points.append({
-                "id": first_spot.id,
-                "name": first_spot.name,
-                "address": first_spot.address,
-                "latitude": first_spot.latitude,
-                "longitude": first_spot.longitude,
-                "description": first_spot.description,
-                "plan": first_spot.plan,
-                "visit_duration": first_spot.visit_duration or 0,
-                "distance_from_previous": distance,
-                "travel_time_from_previous": travel_time
-            })
-            
-            total_distance += distance
-            total_travel_time += travel_time
-            
-            # スポット間の移動
-            for i in range(1, len(db_spots)):
-                prev_spot = db_spots[i-1]
-                current_spot = db_spots[i]
-                
-                distance = calculate_distance(
-                    prev_spot.latitude, prev_spot.longitude,
-                    current_spot.latitude, current_spot.longitude
-                )
-                travel_time = calculate_travel_time(distance, transport_mode)
-                
-                print(f"DEBUG: {prev_spot.name}から{current_spot.name}への距離: {distance:.2f}km, 時間: {travel_time}分")
-                
-                route_points.append({
-                    "id": current_spot.id,
-                    "name": current_spot.name,
-                    "address": current_spot.address,
-                    "latitude": current_spot.latitude,
-                    "longitude": current_spot.longitude,
-                    "description": current_spot.description,
-                    "plan": current_spot.plan,
-                    "visit_duration": current_spot.visit_duration or 0,
-                    "distance_from_previous": distance,
-                    "travel_time_from_previous": travel_time
-                })
-                
-                total_distance += distance
-                total_travel_time += travel_time
-            
-            # 最後のスポットから出発地に戻る
-            if return_to_start:
-                last_spot = db_spots[-1]
-                distance = calculate_distance(
-                    last_spot.latitude, last_spot.longitude,
-                    start_lat, start_lng
-                )
-                travel_time = calculate_travel_time(distance, transport_mode)
-                
-                print(f"DEBUG: 最後のスポット({last_spot.name})から出発地への距離: {distance:.2f}km, 時間: {travel_time}分")
-                
-                route_points.append({
-                    "id": "return",
-                    "name": "出発地に戻る",
-                    "address": "出発地",
-                    "latitude": start_lat,
-                    "longitude": start_lng,
-                    "description": "出発地に戻りました",
-                    "plan": None,
-                    "visit_duration": 0,
-                    "distance_from_previous": distance,
-                    "travel_time_from_previous": travel_time
-                })
-                
-                total_distance += distance
-                total_travel_time += travel_time
+        return negotiated_response(request, route)
         
-        # 総滞在時間を計算
-        total_visit_time = sum(spot.get("visit_duration", 0) for spot in route_points)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"ルート生成中にエラーが発生しました: {str(e)}")
+
+# 一括ルート生成エンドポイント
+@app.post("/api/routes/batch")
+async def generate_routes_batch(
+    batch: RouteBatchRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """複数の行程のルートをまとめて生成
+    
+    全行程のスポットを1回のクエリで取得し、座標の取得も1回にまとめる。出発地と全スポットの
+    距離行列を1つだけ計算し、各行程はその部分行列を使うため、2件目以降のコストはほぼかからない。
+    結果は itineraries と同じ順で、行程ごとに status_code（200 / 400 / 404）を持つ。
+    """
+    try:
+        all_ids = sorted({spot_id for itinerary in batch.itineraries for spot_id in itinerary.spot_ids})
+        db_spots = (await db.scalars(select(Spot).where(Spot.id.in_(all_ids)).order_by(Spot.id))).all()
+        # 座標の取得とルート計算の間は読み取り用の接続を使わないため、先にプールへ返す
+        await db.commit()
+        spots_by_id = {spot.id: spot for spot in db_spots}
         
-        print(f"DEBUG: ルート生成完了 - 総距離: {total_distance:.2f}km, 総移動時間: {total_travel_time}分, 総滞在時間: {total_visit_time}分")
-        print(f"DEBUG: ルートポイント数: {len(route_points)}")
+        failed_ids = {spot.id for spot in await ensure_spot_coordinates(db_spots)}
+        located = [spot for spot in db_spots if spot.id not in failed_ids]
         
-        return {
-            "message": "ルートが生成されました",
-            "route_points": route_points,
-            "total_points": len(route_points),
-            "transport_mode": transport_mode,
-            "return_to_start": return_to_start,
-            "total_distance": round(total_distance, 2),
-            "total_travel_time": total_travel_time,
-            "total_visit_time": total_visit_time,
-            "total_duration": total_travel_time + total_visit_time
-        }
+        # 出発地（重複を除く）と全スポットの距離行列を1回で計算
+        starts = list(dict.fromkeys((itinerary.start_lat, itinerary.start_lng) for itinerary in batch.itineraries))
+        points = starts + [(spot.latitude, spot.longitude) for spot in located]
+        dist = haversine_matrix(points)
+        start_rows = {start: row for row, start in enumerate(starts)}
+        spot_rows = {spot.id: len(starts) + row for row, spot in enumerate(located)}
+        
+        results = []
+        for itinerary in batch.itineraries:
+            # /api/route と同じく、重複を除いてスポットID順にする
+            spots = [spots_by_id[spot_id] for spot_id in sorted(set(itinerary.spot_ids)) if spot_id in spots_by_id]
+            if not spots:
+                results.append({"id": itinerary.id, "status_code": 404, "detail": "指定されたスポットが見つかりません"})
+                continue
+            failed = [spot for spot in spots if spot.id in failed_ids]
+            if failed:
+                results.append({
+                    "id": itinerary.id,
+                    "status_code": 400,
+                    "detail": f"スポット '{failed[0].name}' の座標を取得できませんでした"
+                })
+                continue
+            
+            try:
+                start, end = parse_route_times(itinerary.start_time, itinerary.end_time)
+            except HTTPException as e:
+                results.append({"id": itinerary.id, "status_code": e.status_code, "detail": e.detail})
+                continue
+            
+            rows = [start_rows[(itinerary.start_lat, itinerary.start_lng)]] + [spot_rows[spot.id] for spot in spots]
+            route = await asyncio.to_thread(
+                build_route,
+                itinerary.start_lat, itinerary.start_lng, spots,
+                itinerary.transport_mode, itinerary.return_to_start, itinerary.optimize,
+                dist[np.ix_(rows, rows)].tolist(), start, end,
+            )
+            results.append({"id": itinerary.id, "status_code": 200, **route})
         
+        return negotiated_response(request, {
+            "results": results,
+            "total_itineraries": len(results),
+            "shared": {
+                "spots": len(db_spots),
+                "start_points": len(starts),
+                "matrix_size": len(points),
+            },
+        })
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ルート生成中にエラーが発生しました: {str(e)}")
 
+# プラン自動作成エンドポイント
+@app.post("/api/plans/build")
+async def build_plan_route(
+    plan_request: PlanBuildRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """時間予算内で評価が高く、カテゴリが偏らないスポットの組み合わせと順序を選んでルートを作成
+    
+    座標が登録済みのスポットだけを候補にする。スポット間の距離行列はプランごとにキャッシュし、
+    リクエストごとには出発地からの距離だけを計算する。
+    """
+    try:
+        # スポットが更新された場合に古い行列を使わないよう、読み込み前のバージョンを使う
+        version = catalog_cache.version
+        query = select(Spot).where(Spot.latitude.isnot(None), Spot.longitude.isnot(None)).order_by(Spot.id)
+        if plan_request.plan is not None:
+            query = query.where(Spot.plan == plan_request.plan)
+        pool = (await db.scalars(query)).all()
+        # プランの計算の間は読み取り用の接続を使わないため、先にプールへ返す
+        await db.commit()
+        if not pool:
+            raise HTTPException(status_code=404, detail="指定されたプランのスポットが見つかりません")
+        
+        points = [(spot.latitude, spot.longitude) for spot in pool]
+        spot_dist = plan_matrix_cache.get(("plan", plan_request.plan), version, [spot.id for spot in pool], points)
+        start_dist = haversine_matrix([(plan_request.start_lat, plan_request.start_lng)], points)[0]
+        dist = np.zeros((len(pool) + 1, len(pool) + 1))
+        dist[0, 1:] = start_dist
+        dist[1:, 0] = start_dist
+        dist[1:, 1:] = spot_dist
+        
+        with span("plan.build"):
+            result = await asyncio.to_thread(
+                build_plan,
+                travel_time_matrix(dist, plan_request.transport_mode),
+                [spot.visit_duration or DEFAULT_VISIT_DURATION for spot in pool],
+                [spot.rating or DEFAULT_SPOT_RATING for spot in pool],
+                [spot.category for spot in pool],
+                plan_request.time_budget,
+                plan_request.return_to_start,
+                plan_request.max_spots,
+            )
+        
+        rows = [0] + result.order
+        route = build_route(
+            plan_request.start_lat, plan_request.start_lng, [pool[node - 1] for node in result.order],
+            plan_request.transport_mode, plan_request.return_to_start, False,
+            dist[np.ix_(rows, rows)].tolist(),
+        )
+        route["plan_builder"] = {
+            "plan": plan_request.plan,
+            "time_budget": plan_request.time_budget,
+            "used_time": int(result.used_time),
+            "score": result.score,
+            "candidates": result.candidates,
+            "selected": len(result.order),
+            "categories": [
+                {"category": category, "count": count} for category, count in result.categories.items()
+            ],
+            "solver": result.solver,
+            "elapsed_ms": result.elapsed_ms,
+        }
+        return negotiated_response(request, route)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"プラン作成中にエラーが発生しました: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# これより時間のかかったスパンは WARNING で記録する（秒）
+SLOW_SPAN_SECONDS = float(os.getenv("SLOW_SPAN_SECONDS", "2"))
+
+# ヒストグラムの既定のバケット（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 収集時に値を返す関数の戻り値：(名前, 種類, 説明, [(ラベル, 値), ...])
+Sample = Tuple[Dict[str, str], float]
+Collector = Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def _labels(self, key: tuple) -> Dict[str, str]:
+        return dict(zip(self.label_names, key))
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """増加するだけの値（リクエスト数・エラー数など）"""
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self._labels(key))} {_format_value(value)}" for key, value in values]
+
+
+class Histogram(_Metric):
+    """値の分布（所要時間など）。バケットごとの件数と合計・件数を持つ"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル -> [バケットごとの件数（累積ではない。最後は +Inf）, 合計, 件数]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines = self.header()
+        for key, counts, total, count in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': _format_value(bound)})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Prometheus のテキスト形式で出力するメトリクスの登録先
+
+    カウンタ・ヒストグラムは記録した時点で更新し、キャッシュの統計などの既存の値は
+    register_collector に登録した関数で /metrics の取得時に読み出す。
+    """
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Collector] = []
+
+    def counter(self, name: str, help_text: str, label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception:
+                logger.exception("メトリクスの収集でエラーが発生しました: %r", collector)
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+# アプリ全体で共有するメトリクス
+metrics = MetricsRegistry()
+
+request_duration = metrics.histogram(
+    "nerima_http_request_duration_seconds", "HTTP リクエストの処理時間（ストリーミングは送信完了まで）",
+    ("method", "route", "status"),
+)
+provider_duration = metrics.histogram(
+    "nerima_provider_request_duration_seconds", "外部プロバイダ（Nominatim / Google / ORS）への問い合わせ時間（outcome: ok / error / cancelled）",
+    ("provider", "outcome"),
+)
+provider_errors = metrics.counter(
+    "nerima_provider_errors_total", "外部プロバイダへの問い合わせの失敗数（例外または HTTP 4xx / 5xx）", ("provider",),
+)
+db_query_duration = metrics.histogram(
+    "nerima_db_query_duration_seconds", "データベースのクエリの実行時間", ("engine", "operation"),
+)
+span_duration = metrics.histogram(
+    "nerima_span_duration_seconds", "処理単位（ルート計算・ジオコーディングなど）の所要時間（outcome: ok / error / cancelled）", ("span", "outcome"),
+)
+geocode_results = metrics.counter(
+    "nerima_geocode_results_total", "住所の座標取得の結果（local / cache / provider / not_found / timeout / error）", ("source",),
+)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """ブロックの所要時間を nerima_span_duration_seconds に記録する（async 関数の中でも with で使える）
+
+    取り消された場合（クライアントの切断など）はエラーではなく outcome="cancelled" として記録する。
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        span_duration.observe(elapsed, span=name, outcome=outcome)
+        if elapsed >= SLOW_SPAN_SECONDS:
+            logger.warning("%s に %.3f 秒かかりました", name, elapsed, extra={"span": name, "elapsed": elapsed})
+        else:
+            logger.debug("%s: %.1fms（%s）", name, elapsed * 1000, outcome)
+
+
+class MetricsMiddleware:
+    """リクエストごとの処理時間をルート（パスのテンプレート）単位で記録するミドルウェア"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # パスそのものではなくテンプレート（/api/spots/{spot_id}）を使い、ラベルの種類を抑える
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            request_duration.observe(
+                time.perf_counter() - started, method=scope["method"], route=route_path, status=str(status),
+            )
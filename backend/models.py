@@ -3,6 +3,8 @@ from typing import List, Optional, Dict, Any
 from datetime import datetime
 from decimal import Decimal
 
+from route_optimizer import ROUTE_MAX_SPOTS
+
 class SpotBase(BaseModel):
     """観光スポットの基本モデル"""
     name: str = Field(..., description="スポット名")
@@ -75,6 +77,9 @@ class SpotResponse(BaseModel):
     plan: Optional[str] = None
     image_url: Optional[str] = None
     visit_duration: Optional[int] = None
+    opening_hours: Optional[Dict[str, str]] = None
+    category: Optional[str] = None
+    rating: Optional[float] = None
     created_at: datetime
     updated_at: datetime
 
@@ -82,3 +87,49 @@ class SpotResponse(BaseModel):
         from_attributes = True
         # mood フィールドを明示的に除外
         exclude = {"mood"}
+
+class SpotListItem(BaseModel):
+    """一覧・地図表示用の軽量スポットモデル（説明文などを含まない）"""
+    id: int
+    name: str
+    address: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    plan: Optional[str] = None
+    visit_duration: Optional[int] = None
+
+class SpotNearbyResponse(SpotResponse):
+    """近隣スポット検索レスポンス用モデル"""
+    distance_km: float = Field(..., description="指定地点からの距離（km）")
+
+class DistanceMatrixRequest(BaseModel):
+    """距離行列リクエスト用モデル"""
+    origins: List[List[float]] = Field(..., description="出発地 [[lat, lng], ...]")
+    destinations: Optional[List[List[float]]] = Field(None, description="目的地 [[lat, lng], ...]（省略時は出発地同士）")
+    transport_mode: str = Field("walking", description="移動手段: walking, cycling, driving")
+
+class ItineraryRequest(BaseModel):
+    """一括ルート生成の1件分（/api/route のクエリパラメータと同じ項目）"""
+    id: Optional[str] = Field(None, description="結果と対応付けるための任意のID")
+    start_lat: float
+    start_lng: float
+    spot_ids: List[int] = Field(..., min_length=1, max_length=ROUTE_MAX_SPOTS)
+    transport_mode: str = Field("walking", description="移動手段: walking, cycling, driving")
+    return_to_start: bool = True
+    optimize: bool = False
+    start_time: Optional[str] = Field(None, description="出発時刻（HH:MM または ISO 8601）。指定すると営業時間を考慮して時刻付きの行程を作る")
+    end_time: Optional[str] = Field(None, description="終了時刻（HH:MM または ISO 8601）")
+
+class RouteBatchRequest(BaseModel):
+    """一括ルート生成リクエスト用モデル"""
+    itineraries: List[ItineraryRequest] = Field(..., min_length=1, max_length=100)
+
+class PlanBuildRequest(BaseModel):
+    """プラン自動作成リクエスト用モデル"""
+    start_lat: float
+    start_lng: float
+    plan: Optional[str] = Field(None, description="プラン（/api/plans の値。省略時は全スポットから選ぶ）")
+    transport_mode: str = Field("walking", description="移動手段: walking, cycling, driving")
+    time_budget: int = Field(..., gt=0, le=24 * 60, description="使える時間（分。移動時間と滞在時間の合計）")
+    return_to_start: bool = True
+    max_spots: Optional[int] = Field(None, gt=0, description="訪問するスポット数の上限")
@@ -0,0 +1,330 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from distance_matrix import haversine_matrix
+
+# 評価が未設定のスポットの評価
+DEFAULT_SPOT_RATING = 3.0
+
+# 滞在時間が未設定のスポットの滞在時間（分。SpotBase.visit_duration の既定値）
+DEFAULT_VISIT_DURATION = 60
+
+# 同じカテゴリの2件目以降のスコアの減衰率（k 件目は rating * DIVERSITY_DECAY ** k）
+DIVERSITY_DECAY = 0.5
+
+# 局所探索の打ち切り時間（秒）
+PLAN_BUILDER_TIME_LIMIT = 0.1
+
+# プランごとのスポット間距離行列を保持する件数
+PLAN_MATRIX_CACHE_ENTRIES = 16
+
+
+@dataclass
+class PlanResult:
+    """プラン作成の結果（order は候補のインデックス 1..n、時間はすべて分）"""
+    order: List[int]
+    score: float
+    used_time: float
+    travel_time: float
+    visit_time: float
+    candidates: int
+    iterations: int = 0
+    elapsed_ms: float = 0.0
+    solver: str = "greedy+local-search"
+    categories: Dict[Optional[str], int] = field(default_factory=dict)
+
+
+class _Orienteering:
+    """出発地（インデックス0）と候補 1..n の移動時間行列を使うオリエンテーリング問題
+
+    時間予算内で訪問する候補の部分集合と順序を選び、評価の合計（カテゴリの偏りは減衰）を最大にする。
+    行列の最後の列は終点（出発地に戻る場合は出発地、戻らない場合は移動時間0）を表す。
+    """
+
+    def __init__(
+        self,
+        travel: np.ndarray,
+        durations: Sequence[float],
+        ratings: Sequence[float],
+        categories: Sequence[Optional[str]],
+        budget: float,
+        return_to_start: bool,
+        decay: float,
+    ):
+        size = len(travel)
+        self.end = size
+        self.travel = np.zeros((size + 1, size + 1))
+        self.travel[:size, :size] = travel
+        if return_to_start:
+            self.travel[:size, size] = travel[:, 0]
+        self.durations = np.concatenate(([0.0], np.asarray(durations, dtype=float), [0.0]))
+        self.ratings = np.concatenate(([0.0], np.asarray(ratings, dtype=float), [0.0]))
+        codes: Dict[Optional[str], int] = {}
+        self.category_names = list(categories)
+        self.category_codes = np.array(
+            [-1] + [codes.setdefault(category, len(codes)) for category in categories] + [-1]
+        )
+        self.category_members = {
+            code: np.flatnonzero(self.category_codes == code) for code in codes.values()
+        }
+        self.budget = budget
+        self.decay = decay
+
+    # スコア
+    def _category_score(self, ratings: np.ndarray) -> float:
+        ordered = np.sort(ratings)[::-1]
+        return float(np.sum(ordered * self.decay ** np.arange(len(ordered))))
+
+    def score(self, nodes: Sequence[int]) -> float:
+        nodes = np.asarray(nodes, dtype=int)
+        if not len(nodes):
+            return 0.0
+        codes = self.category_codes[nodes]
+        return sum(self._category_score(self.ratings[nodes[codes == code]]) for code in np.unique(codes))
+
+    def marginal_gains(self, nodes: Sequence[int]) -> np.ndarray:
+        """各候補を nodes に加えたときのスコアの増分（同じカテゴリの評価順で減衰を掛け直す）"""
+        gains = self.ratings.copy()
+        nodes = np.asarray(nodes, dtype=int)
+        if not len(nodes):
+            return gains
+        codes = self.category_codes[nodes]
+        for code in np.unique(codes):
+            selected = np.sort(self.ratings[nodes[codes == code]])[::-1]
+            weights = self.decay ** np.arange(len(selected) + 1)
+            # suffix[p] = Σ_{i>=p} selected[i] * decay^i
+            suffix = np.concatenate((np.cumsum((selected * weights[:-1])[::-1])[::-1], [0.0]))
+            members = self.category_members[code]
+            ratings = self.ratings[members]
+            rank = np.searchsorted(-selected, -ratings, side="right")
+            gains[members] = ratings * weights[rank] - (1 - self.decay) * suffix[rank]
+        return gains
+
+    # 時間
+    def route_time(self, route: Sequence[int]) -> Tuple[float, float]:
+        """(移動時間, 滞在時間)"""
+        path = [0] + list(route) + [self.end]
+        travel = float(self.travel[path[:-1], path[1:]].sum())
+        return travel, float(self.durations[list(route)].sum())
+
+    def insertion_costs(self, route: Sequence[int], candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """各候補を route に挿入したときの最小の追加時間（移動 + 滞在）とその位置"""
+        prevs = np.array([0] + list(route))
+        nexts = np.array(list(route) + [self.end])
+        added = (
+            self.travel[np.ix_(prevs, candidates)]
+            + self.travel[np.ix_(candidates, nexts)].T
+            - self.travel[prevs, nexts][:, None]
+        )
+        positions = np.argmin(added, axis=0)
+        return added[positions, np.arange(len(candidates))] + self.durations[candidates], positions
+
+    # 探索
+    def greedy_insert(self, route: List[int], available: np.ndarray) -> int:
+        """時間あたりのスコア増分が最も大きい候補を予算が尽きるまで挿入し、挿入した件数を返す"""
+        inserted = 0
+        used = sum(self.route_time(route))
+        while available.any():
+            candidates = np.flatnonzero(available)
+            costs, positions = self.insertion_costs(route, candidates)
+            feasible = used + costs <= self.budget + 1e-9
+            if not feasible.any():
+                break
+            gains = self.marginal_gains(route)[candidates]
+            ratio = np.where(feasible, gains / np.maximum(costs, 1e-6), -np.inf)
+            best = int(np.argmax(ratio))
+            node = int(candidates[best])
+            route.insert(int(positions[best]), node)
+            available[node] = False
+            used += float(costs[best])
+            inserted += 1
+        return inserted
+
+    def two_opt(self, route: List[int]) -> List[int]:
+        """区間反転で移動時間を短くする（滞在時間は順序によらないため移動時間だけを比べる）"""
+        travel = self.travel
+        improved = True
+        while improved:
+            improved = False
+            path = [0] + route + [self.end]
+            for i in range(1, len(path) - 2):
+                a, b = path[i - 1], path[i]
+                for j in range(i + 1, len(path) - 1):
+                    c, d = path[j], path[j + 1]
+                    if travel[a, c] + travel[b, d] + 1e-9 < travel[a, b] + travel[c, d]:
+                        path[i:j + 1] = path[i:j + 1][::-1]
+                        improved = True
+                        break
+                if improved:
+                    break
+            route = path[1:-1]
+        return route
+
+    def best_replacement(self, route: List[int], available: np.ndarray) -> Optional[Tuple[List[int], float]]:
+        """選択済みの1件を未選択の1件に入れ替えてスコアが最も上がる経路（なければ None）"""
+        candidates = np.flatnonzero(available)
+        if not len(candidates) or not route:
+            return None
+        current = self.score(route)
+        best = None
+        for position, node in enumerate(route):
+            reduced = route[:position] + route[position + 1:]
+            used = sum(self.route_time(reduced))
+            costs, positions = self.insertion_costs(reduced, candidates)
+            feasible = used + costs <= self.budget + 1e-9
+            if not feasible.any():
+                continue
+            gains = self.score(reduced) + self.marginal_gains(reduced)[candidates] - current
+            gains = np.where(feasible, gains, -np.inf)
+            choice = int(np.argmax(gains))
+            if gains[choice] > 1e-9 and (best is None or gains[choice] > best[0]):
+                replaced = list(reduced)
+                replaced.insert(int(positions[choice]), int(candidates[choice]))
+                best = (float(gains[choice]), replaced)
+        if best is None:
+            return None
+        return best[1], best[0]
+
+
+def build_plan(
+    travel: np.ndarray,
+    durations: Sequence[float],
+    ratings: Sequence[float],
+    categories: Sequence[Optional[str]],
+    budget: float,
+    return_to_start: bool = True,
+    max_spots: Optional[int] = None,
+    decay: float = DIVERSITY_DECAY,
+    time_limit: float = PLAN_BUILDER_TIME_LIMIT,
+) -> PlanResult:
+    """時間予算内でスコアが最大になる訪問先の部分集合と順序を選ぶ（オリエンテーリング問題）
+
+    travel はインデックス0を出発地、1..n を候補とする移動時間行列（分）。
+    時間は移動時間と滞在時間（durations）の合計で、return_to_start の場合は出発地に戻るまでを含む。
+    スコアは評価（ratings）の合計で、同じカテゴリの k 件目（評価の高い順）は decay ** k 倍になる。
+    時間あたりのスコアが高い候補から挿入する貪欲法のあと、2-opt、追加挿入、入れ替えの局所探索で改善する。
+    """
+    started = time.perf_counter()
+    problem = _Orienteering(np.asarray(travel, dtype=float), durations, ratings, categories, budget, return_to_start, decay)
+    size = len(durations)
+
+    # 単独でも予算に収まらない候補は最初から除く
+    available = np.zeros(size + 2, dtype=bool)
+    available[1:size + 1] = True
+    round_trip = problem.travel[0, 1:size + 1] + problem.durations[1:size + 1] + problem.travel[1:size + 1, problem.end]
+    available[1:size + 1] &= round_trip <= budget + 1e-9
+
+    def limit(route: List[int]) -> None:
+        # max_spots を超えた分は、外したときのスコアの減少が小さいものから外す
+        while max_spots is not None and len(route) > max_spots:
+            current = problem.score(route)
+            losses = [current - problem.score(route[:i] + route[i + 1:]) for i in range(len(route))]
+            removed = route.pop(int(np.argmin(losses)))
+            available[removed] = True
+
+    route: List[int] = []
+    problem.greedy_insert(route, available)
+    limit(route)
+    iterations = 0
+    while time.perf_counter() - started < time_limit:
+        iterations += 1
+        route = problem.two_opt(route)
+        if (max_spots is None or len(route) < max_spots) and problem.greedy_insert(route, available):
+            limit(route)
+            continue
+        replacement = problem.best_replacement(route, available)
+        if replacement is None:
+            break
+        new_route, _ = replacement
+        available[list(set(route) - set(new_route))] = True
+        available[list(set(new_route) - set(route))] = False
+        route = new_route
+
+    travel_time, visit_time = problem.route_time(route)
+    categories_used: Dict[Optional[str], int] = {}
+    for node in route:
+        category = problem.category_names[node - 1]
+        categories_used[category] = categories_used.get(category, 0) + 1
+    return PlanResult(
+        order=list(route),
+        score=round(problem.score(route), 3),
+        used_time=travel_time + visit_time,
+        travel_time=travel_time,
+        visit_time=visit_time,
+        candidates=size,
+        iterations=iterations,
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        categories=categories_used,
+    )
+
+
+class PlanMatrixCache:
+    """プランごとのスポット間距離行列（km）のキャッシュ
+
+    スポットが変わると catalog_cache のバージョンが上がるため、(キー, バージョン) で保持し、
+    念のためスポットIDの並びも一致する場合だけ再利用する。
+    """
+
+    def __init__(self, max_entries: int = PLAN_MATRIX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, int], Tuple[Tuple[int, ...], np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable, version: int, spot_ids: Sequence[int], points: Sequence[Sequence[float]]) -> np.ndarray:
+        ids = tuple(spot_ids)
+        with self._lock:
+            entry = self._entries.get((key, version))
+            if entry is not None and entry[0] == ids:
+                self._entries.move_to_end((key, version))
+                self._hits += 1
+                return entry[1]
+            self._misses += 1
+        matrix = haversine_matrix(points)
+        with self._lock:
+            self._entries[(key, version)] = (ids, matrix)
+            self._entries.move_to_end((key, version))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return matrix
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self._hits, "misses": self._misses}
+
+
+plan_matrix_cache = PlanMatrixCache()
+
+
+if __name__ == "__main__":
+    # 500件の候補からのプラン作成時間のベンチマーク
+    import random
+
+    from distance_matrix import travel_time_matrix
+
+    random.seed(0)
+    category_choices = ["公園・自然", "文化施設", "グルメ", "ショッピング", "体験", None]
+    for n in (100, 300, 500):
+        for budget in (240, 480):
+            elapsed = []
+            for trial in range(10):
+                points = [(35.73, 139.65)] + [
+                    (35.70 + random.random() * 0.08, 139.57 + random.random() * 0.12) for _ in range(n)
+                ]
+                travel = travel_time_matrix(haversine_matrix(points), "cycling")
+                durations = [random.choice([30, 45, 60, 90]) for _ in range(n)]
+                ratings = [round(random.uniform(2.5, 5.0), 1) for _ in range(n)]
+                categories = [random.choice(category_choices) for _ in range(n)]
+                started = time.perf_counter()
+                result = build_plan(travel, durations, ratings, categories, budget)
+                elapsed.append((time.perf_counter() - started) * 1000)
+            elapsed.sort()
+            print(f"{n:4d} spots, budget {budget:3d}min: median {elapsed[len(elapsed) // 2]:6.1f}ms  "
+                  f"max {elapsed[-1]:6.1f}ms  spots={len(result.order)} score={result.score} "
+                  f"used={result.used_time:.0f}min iterations={result.iterations}")
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+
+from serialization import negotiate_media_type, render
+
+# キャッシュするレスポンスの最大件数（クエリパラメータの組み合わせごとに1件）
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+
+# ブラウザには毎回 If-None-Match で再検証させる
+RESPONSE_CACHE_CONTROL = "no-cache"
+
+
+def _etag_of(body: bytes) -> str:
+    """本文のハッシュから強い ETag を作る"""
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match が ETag に一致するか（RFC 9110 の弱い比較）"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """カタログのバージョン番号で無効化する読み取り用レスポンスのキャッシュ
+
+    スポットを変更する処理は bump() でバージョンを進め、それ以前に作ったレスポンスはすべて破棄される。
+    プロセス内のキャッシュのため、複数ワーカーで動かす場合は各ワーカーが自分の書き込みしか検知できない。
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.version = 0
+        # キー -> (バージョン, 本文, ETag, 追加ヘッダー)
+        self._entries: "OrderedDict[Hashable, Tuple[int, bytes, str, Dict[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+
+    def bump(self) -> int:
+        """カタログのバージョンを進めてキャッシュを破棄する"""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            return self.version
+
+    def _get(self, key: Hashable) -> Optional[Tuple[bytes, str, Dict[str, str]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self.version:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1:]
+
+    def _set(self, key: Hashable, version: int, body: bytes, etag: str, headers: Dict[str, str]) -> None:
+        with self._lock:
+            # 作成中に書き込みがあった場合は古い内容になるため保存しない
+            if version != self.version:
+                return
+            self._entries[key] = (version, body, etag, headers)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def respond(
+        self,
+        request: Request,
+        key: Hashable,
+        build: Callable[[Dict[str, str]], Awaitable[Any]],
+    ) -> Response:
+        """キャッシュ済みのレスポンスを返す（なければ build で作成）
+
+        build には追加ヘッダー用の dict が渡され、JSON に変換できる値を返す。
+        JSON / MessagePack の表現ごとに別のエントリとしてキャッシュする。
+        If-None-Match が ETag に一致する場合は本文なしの 304 を返す。
+        """
+        media_type = negotiate_media_type(request)
+        key = (key, media_type)
+        cached = self._get(key)
+        if cached is None:
+            version = self.version
+            headers: Dict[str, str] = {}
+            body = render(await build(headers), media_type)
+            etag = _etag_of(body)
+            self._set(key, version, body, etag, headers)
+        else:
+            body, etag, headers = cached
+
+        response_headers = {**headers, "ETag": etag, "Cache-Control": RESPONSE_CACHE_CONTROL, "Vary": "Accept"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            with self._lock:
+                self._not_modified += 1
+            return Response(status_code=304, headers=response_headers)
+        return Response(content=body, media_type=media_type, headers=response_headers)
+
+    def stats(self) -> dict:
+        """キャッシュの統計"""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "version": self.version,
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "not_modified": self._not_modified,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+# アプリ全体で共有するスポット・プランのレスポンスキャッシュ
+catalog_cache = ResponseCache()
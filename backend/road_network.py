@@ -0,0 +1,570 @@
+"""オフラインの道路ネットワーク経路探索
+
+OSM の抽出データ（.osm / .osm.gz / .osm.bz2 の XML）から移動手段ごとの道路グラフを
+CSR（圧縮行格納）形式の配列で構築し、双方向 A* で2点間の最短時間経路を求める。
+変換済みのグラフは .npz で保存でき、起動時はそれを読み込むだけで済む。
+
+    python road_network.py build nerima.osm road_network.npz
+    python road_network.py bench
+"""
+import bz2
+import gzip
+import heapq
+import math
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from distance_matrix import TRAVEL_SPEEDS_KMH
+
+# 起動時に読み込むグラフ（.npz または OSM XML）。未設定ならローカル経路探索は無効
+ROAD_NETWORK_PATH = os.getenv("ROAD_NETWORK_PATH")
+
+# スナップ（最寄りノードへの吸着）を許す最大距離（m）
+ROAD_NETWORK_MAX_SNAP_M = float(os.getenv("ROAD_NETWORK_MAX_SNAP_M", "500"))
+
+EARTH_RADIUS_M = 6371000
+
+# A* のヒューリスティックに掛ける係数（平面近似の誤差を吸収して下界を保つ）
+HEURISTIC_SAFETY_FACTOR = 0.99
+
+MODES = ("walking", "cycling", "driving")
+
+# ORS のプロフィール名との対応（/routing/local を /routing/ors と同じリクエストで使えるように）
+ORS_PROFILE_MODES = {
+    "foot-walking": "walking",
+    "foot-hiking": "walking",
+    "cycling-regular": "cycling",
+    "cycling-road": "cycling",
+    "cycling-electric": "cycling",
+    "driving-car": "driving",
+}
+
+# 移動手段ごとに通行できる highway の種類
+_MOTOR_HIGHWAYS = {
+    "motorway", "motorway_link", "trunk", "trunk_link", "primary", "primary_link",
+    "secondary", "secondary_link", "tertiary", "tertiary_link", "unclassified",
+    "residential", "living_street", "service",
+}
+MODE_HIGHWAYS = {
+    "walking": (_MOTOR_HIGHWAYS - {"motorway", "motorway_link", "trunk", "trunk_link"})
+    | {"footway", "path", "pedestrian", "steps", "track", "cycleway", "corridor", "bridleway"},
+    "cycling": (_MOTOR_HIGHWAYS - {"motorway", "motorway_link", "trunk", "trunk_link"})
+    | {"cycleway", "path", "track"},
+    "driving": _MOTOR_HIGHWAYS,
+}
+
+# 通行可否を決めるタグ（移動手段ごとに優先順）
+MODE_ACCESS_TAGS = {
+    "walking": ("foot", "access"),
+    "cycling": ("bicycle", "vehicle", "access"),
+    "driving": ("motor_vehicle", "motorcar", "vehicle", "access"),
+}
+_DENIED_ACCESS = {"no", "private", "agricultural", "forestry", "delivery", "discouraged"}
+_ALLOWED_ACCESS = {"yes", "designated", "permissive", "destination", "customers"}
+
+# 自動車の道路種別ごとの速度（km/h）。maxspeed タグがあればそちらを上限とする
+DRIVING_SPEEDS_KMH = {
+    "motorway": 80, "motorway_link": 40, "trunk": 50, "trunk_link": 30,
+    "primary": 40, "primary_link": 30, "secondary": 35, "secondary_link": 25,
+    "tertiary": 30, "tertiary_link": 20, "unclassified": 25, "residential": 20,
+    "living_street": 10, "service": 10,
+}
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """2点間の距離（m）"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    a = math.sin((lat2_rad - lat1_rad) / 2) ** 2 + \
+        math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _haversine_m_array(lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray) -> np.ndarray:
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    a = np.sin((lat2_rad - lat1_rad) / 2) ** 2 + \
+        np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class RouteNotFound(Exception):
+    """経路が見つからない（グラフ上でつながっていない、または道路から遠すぎる）"""
+
+
+class RoadGraph:
+    """1つの移動手段の道路グラフ（CSR 形式、辺の重みは所要秒数）"""
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray,
+                 sources: np.ndarray, targets: np.ndarray, meters: np.ndarray, seconds: np.ndarray):
+        self.lat = lat
+        self.lng = lng
+        self.node_count = len(lat)
+        self.edge_count = len(sources)
+        self.indptr, self.indices, self.meters, self.seconds = self._csr(sources, targets, meters, seconds)
+        self.rev_indptr, self.rev_indices, self.rev_meters, self.rev_seconds = self._csr(targets, sources, meters, seconds)
+        # A* のヒューリスティック（直線距離 / 最高速度）が所要時間を超えないよう、グラフ内の最高速度を使う
+        self.max_speed_mps = float((meters / np.maximum(seconds, 1e-6)).max()) if len(meters) else 1.0
+        # 辺を持つノード（スナップの候補）
+        degree = np.diff(self.indptr) + np.diff(self.rev_indptr)
+        self.routable_nodes = np.flatnonzero(degree > 0).astype(np.int32)
+        self._routable_lat = lat[self.routable_nodes]
+        self._routable_lng = lng[self.routable_nodes]
+        # 探索ループでは numpy の要素アクセスより Python のリストの方が速い
+        self._adjacency = (self.indptr.tolist(), self.indices.tolist(), self.seconds.tolist())
+        self._rev_adjacency = (self.rev_indptr.tolist(), self.rev_indices.tolist(), self.rev_seconds.tolist())
+        # ヒューリスティック用の平面座標（m）。グラフの中心緯度での正距円筒図法
+        lat0 = math.radians(float(lat.mean())) if len(lat) else 0.0
+        scale = math.pi * EARTH_RADIUS_M / 180
+        self._x = (lng * scale * math.cos(lat0)).tolist()
+        self._y = (lat * scale).tolist()
+        # 平面近似の誤差で所要時間を超えないよう、少し小さめに見積もる
+        self._heuristic_scale = HEURISTIC_SAFETY_FACTOR / self.max_speed_mps
+        self._edge_meters = self.meters.tolist()
+
+    def _csr(self, sources, targets, meters, seconds):
+        order = np.lexsort((targets, sources))
+        counts = np.bincount(sources, minlength=self.node_count)
+        indptr = np.zeros(self.node_count + 1, dtype=np.int32)
+        np.cumsum(counts, out=indptr[1:])
+        return (indptr, targets[order].astype(np.int32),
+                meters[order].astype(np.float32), seconds[order].astype(np.float32))
+
+    def snap(self, lat: float, lng: float, max_distance_m: float = ROAD_NETWORK_MAX_SNAP_M) -> Tuple[int, float]:
+        """最寄りのノードと、そこまでの距離（m）を返す"""
+        if not len(self.routable_nodes):
+            raise RouteNotFound("道路データがありません")
+        # 近似距離で候補を絞ってから正確な距離を計算する
+        cos_lat = math.cos(math.radians(lat))
+        approx = (self._routable_lat - lat) ** 2 + ((self._routable_lng - lng) * cos_lat) ** 2
+        index = int(np.argmin(approx))
+        node = int(self.routable_nodes[index])
+        distance = haversine_m(lat, lng, float(self.lat[node]), float(self.lng[node]))
+        if distance > max_distance_m:
+            raise RouteNotFound(f"({lat}, {lng}) の近く {max_distance_m:.0f}m 以内に道路がありません")
+        return node, distance
+
+    def shortest_path(self, source: int, target: int) -> Tuple[float, List[int]]:
+        """双方向 A* で最短時間の経路を求め、（秒, ノード列）を返す
+
+        ポテンシャルは前向き・後ろ向きのヒューリスティックの平均（p(v) = (h_t(v) - h_s(v)) / 2）を使う。
+        この場合、両方向のキューの最小キーの和が暫定の最短距離以上になった時点で打ち切れる。
+        """
+        if source == target:
+            return 0.0, [source]
+        xs, ys = self._x, self._y
+        sx, sy, tx, ty = xs[source], ys[source], xs[target], ys[target]
+        half_scale = self._heuristic_scale / 2
+        hypot = math.hypot
+
+        def potential(node: int) -> float:
+            x, y = xs[node], ys[node]
+            return (hypot(tx - x, ty - y) - hypot(sx - x, sy - y)) * half_scale
+
+        # 前向き（source から）と後ろ向き（target から）の状態
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({source: -1}, {target: -1})
+        settled = (set(), set())
+        heaps = ([(potential(source), source)], [(-potential(target), target)])
+        adjacency = (self._adjacency, self._rev_adjacency)
+        signs = (1.0, -1.0)
+
+        best = math.inf
+        meeting = -1
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            # キューの小さい方を進める
+            side = 0 if len(heaps[0]) <= len(heaps[1]) else 1
+            key, node = heapq.heappop(heaps[side])
+            if node in settled[side]:
+                continue
+            settled[side].add(node)
+            node_dist = dist[side][node]
+            other_dist = dist[1 - side]
+            indptr, indices, weights = adjacency[side]
+            side_dist = dist[side]
+            side_parent = parent[side]
+            sign = signs[side]
+            heap = heaps[side]
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[edge]
+                new_dist = node_dist + weights[edge]
+                if new_dist < side_dist.get(neighbour, math.inf):
+                    side_dist[neighbour] = new_dist
+                    side_parent[neighbour] = node
+                    heapq.heappush(heap, (new_dist + sign * potential(neighbour), neighbour))
+                    if neighbour in other_dist:
+                        total = new_dist + other_dist[neighbour]
+                        if total < best:
+                            best = total
+                            meeting = neighbour
+
+        if meeting < 0:
+            raise RouteNotFound("道路ネットワーク上で経路が見つかりません")
+
+        path = []
+        node = meeting
+        while node != -1:
+            path.append(node)
+            node = parent[0][node]
+        path.reverse()
+        node = parent[1][meeting]
+        while node != -1:
+            path.append(node)
+            node = parent[1][node]
+        return best, path
+
+    def path_meters(self, path: Sequence[int]) -> float:
+        """ノード列の距離（m）"""
+        indptr, indices, _ = self._adjacency
+        total = 0.0
+        for u, v in zip(path, path[1:]):
+            best = math.inf
+            for edge in range(indptr[u], indptr[u + 1]):
+                if indices[edge] == v:
+                    best = min(best, self._edge_meters[edge])
+            total += best
+        return total
+
+    def one_to_many(self, source: int, targets: Iterable[int]) -> Dict[int, Tuple[float, float]]:
+        """source から targets への最短時間の経路を1回の Dijkstra で求める
+
+        戻り値は 到達できた target -> (秒, その経路の距離 m)。
+        """
+        remaining = set(targets)
+        indptr, indices, weights = self._adjacency
+        edge_meters = self._edge_meters
+        dist = {source: 0.0}
+        meters = {source: 0.0}
+        found: Dict[int, Tuple[float, float]] = {}
+        heap = [(0.0, source)]
+        settled = set()
+        while heap and remaining:
+            node_dist, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            settled.add(node)
+            node_meters = meters[node]
+            if node in remaining:
+                remaining.discard(node)
+                found[node] = (node_dist, node_meters)
+            for edge in range(indptr[node], indptr[node + 1]):
+                neighbour = indices[edge]
+                new_dist = node_dist + weights[edge]
+                if new_dist < dist.get(neighbour, math.inf):
+                    dist[neighbour] = new_dist
+                    meters[neighbour] = node_meters + edge_meters[edge]
+                    heapq.heappush(heap, (new_dist, neighbour))
+        return found
+
+
+class RoadNetwork:
+    """ノードの座標と、移動手段ごとの RoadGraph をまとめたもの"""
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray, graphs: Dict[str, RoadGraph]):
+        self.lat = lat
+        self.lng = lng
+        self.graphs = graphs
+
+    @classmethod
+    def from_edges(cls, lat: np.ndarray, lng: np.ndarray, edges: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]) -> "RoadNetwork":
+        """移動手段ごとの（始点, 終点, 速度 km/h）の配列からグラフを作る（距離は座標から計算）"""
+        graphs = {}
+        for mode, (sources, targets, speeds_kmh) in edges.items():
+            sources = np.asarray(sources, dtype=np.int32)
+            targets = np.asarray(targets, dtype=np.int32)
+            meters = _haversine_m_array(lat[sources], lng[sources], lat[targets], lng[targets])
+            seconds = meters / (np.asarray(speeds_kmh, dtype=np.float64) / 3.6)
+            graphs[mode] = RoadGraph(lat, lng, sources, targets, meters, seconds)
+        return cls(lat, lng, graphs)
+
+    def graph(self, mode: str) -> RoadGraph:
+        graph = self.graphs.get(mode)
+        if graph is None:
+            raise RouteNotFound(f"移動手段 '{mode}' の道路データがありません")
+        return graph
+
+    def route(self, mode: str, points: Sequence[Sequence[float]]) -> dict:
+        """[[lat, lng], ...] を順に通る経路を求める
+
+        戻り値は legs（区間ごとの距離 m・時間 秒）、coordinates（[lng, lat] の列）、way_points
+        （各経由地に対応する coordinates のインデックス）。
+        """
+        if len(points) < 2:
+            raise RouteNotFound("2地点以上を指定してください")
+        graph = self.graph(mode)
+        nodes = [graph.snap(lat, lng)[0] for lat, lng in points]
+        coordinates: List[List[float]] = []
+        way_points = [0]
+        legs = []
+        for source, target in zip(nodes, nodes[1:]):
+            seconds, path = graph.shortest_path(source, target)
+            legs.append({"distance": round(graph.path_meters(path), 1), "duration": round(seconds, 1)})
+            start = 1 if coordinates else 0
+            coordinates.extend([float(graph.lng[node]), float(graph.lat[node])] for node in path[start:])
+            way_points.append(len(coordinates) - 1)
+        return {"legs": legs, "coordinates": coordinates, "way_points": way_points}
+
+    def matrix(self, mode: str, sources: Sequence[Sequence[float]], destinations: Sequence[Sequence[float]]) -> Dict[str, list]:
+        """多対多の所要時間（秒）と距離（m）の行列。到達できない組は None"""
+        graph = self.graph(mode)
+        source_nodes = [graph.snap(lat, lng)[0] for lat, lng in sources]
+        destination_nodes = [graph.snap(lat, lng)[0] for lat, lng in destinations]
+        durations = []
+        distances = []
+        for source in source_nodes:
+            found = graph.one_to_many(source, destination_nodes)
+            durations.append([round(found[node][0], 1) if node in found else None for node in destination_nodes])
+            distances.append([round(found[node][1], 1) if node in found else None for node in destination_nodes])
+        return {"durations": durations, "distances": distances}
+
+    def save(self, path: str) -> None:
+        """.npz に保存する"""
+        arrays = {"lat": self.lat, "lng": self.lng}
+        for mode, graph in self.graphs.items():
+            # CSR の行番号から始点を復元して保存する
+            arrays[f"{mode}_sources"] = np.repeat(np.arange(graph.node_count, dtype=np.int32), np.diff(graph.indptr))
+            arrays[f"{mode}_targets"] = graph.indices
+            arrays[f"{mode}_meters"] = graph.meters
+            arrays[f"{mode}_seconds"] = graph.seconds
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "RoadNetwork":
+        """.npz または OSM XML から読み込む"""
+        if not path.endswith(".npz"):
+            return load_osm(path)
+        with np.load(path) as data:
+            lat = data["lat"]
+            lng = data["lng"]
+            graphs = {
+                mode: RoadGraph(lat, lng, data[f"{mode}_sources"], data[f"{mode}_targets"],
+                                data[f"{mode}_meters"], data[f"{mode}_seconds"])
+                for mode in MODES if f"{mode}_sources" in data
+            }
+        return cls(lat, lng, graphs)
+
+    def stats(self) -> dict:
+        return {
+            "nodes": int(len(self.lat)),
+            "modes": {
+                mode: {"edges": graph.edge_count, "routable_nodes": int(len(graph.routable_nodes))}
+                for mode, graph in self.graphs.items()
+            },
+        }
+
+
+def _open_osm(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    return open(path, "rb")
+
+
+def _access_allowed(tags: Dict[str, str], mode: str) -> Optional[bool]:
+    """アクセス制限タグによる通行可否（タグがなければ None）"""
+    for key in MODE_ACCESS_TAGS[mode]:
+        value = tags.get(key)
+        if value in _DENIED_ACCESS:
+            return False
+        if value in _ALLOWED_ACCESS:
+            return True
+    return None
+
+
+def _oneway(tags: Dict[str, str], mode: str) -> int:
+    """一方通行の向き（0: 双方向, 1: 順方向のみ, -1: 逆方向のみ）"""
+    if mode == "walking":
+        return 0
+    if mode == "cycling" and tags.get("oneway:bicycle") == "no":
+        return 0
+    value = tags.get("oneway")
+    if value in ("yes", "1", "true"):
+        return 1
+    if value == "-1":
+        return -1
+    if tags.get("junction") in ("roundabout", "circular") or tags.get("highway") in ("motorway", "motorway_link"):
+        return 1
+    return 0
+
+
+def _way_speed_kmh(tags: Dict[str, str], mode: str) -> float:
+    if mode != "driving":
+        return TRAVEL_SPEEDS_KMH[mode]
+    speed = DRIVING_SPEEDS_KMH.get(tags.get("highway"), 20)
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*$", tags.get("maxspeed", ""))
+    if match:
+        speed = min(speed, float(match.group(1)))
+    return speed
+
+
+def load_osm(path: str) -> RoadNetwork:
+    """OSM XML から移動手段ごとの道路グラフを作る（道路に使われているノードだけを残す）"""
+    node_coords: Dict[int, Tuple[float, float]] = {}
+    ways: List[Tuple[List[int], Dict[str, str]]] = []
+
+    with _open_osm(path) as source:
+        for _, element in ET.iterparse(source, events=("end",)):
+            if element.tag == "node":
+                node_coords[int(element.get("id"))] = (float(element.get("lat")), float(element.get("lon")))
+                element.clear()
+            elif element.tag == "way":
+                tags = {tag.get("k"): tag.get("v") for tag in element.iter("tag")}
+                if "highway" in tags and tags.get("area") != "yes":
+                    refs = [int(nd.get("ref")) for nd in element.iter("nd")]
+                    if len(refs) >= 2:
+                        ways.append((refs, tags))
+                element.clear()
+            elif element.tag == "relation":
+                element.clear()
+
+    # 道路に使われているノードに 0 からの番号を振る
+    index: Dict[int, int] = {}
+    for refs, _ in ways:
+        for ref in refs:
+            if ref in node_coords and ref not in index:
+                index[ref] = len(index)
+    lat = np.empty(len(index), dtype=np.float64)
+    lng = np.empty(len(index), dtype=np.float64)
+    for ref, i in index.items():
+        lat[i], lng[i] = node_coords[ref]
+
+    edges: Dict[str, Tuple[list, list, list]] = {mode: ([], [], []) for mode in MODES}
+    for refs, tags in ways:
+        highway = tags["highway"]
+        for mode in MODES:
+            allowed = _access_allowed(tags, mode)
+            if allowed is False or (allowed is None and highway not in MODE_HIGHWAYS[mode]):
+                continue
+            direction = _oneway(tags, mode)
+            speed = _way_speed_kmh(tags, mode)
+            sources, targets, speeds = edges[mode]
+            for a, b in zip(refs, refs[1:]):
+                if a not in index or b not in index:
+                    continue
+                u, v = index[a], index[b]
+                if direction >= 0:
+                    sources.append(u)
+                    targets.append(v)
+                    speeds.append(speed)
+                if direction <= 0:
+                    sources.append(v)
+                    targets.append(u)
+                    speeds.append(speed)
+
+    return RoadNetwork.from_edges(lat, lng, {mode: edges[mode] for mode in MODES if edges[mode][0]})
+
+
+def build_grid_network(rows: int, cols: int, spacing_m: float = 80.0,
+                       origin: Tuple[float, float] = (35.7356, 139.6516), seed: int = 0) -> RoadNetwork:
+    """格子状の合成道路ネットワーク（動作確認・ベンチマーク用）
+
+    全移動手段で双方向に通行でき、辺ごとの速度を少しばらつかせる。
+    """
+    rng = np.random.default_rng(seed)
+    lat0, lng0 = origin
+    dlat = spacing_m / (math.pi * EARTH_RADIUS_M / 180)
+    dlng = dlat / math.cos(math.radians(lat0))
+    grid_lat = lat0 + np.repeat(np.arange(rows), cols) * dlat
+    grid_lng = lng0 + np.tile(np.arange(cols), rows) * dlng
+    ids = np.arange(rows * cols).reshape(rows, cols)
+    horizontal = (ids[:, :-1].ravel(), ids[:, 1:].ravel())
+    vertical = (ids[:-1, :].ravel(), ids[1:, :].ravel())
+    sources = np.concatenate([horizontal[0], vertical[0], horizontal[1], vertical[1]])
+    targets = np.concatenate([horizontal[1], vertical[1], horizontal[0], vertical[0]])
+    slowdown = rng.uniform(0.6, 1.0, len(sources))
+    edges = {
+        mode: (sources, targets, TRAVEL_SPEEDS_KMH[mode] * slowdown)
+        for mode in MODES
+    }
+    return RoadNetwork.from_edges(grid_lat, grid_lng, edges)
+
+
+class RoadNetworkHolder:
+    """アプリ全体で共有する道路ネットワーク（ROAD_NETWORK_PATH から読み込む）"""
+
+    def __init__(self):
+        self.network: Optional[RoadNetwork] = None
+        self.path: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> RoadNetwork:
+        network = RoadNetwork.load(path)
+        with self._lock:
+            self.network = network
+            self.path = path
+        return network
+
+    def get(self) -> Optional[RoadNetwork]:
+        return self.network
+
+    def stats(self) -> dict:
+        network = self.network
+        if network is None:
+            return {"loaded": False}
+        return {"loaded": True, "path": self.path, **network.stats()}
+
+
+road_network = RoadNetworkHolder()
+
+
+def _dijkstra_reference(graph: RoadGraph, source: int, target: int) -> float:
+    """素朴な Dijkstra（双方向 A* の結果確認用）"""
+    return graph.one_to_many(source, [target]).get(target, (math.inf, math.inf))[0]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        started = time.perf_counter()
+        network = load_osm(sys.argv[2])
+        network.save(sys.argv[3])
+        print(f"built {sys.argv[3]} in {time.perf_counter() - started:.1f}s: {network.stats()}")
+        sys.exit(0)
+
+    # 合成ネットワーク（練馬区程度の広さの 120x150 格子, 18,000 ノード）でのベンチマーク
+    started = time.perf_counter()
+    network = build_grid_network(120, 150)
+    print(f"build: {(time.perf_counter() - started) * 1000:.1f}ms {network.stats()}")
+
+    with __import__("tempfile").TemporaryDirectory() as tmp:
+        npz = os.path.join(tmp, "grid.npz")
+        network.save(npz)
+        started = time.perf_counter()
+        network = RoadNetwork.load(npz)
+        print(f"load .npz: {(time.perf_counter() - started) * 1000:.1f}ms ({os.path.getsize(npz) / 1024:.0f}KB)")
+
+    graph = network.graph("walking")
+    rng = np.random.default_rng(1)
+    for label, max_offset in (("short legs (<1.5km)", 15), ("long legs (<8km)", 90)):
+        pairs = []
+        while len(pairs) < 50:
+            row, col = int(rng.integers(0, 120)), int(rng.integers(0, 150))
+            row2 = int(np.clip(row + rng.integers(-max_offset, max_offset + 1), 0, 119))
+            col2 = int(np.clip(col + rng.integers(-max_offset, max_offset + 1), 0, 149))
+            pairs.append((row * 150 + col, row2 * 150 + col2))
+        started = time.perf_counter()
+        results = [graph.shortest_path(s, t)[0] for s, t in pairs]
+        astar = (time.perf_counter() - started) / len(pairs)
+        started = time.perf_counter()
+        reference = [_dijkstra_reference(graph, s, t) for s, t in pairs]
+        dijkstra = (time.perf_counter() - started) / len(pairs)
+        assert all(abs(a - b) < 1e-3 for a, b in zip(results, reference)), "双方向 A* の結果が Dijkstra と一致しません"
+        print(f"{label:20s}: bidirectional A* {astar * 1000:6.2f}ms/leg  dijkstra {dijkstra * 1000:6.2f}ms/leg")
+
+    points = [[35.7356 + i * 0.004, 139.6516 + i * 0.006] for i in range(8)]
+    started = time.perf_counter()
+    network.matrix("walking", points, points)
+    print(f"matrix 8x8: {(time.perf_counter() - started) * 1000:.1f}ms")
+    started = time.perf_counter()
+    route = network.route("walking", points[:4])
+    print(f"route 3 legs: {(time.perf_counter() - started) * 1000:.1f}ms {route['legs']}")
@@ -0,0 +1,189 @@
+import os
+from typing import List, Optional, Sequence, Tuple
+
+# 厳密解（Held-Karp 動的計画法）を使うスポット数の上限（計算量は O(n^2 2^n)）
+HELD_KARP_MAX_SPOTS = 10
+
+# 1つのルートで指定できるスポット数の上限（/api/route と /api/routes/batch で検証する）
+ROUTE_MAX_SPOTS = int(os.getenv("ROUTE_MAX_SPOTS", "50"))
+
+DistanceMatrix = Sequence[Sequence[float]]
+
+
+def tour_length(dist: DistanceMatrix, order: Sequence[int], return_to_start: bool) -> float:
+    """出発地（インデックス0）から order の順に巡回したときの総距離"""
+    total = 0.0
+    prev = 0
+    for node in order:
+        total += dist[prev][node]
+        prev = node
+    if return_to_start:
+        total += dist[prev][0]
+    return total
+
+
+def _held_karp(dist: DistanceMatrix, n: int, return_to_start: bool) -> List[int]:
+    """Held-Karp 動的計画法による厳密解（スポットは 1..n）"""
+    full = (1 << n) - 1
+    inf = float("inf")
+    # dp[mask][j]: mask のスポットを訪問し、スポット j+1 で終わる最短距離
+    dp = [[inf] * n for _ in range(1 << n)]
+    parent = [[-1] * n for _ in range(1 << n)]
+    for j in range(n):
+        dp[1 << j][j] = dist[0][j + 1]
+
+    rows = [dist[j + 1] for j in range(n)]
+    for mask in range(1, full + 1):
+        dp_mask = dp[mask]
+        visited = [j for j in range(n) if mask >> j & 1]
+        targets = [(k, mask | (1 << k)) for k in range(n) if not mask >> k & 1]
+        for j in visited:
+            cost = dp_mask[j]
+            row = rows[j]
+            for k, next_mask in targets:
+                new_cost = cost + row[k + 1]
+                if new_cost < dp[next_mask][k]:
+                    dp[next_mask][k] = new_cost
+                    parent[next_mask][k] = j
+
+    best_cost = inf
+    last = 0
+    for j in range(n):
+        cost = dp[full][j] + (dist[j + 1][0] if return_to_start else 0.0)
+        if cost < best_cost:
+            best_cost = cost
+            last = j
+
+    order = []
+    mask = full
+    while last != -1:
+        order.append(last + 1)
+        prev = parent[mask][last]
+        mask ^= 1 << last
+        last = prev
+    order.reverse()
+    return order
+
+
+def _nearest_neighbour(dist: DistanceMatrix, n: int) -> List[int]:
+    """最近傍法による初期解"""
+    unvisited = set(range(1, n + 1))
+    order = []
+    current = 0
+    while unvisited:
+        row = dist[current]
+        current = min(unvisited, key=lambda node: row[node])
+        unvisited.remove(current)
+        order.append(current)
+    return order
+
+
+def _two_opt(dist: DistanceMatrix, tour: List[int], return_to_start: bool) -> bool:
+    """2-opt 改善（tour[0] は出発地で固定）。改善があれば True"""
+    size = len(tour)
+    improved = False
+    for i in range(1, size - 1):
+        a = tour[i - 1]
+        b = tour[i]
+        d_ab = dist[a][b]
+        for j in range(i + 1, size):
+            c = tour[j]
+            if j + 1 < size:
+                d = tour[j + 1]
+            elif return_to_start:
+                d = 0
+            else:
+                d = None
+            if d is None:
+                delta = dist[a][c] - d_ab
+            else:
+                delta = dist[a][c] + dist[b][d] - d_ab - dist[c][d]
+            if delta < -1e-9:
+                tour[i:j + 1] = reversed(tour[i:j + 1])
+                improved = True
+                b = tour[i]
+                d_ab = dist[a][b]
+    return improved
+
+
+def _or_opt(dist: DistanceMatrix, tour: List[int], return_to_start: bool) -> bool:
+    """Or-opt 改善（長さ1〜3の区間を別の位置へ移動、反転も考慮）。改善があれば True"""
+    improved = False
+    for length in (1, 2, 3):
+        i = 1
+        while i + length <= len(tour):
+            size = len(tour)
+            seg_first = tour[i]
+            seg_last = tour[i + length - 1]
+            prev = tour[i - 1]
+            if i + length < size:
+                nxt: Optional[int] = tour[i + length]
+            elif return_to_start:
+                nxt = 0
+            else:
+                nxt = None
+
+            removal_gain = dist[prev][seg_first]
+            if nxt is not None:
+                removal_gain += dist[seg_last][nxt] - dist[prev][nxt]
+
+            best_delta = -1e-9
+            best_move: Optional[Tuple[int, bool]] = None
+            for p in range(size):
+                if i - 1 <= p <= i + length - 1:
+                    continue
+                u = tour[p]
+                if p + 1 < size:
+                    v: Optional[int] = tour[p + 1]
+                elif return_to_start:
+                    v = 0
+                else:
+                    v = None
+                base = -dist[u][v] if v is not None else 0.0
+                forward = base + dist[u][seg_first] + (dist[seg_last][v] if v is not None else 0.0)
+                backward = base + dist[u][seg_last] + (dist[seg_first][v] if v is not None else 0.0)
+                for added, reverse in ((forward, False), (backward, True)):
+                    delta = added - removal_gain
+                    if delta < best_delta:
+                        best_delta = delta
+                        best_move = (p, reverse)
+
+            if best_move is None:
+                i += 1
+                continue
+
+            p, reverse = best_move
+            segment = tour[i:i + length]
+            if reverse:
+                segment.reverse()
+            del tour[i:i + length]
+            insert_at = p + 1 if p < i else p + 1 - length
+            tour[insert_at:insert_at] = segment
+            improved = True
+    return improved
+
+
+def _local_search(dist: DistanceMatrix, n: int, return_to_start: bool, max_rounds: int = 50) -> List[int]:
+    """最近傍法 + 2-opt / Or-opt による近似解"""
+    tour = [0] + _nearest_neighbour(dist, n)
+    for _ in range(max_rounds):
+        improved = _two_opt(dist, tour, return_to_start)
+        improved = _or_opt(dist, tour, return_to_start) or improved
+        if not improved:
+            break
+    return tour[1:]
+
+
+def optimize_visit_order(dist: DistanceMatrix, return_to_start: bool) -> Tuple[List[int], str]:
+    """訪問順序を最適化する
+
+    dist はインデックス0を出発地、1..n をスポットとする距離行列。
+    return_to_start が True なら出発地に戻る巡回路、False なら出発地から始まる開路として最適化する。
+    戻り値は（スポットのインデックス 1..n の訪問順, 使用したソルバー名）。
+    """
+    n = len(dist) - 1
+    if n <= 1:
+        return list(range(1, n + 1)), "trivial"
+    if n <= HELD_KARP_MAX_SPOTS:
+        return _held_karp(dist, n, return_to_start), "held-karp"
+    return _local_search(dist, n, return_to_start), "2-opt+or-opt"
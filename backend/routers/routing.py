@@ -1,25 +1,206 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from pydantic import BaseModel, Field
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+import asyncio
+import json
 import os
+import sqlite3
+import threading
+import time
 import httpx
 
+from geometry import transform_route_geojson
+from http_clients import http_clients
+from metrics import span
+from road_network import ORS_PROFILE_MODES, RouteNotFound, road_network
+from serialization import JSON_MEDIA_TYPE, negotiate_media_type, render
+
 router = APIRouter(prefix="/routing", tags=["routing"])
 
+# ORS ルートキャッシュの設定
+ORS_CACHE_PATH = os.getenv("ORS_CACHE_PATH", "./directions_cache.db")
+ORS_CACHE_TTL = int(os.getenv("ORS_CACHE_TTL", str(7 * 24 * 3600)))  # デフォルト7日
+ORS_CACHE_COORD_PRECISION = int(os.getenv("ORS_CACHE_COORD_PRECISION", "5"))  # 小数点以下の桁数（5桁 ≒ 1m）
+ORS_CACHE_MEMORY_ENTRIES = int(os.getenv("ORS_CACHE_MEMORY_ENTRIES", "256"))
+ORS_CACHE_DISK_ENTRIES = int(os.getenv("ORS_CACHE_DISK_ENTRIES", "10000"))
+
+
+class DirectionsCache:
+    """ORS のルート（GeoJSON）をプロフィールと丸めた座標をキーに保存する2段キャッシュ
+
+    1段目はメモリ上の LRU、2段目は SQLite ファイル。ディスクにヒットした結果はメモリに昇格する。
+    どちらも件数の上限を超えると最も長く参照されていないエントリから削除する。
+    """
+
+    def __init__(self, path: str = ORS_CACHE_PATH,
+                 ttl: int = ORS_CACHE_TTL,
+                 precision: int = ORS_CACHE_COORD_PRECISION,
+                 memory_entries: int = ORS_CACHE_MEMORY_ENTRIES,
+                 disk_entries: int = ORS_CACHE_DISK_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.precision = precision
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # キー -> (有効期限, GeoJSON のバイト列)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS directions_cache (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_directions_cache_accessed_at ON directions_cache (accessed_at)"
+        )
+        self._conn.commit()
+
+    def make_key(self, profile: str, coordinates: Sequence[Sequence[float]]) -> str:
+        """プロフィールと丸めた座標からキーを作る"""
+        precision = self.precision
+        points = ";".join(f"{lat:.{precision}f},{lng:.{precision}f}" for lat, lng in coordinates)
+        return f"{profile}|{points}"
+
+    def get_memory(self, key: str) -> Optional[bytes]:
+        """メモリ上の段だけを参照する（ディスクに触れないため、イベントループから直接呼べる）"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._memory[key]
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        """キャッシュを参照する（未登録・期限切れの場合は None）
+
+        ディスクにヒットすると参照時刻を書き込むため、async の処理からは aget を使う。
+        """
+        body = self.get_memory(key)
+        if body is not None:
+            return body
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, expires_at FROM directions_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] < now:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE directions_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.disk_hits += 1
+            body = bytes(row[0])
+            self._remember(key, row[1], body)
+            return body
+
+    async def aget(self, key: str) -> Optional[bytes]:
+        """get の async 版（メモリにヒットしなければ SQLite の参照・更新をスレッドで行う）"""
+        body = self.get_memory(key)
+        if body is not None:
+            return body
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, body: bytes) -> None:
+        """set の async 版（SQLite への書き込みと commit をスレッドで行う）"""
+        await asyncio.to_thread(self.set, key, body)
+
+    def set(self, key: str, body: bytes) -> None:
+        """ルートを両方の段に保存する"""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, body)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO directions_cache (key, body, created_at, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, body, now, expires_at, now)
+            )
+            # 上限を超えた分を参照の古い順に削除
+            self._conn.execute(
+                "DELETE FROM directions_cache WHERE key IN ("
+                "SELECT key FROM directions_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_entries,)
+            )
+            self._conn.commit()
+
+    def _remember(self, key: str, expires_at: float, body: bytes) -> None:
+        self._memory[key] = (expires_at, body)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def purge_expired(self) -> int:
+        """期限切れのエントリを削除し、削除件数を返す"""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (expires_at, _) in self._memory.items() if expires_at < now]:
+                del self._memory[key]
+            cursor = self._conn.execute("DELETE FROM directions_cache WHERE expires_at < ?", (now,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        """キャッシュのヒット・ミス数と件数を返す"""
+        with self._lock:
+            disk_count = self._conn.execute("SELECT COUNT(*) FROM directions_cache").fetchone()[0]
+            memory_count = len(self._memory)
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": memory_count,
+            "disk_entries": disk_count,
+            "coord_precision": self.precision,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+# アプリ全体で共有するルートキャッシュ
+directions_cache = DirectionsCache()
+
+# 同じキーのリクエストが同時に来た場合に ORS への問い合わせを1回にまとめる
+_inflight: Dict[str, "asyncio.Task[bytes]"] = {}
+
 class RouteRequest(BaseModel):
     # フロントからは [lat, lng] で来る想定 → ORSは [lng, lat]
     coordinates: list[list[float]] = Field(..., description="[[lat,lng], [lat,lng], ...]")
     profile: str = Field("foot-walking", description="ORSのプロフィール: foot-walking, cycling-regular, driving-car など")
+    # 以下を指定しない場合は ORS の GeoJSON をそのまま返す
+    zoom: Optional[float] = Field(None, ge=0, le=22, description="表示するズームレベル。指定するとこの縮尺で見分けられない頂点を間引く")
+    simplify: str = Field("douglas-peucker", pattern="^(douglas-peucker|visvalingam)$", description="間引きのアルゴリズム")
+    geometry_format: str = Field("geojson", pattern="^(geojson|polyline|delta)$", description="geojson / polyline（Google エンコード済みポリライン）/ delta（整数化した差分座標）")
+    precision: int = Field(5, ge=1, le=7, description="polyline / delta の小数点以下の桁数")
 
-@router.post("/ors")
-async def route_via_ors(req: RouteRequest):
+async def _fetch_from_ors(profile: str, coordinates: List[List[float]]) -> bytes:
+    """ORS にルートを問い合わせ、GeoJSON のバイト列を返す"""
     api_key = os.getenv("ORS_API_KEY")
     if not api_key:
         raise HTTPException(500, "ORS_API_KEY not set")
 
     # ORSは [lng,lat] 順。フロント想定 [lat,lng] を変換
-    coords_lnglat = [[lng, lat] for lat, lng in req.coordinates]
+    coords_lnglat = [[lng, lat] for lat, lng in coordinates]
 
-    url = f"https://api.openrouteservice.org/v2/directions/{req.profile}/geojson"
+    url = f"https://api.openrouteservice.org/v2/directions/{profile}/geojson"
     headers = {"Authorization": api_key}
 
     payload = {
@@ -29,12 +210,168 @@ async def route_via_ors(req: RouteRequest):
     }
 
     try:
-        async with httpx.AsyncClient(timeout=20) as client:
+        client = http_clients.httpx_client("ors")
+        async with http_clients.track("ors") as call:
             r = await client.post(url, headers=headers, json=payload)
-        if r.status_code == 429:
-            raise HTTPException(429, "ORS rate limit")
-        if r.status_code >= 400:
-            raise HTTPException(r.status_code, r.text)
-        return r.json()  # GeoJSON をそのまま返す
+            call.status = r.status_code
     except httpx.RequestError as e:
         raise HTTPException(502, f"ORS request failed: {e}")
+    if r.status_code == 429:
+        raise HTTPException(429, "ORS rate limit")
+    if r.status_code >= 400:
+        raise HTTPException(r.status_code, r.text)
+    return r.content
+
+
+async def _fetch_and_store(key: str, profile: str, coordinates: List[List[float]]) -> bytes:
+    body = await _fetch_from_ors(profile, coordinates)
+    await directions_cache.aset(key, body)
+    return body
+
+
+def _forget_inflight(key: str, task: "asyncio.Task[bytes]") -> None:
+    _inflight.pop(key, None)
+    # 待ち手が全員キャンセルされていても例外を回収しておく
+    if not task.cancelled():
+        task.exception()
+
+
+async def get_ors_route(profile: str, coordinates: List[List[float]]) -> bytes:
+    """キャッシュを経由して ORS のルートを取得する（成功したレスポンスのみキャッシュ）"""
+    key = directions_cache.make_key(profile, coordinates)
+    body = await directions_cache.aget(key)
+    if body is not None:
+        return body
+
+    # 問い合わせはリクエストから独立したタスクで行い、クライアントの切断で他の待ち手を巻き込まない
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_store(key, profile, coordinates))
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _forget_inflight(key, done))
+    return await asyncio.shield(task)
+
+
+async def get_transformed_route(req: RouteRequest) -> bytes:
+    """ルートを取得し、リクエストに応じて線を間引き・エンコードしたものを返す（結果もキャッシュする）"""
+    if req.zoom is None and req.geometry_format == "geojson":
+        return await get_ors_route(req.profile, req.coordinates)
+
+    key = "|".join([
+        directions_cache.make_key(req.profile, req.coordinates),
+        f"z{req.zoom}", req.simplify, req.geometry_format, f"p{req.precision}",
+    ])
+    body = await directions_cache.aget(key)
+    if body is not None:
+        return body
+    raw = await get_ors_route(req.profile, req.coordinates)
+    # 頂点数が多いと数十ミリ秒かかるため、イベントループを止めないようスレッドで処理する
+    geojson = await asyncio.to_thread(
+        transform_route_geojson, json.loads(raw), req.zoom, req.simplify, req.geometry_format, req.precision
+    )
+    body = json.dumps(geojson, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    await directions_cache.aset(key, body)
+    return body
+
+
+@router.post("/ors")
+async def route_via_ors(req: RouteRequest, request: Request):
+    body = await get_transformed_route(req)
+    # JSON はパースせずにそのまま中継し、MessagePack が要求された場合のみ変換する
+    media_type = negotiate_media_type(request)
+    if media_type != JSON_MEDIA_TYPE:
+        body = render(json.loads(body), media_type)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+
+@router.get("/cache/stats")
+async def get_directions_cache_stats():
+    """ORS ルートキャッシュの統計を取得"""
+    return directions_cache.stats()
+
+
+# ローカル経路探索の多対多行列の最大要素数
+LOCAL_MATRIX_MAX_CELLS = 2500
+
+
+class MatrixRequest(BaseModel):
+    locations: list[list[float]] = Field(..., description="[[lat,lng], [lat,lng], ...]")
+    sources: Optional[list[int]] = Field(None, description="出発地とする locations のインデックス（省略時は全地点）")
+    destinations: Optional[list[int]] = Field(None, description="目的地とする locations のインデックス（省略時は全地点）")
+    profile: str = Field("foot-walking", description="ORSのプロフィール: foot-walking, cycling-regular, driving-car など")
+
+
+def _local_network_and_mode(profile: str):
+    network = road_network.get()
+    if network is None:
+        raise HTTPException(503, "道路ネットワークが読み込まれていません（ROAD_NETWORK_PATH を設定してください）")
+    mode = ORS_PROFILE_MODES.get(profile)
+    if mode is None:
+        raise HTTPException(400, f"未対応のプロフィールです: {profile}")
+    return network, mode
+
+
+@router.post("/local")
+async def route_via_local(req: RouteRequest, request: Request):
+    """ローカルの道路ネットワークで経路を求める（/routing/ors と同じリクエスト・ORS 形式の GeoJSON）"""
+    network, mode = _local_network_and_mode(req.profile)
+    try:
+        # 探索は CPU を使うため、イベントループを止めないようスレッドで行う
+        with span("route.local"):
+            route = await asyncio.to_thread(network.route, mode, req.coordinates)
+    except RouteNotFound as e:
+        raise HTTPException(404, str(e))
+
+    legs = route["legs"]
+    geojson = {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "properties": {
+                "segments": legs,
+                "way_points": route["way_points"],
+                "summary": {
+                    "distance": round(sum(leg["distance"] for leg in legs), 1),
+                    "duration": round(sum(leg["duration"] for leg in legs), 1),
+                },
+            },
+            "geometry": {"type": "LineString", "coordinates": route["coordinates"]},
+        }],
+        "metadata": {"engine": "local", "profile": req.profile},
+    }
+    if req.zoom is not None or req.geometry_format != "geojson":
+        # /routing/ors と同じく、頂点数が多いと時間がかかるためスレッドで処理する
+        geojson = await asyncio.to_thread(
+            transform_route_geojson, geojson, req.zoom, req.simplify, req.geometry_format, req.precision
+        )
+    media_type = negotiate_media_type(request)
+    return Response(content=render(geojson, media_type), media_type=media_type, headers={"Vary": "Accept"})
+
+
+@router.post("/local/matrix")
+async def matrix_via_local(req: MatrixRequest):
+    """ローカルの道路ネットワークで多対多の所要時間（秒）・距離（m）行列を求める"""
+    network, mode = _local_network_and_mode(req.profile)
+    indices = range(len(req.locations))
+    source_indices = req.sources if req.sources is not None else list(indices)
+    destination_indices = req.destinations if req.destinations is not None else list(indices)
+    if any(i < 0 or i >= len(req.locations) for i in source_indices + destination_indices):
+        raise HTTPException(400, "sources / destinations のインデックスが範囲外です")
+    if len(source_indices) * len(destination_indices) > LOCAL_MATRIX_MAX_CELLS:
+        raise HTTPException(400, f"行列のサイズは {LOCAL_MATRIX_MAX_CELLS} 要素までです")
+    try:
+        with span("route.local_matrix"):
+            result = await asyncio.to_thread(
+                network.matrix, mode,
+                [req.locations[i] for i in source_indices],
+                [req.locations[i] for i in destination_indices],
+            )
+    except RouteNotFound as e:
+        raise HTTPException(404, str(e))
+    return {**result, "metadata": {"engine": "local", "profile": req.profile}}
+
+
+@router.get("/local/status")
+async def get_local_routing_status():
+    """ローカル経路探索の道路ネットワークの読み込み状況"""
+    return road_network.stats()
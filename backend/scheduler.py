@@ -0,0 +1,500 @@
+import re
+import time
+import unicodedata
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+# 1日の中の営業時間帯（その日の0時からの分。閉店が翌日にかかる場合は 1440 を超える）
+Window = Tuple[int, int]
+
+MINUTES_PER_DAY = 24 * 60
+INF = float("inf")
+
+# ローカルサーチの打ち切り時間（秒）。挿入法の結果は常に得られるため、超えた時点の最良解を返す
+SCHEDULER_TIME_LIMIT = 0.05
+
+# 挿入する地点を選ぶときの出発地からの遠さの重み（Solomon の I1 法の λ）。遠い地点ほど先に経路へ入れる
+INSERTION_DISTANCE_WEIGHT = 1.0
+
+# 曜日（datetime.weekday() の順）ごとのキー
+WEEKDAY_KEYS = [
+    ("月曜日", "月曜", "月", "mon", "monday"),
+    ("火曜日", "火曜", "火", "tue", "tuesday"),
+    ("水曜日", "水曜", "水", "wed", "wednesday"),
+    ("木曜日", "木曜", "木", "thu", "thursday"),
+    ("金曜日", "金曜", "金", "fri", "friday"),
+    ("土曜日", "土曜", "土", "sat", "saturday"),
+    ("日曜日", "日曜", "日", "sun", "sunday"),
+]
+WEEKDAY_GROUP_KEYS = ("平日", "weekdays")
+WEEKEND_GROUP_KEYS = ("土日", "週末", "weekends")
+EVERYDAY_KEYS = ("毎日", "全日", "daily", "everyday")
+
+CLOSED_WORDS = ("定休", "休み", "休業", "休館", "休園", "closed")
+ALL_DAY_WORDS = ("24時間", "終日", "24h", "open24")
+
+_TIME_RANGE = re.compile(
+    r"(\d{1,2})(?:[:時](\d{2})?分?)?\s*[-~〜～–ー―]\s*(\d{1,2})(?:[:時](\d{2})?分?)?"
+)
+_DAY_ENTRY = re.compile(r"^\s*([^\d:：]+?)\s*[:：]\s*(.*)$")
+
+# 休みの記載（「月曜定休」「水曜休み」「定休日:月・火」など）を区切る文字
+_NOTE_SEPARATORS = re.compile(r"[()\[\]、,，。/]+")
+# 曜日の記載（「月曜」「月曜日」、または「月・火」のように並べたもの）
+_JA_WEEKDAY = re.compile(r"([月火水木金土日])(?=曜|・)|(?<=・)([月火水木金土日])")
+_EN_WEEKDAY = re.compile(r"\b(mon|tue|wed|thu|fri|sat|sun)")
+_JA_WEEKDAY_INDEX = {key[0][0]: index for index, key in enumerate(WEEKDAY_KEYS)}
+_EN_WEEKDAY_INDEX = {key[3]: index for index, key in enumerate(WEEKDAY_KEYS)}
+
+
+def _normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).strip().lower()
+
+
+def _closed_weekdays(text: str) -> Set[int]:
+    """「9:00-17:00（月曜定休）」「水曜休み」のように休みの記載に添えられた曜日（weekday() の値）
+
+    毎月第N曜日の休み（「第3火曜休み」）は毎週の休みではないため含めない。
+    """
+    closed = set()
+    for note in _NOTE_SEPARATORS.split(text):
+        if "第" in note or not any(word in note for word in CLOSED_WORDS):
+            continue
+        for match in _JA_WEEKDAY.finditer(note):
+            closed.add(_JA_WEEKDAY_INDEX[match.group(1) or match.group(2)])
+        for match in _EN_WEEKDAY.finditer(note):
+            closed.add(_EN_WEEKDAY_INDEX[match.group(1)])
+    return closed
+
+
+def parse_hours(value: Optional[str], weekday: Optional[int] = None) -> Optional[List[Window]]:
+    """「9:00-17:00」「10時～18時、19時～22時」「24時間」「定休日」などを営業時間帯のリストに変換する
+
+    休みの場合は空のリスト、解釈できない場合は None（営業時間不明）を返す。
+    「9:00-17:00（月曜定休）」のように曜日を添えた休みの記載は、weekday（datetime.weekday() の値）が
+    その曜日の場合だけ休みとし、他の曜日は記載された営業時間を返す。
+    """
+    if value is None:
+        return None
+    text = _normalize(str(value)).replace("不定休", "")
+    if not text:
+        return None
+    closed_weekdays = _closed_weekdays(text)
+    if weekday is not None and weekday in closed_weekdays:
+        return []
+    if any(word in text for word in ALL_DAY_WORDS):
+        return [(0, MINUTES_PER_DAY)]
+
+    windows = []
+    for open_h, open_m, close_h, close_m in _TIME_RANGE.findall(text):
+        opening = int(open_h) * 60 + int(open_m or 0)
+        closing = int(close_h) * 60 + int(close_m or 0)
+        if closing <= opening:
+            closing += MINUTES_PER_DAY  # 深夜営業（翌日にかかる）
+        windows.append((opening, closing))
+    if windows:
+        return sorted(windows)
+    # 営業時間の記載がなく休みとだけある場合は終日休み（曜日を添えた休みなら他の曜日は不明）
+    if any(word in text for word in CLOSED_WORDS) and not closed_weekdays:
+        return []
+    return None
+
+
+def parse_opening_hours_text(text: Optional[str]) -> Optional[Dict[str, str]]:
+    """CSV の「月曜日: 9:00-22:00,火曜日: 9:00-22:00,...」形式を 曜日 -> 営業時間 の辞書に変換する
+
+    曜日の指定がない場合（「9:00-17:00」のみ）は毎日の営業時間とみなす。
+    """
+    if not text or not text.strip():
+        return None
+    entries = [entry for entry in re.split(r"[,、\n]", text) if entry.strip()]
+    hours: Dict[str, str] = {}
+    for entry in entries:
+        match = _DAY_ENTRY.match(entry)
+        if match:
+            hours[match.group(1).strip()] = match.group(2).strip()
+        elif hours:
+            # 「月曜日: 10:00-12:00, 13:00-17:00」のように時間帯がカンマで続く場合
+            last_key = next(reversed(hours))
+            hours[last_key] = f"{hours[last_key]}, {entry.strip()}"
+        else:
+            hours["毎日"] = entry.strip()
+    return hours or None
+
+
+def opening_windows(opening_hours, weekday: int) -> Optional[List[Window]]:
+    """opening_hours（曜日 -> 営業時間 の辞書、または全曜日共通の文字列）から指定曜日の営業時間帯を求める
+
+    前日の深夜営業（翌日にかかる時間帯）は、その日の0時より前から始まる時間帯として含める
+    （金曜 22:00-2:00 なら土曜は (-120, 120)）。
+    該当する曜日の記載がない場合や解釈できない場合は None（いつでも訪問できるものとして扱う）を返す。
+    """
+    windows = _day_windows(opening_hours, weekday)
+    if windows is None:
+        return None
+    previous = _day_windows(opening_hours, (weekday - 1) % 7) or []
+    carried = [
+        (opening - MINUTES_PER_DAY, closing - MINUTES_PER_DAY)
+        for opening, closing in previous if closing > MINUTES_PER_DAY
+    ]
+    return sorted(carried + windows)
+
+
+def _day_windows(opening_hours, weekday: int) -> Optional[List[Window]]:
+    """指定曜日の記載そのものの営業時間帯（前日の深夜営業は含まない）"""
+    if not opening_hours:
+        return None
+    if isinstance(opening_hours, str):
+        return parse_hours(opening_hours, weekday)
+
+    entries = {_normalize(str(key)): value for key, value in opening_hours.items()}
+    candidates = list(WEEKDAY_KEYS[weekday])
+    candidates += WEEKDAY_GROUP_KEYS if weekday < 5 else WEEKEND_GROUP_KEYS
+    candidates += EVERYDAY_KEYS
+    for key in candidates:
+        if key in entries:
+            return parse_hours(entries[key], weekday)
+    return None
+
+
+def parse_clock(value: str, base: Optional[datetime] = None) -> datetime:
+    """「HH:MM」（base の日付）または ISO 8601 の日時を datetime に変換する（不正な値は ValueError）"""
+    text = unicodedata.normalize("NFKC", value).strip()
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", text)
+    if match:
+        hour, minute = int(match.group(1)), int(match.group(2))
+        if hour > 23 or minute > 59:
+            raise ValueError(f"時刻の形式が正しくありません: {value}")
+        base = base or datetime.now()
+        return base.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return datetime.fromisoformat(text)
+
+
+@dataclass
+class Stop:
+    """訪問先1件分の制約（duration は滞在時間（分）、windows が None なら営業時間の制約なし）"""
+    duration: int
+    windows: Optional[List[Window]] = None
+
+
+@dataclass
+class Schedule:
+    """スケジュールの計算結果（時刻はすべて出発日の0時からの分）"""
+    order: List[int]
+    arrivals: List[int] = field(default_factory=list)
+    starts: List[int] = field(default_factory=list)
+    departures: List[int] = field(default_factory=list)
+    start_minute: int = 0
+    end_minute: int = 0
+    travel_minutes: int = 0
+    infeasible: List[Tuple[int, str]] = field(default_factory=list)
+    solver: str = "insertion"
+
+    @property
+    def wait_minutes(self) -> int:
+        return sum(start - arrival for arrival, start in zip(self.arrivals, self.starts))
+
+
+def service_start(arrival: float, stop: Stop) -> Optional[float]:
+    """arrival に到着したとき、滞在時間を営業時間内に確保できる最も早い開始時刻（なければ None）"""
+    if stop.windows is None:
+        return arrival
+    for opening, closing in stop.windows:
+        start = arrival if arrival > opening else opening
+        if start + stop.duration <= closing:
+            return start
+    return None
+
+
+def latest_arrival(deadline: float, stop: Stop) -> float:
+    """deadline までに出発できる最も遅い到着時刻（到着が早いほど条件は緩いため、これ以前なら必ず間に合う）"""
+    if stop.windows is None:
+        return deadline - stop.duration
+    latest = -INF
+    for opening, closing in stop.windows:
+        limit = closing if closing < deadline else deadline
+        if opening + stop.duration <= limit:
+            latest = max(latest, limit - stop.duration)
+    return latest
+
+
+class _Problem:
+    """出発地（インデックス0）と訪問先 1..n の移動時間行列（分）と制約"""
+
+    def __init__(
+        self,
+        travel: Sequence[Sequence[float]],
+        stops: Sequence[Stop],
+        start_minute: int,
+        end_minute: Optional[int],
+        return_to_start: bool,
+    ):
+        self.travel = [list(row) for row in travel]
+        self.stops = [None] + list(stops)
+        self.start_minute = start_minute
+        self.end_minute = INF if end_minute is None else end_minute
+        self.return_to_start = return_to_start
+
+    def leg_to_end(self, node: int) -> float:
+        return self.travel[node][0] if self.return_to_start else 0
+
+    def evaluate(self, route: Sequence[int]) -> Optional[Tuple[float, float]]:
+        """route の (終了時刻, 総移動時間)。営業時間や終了時刻を守れない場合は None"""
+        travel = self.travel
+        stops = self.stops
+        now = self.start_minute
+        moved = 0
+        prev = 0
+        for node in route:
+            leg = travel[prev][node]
+            start = service_start(now + leg, stops[node])
+            if start is None:
+                return None
+            now = start + stops[node].duration
+            moved += leg
+            prev = node
+        leg = self.leg_to_end(prev)
+        now += leg
+        if now > self.end_minute:
+            return None
+        return now, moved + leg
+
+    def timeline(self, route: Sequence[int]) -> Schedule:
+        schedule = Schedule(order=list(route), start_minute=self.start_minute)
+        now = self.start_minute
+        prev = 0
+        for node in route:
+            leg = self.travel[prev][node]
+            arrival = now + leg
+            start = service_start(arrival, self.stops[node])
+            schedule.arrivals.append(int(arrival))
+            schedule.starts.append(int(start))
+            now = start + self.stops[node].duration
+            schedule.departures.append(int(now))
+            schedule.travel_minutes += int(leg)
+            prev = node
+        leg = self.leg_to_end(prev)
+        schedule.travel_minutes += int(leg)
+        schedule.end_minute = int(now + leg)
+        return schedule
+
+    def latest_arrivals(self, route: Sequence[int]) -> List[float]:
+        """各位置の最も遅い到着時刻（末尾は終点への到着期限）"""
+        latest = [0.0] * (len(route) + 1)
+        latest[-1] = self.end_minute
+        next_node = None
+        for position in range(len(route) - 1, -1, -1):
+            node = route[position]
+            leg = self.leg_to_end(node) if next_node is None else self.travel[node][next_node]
+            latest[position] = latest_arrival(latest[position + 1] - leg, self.stops[node])
+            next_node = node
+        return latest
+
+    def departures(self, route: Sequence[int]) -> List[float]:
+        """出発地と各位置の出発時刻"""
+        departures = [float(self.start_minute)]
+        prev = 0
+        for node in route:
+            start = service_start(departures[-1] + self.travel[prev][node], self.stops[node])
+            departures.append(start + self.stops[node].duration)
+            prev = node
+        return departures
+
+
+def _infeasible_reason(problem: _Problem, node: int) -> Optional[str]:
+    """単独でも訪問できない地点の理由（単独なら訪問できる場合は None）"""
+    stop = problem.stops[node]
+    if stop.windows is not None and not stop.windows:
+        return "定休日のため訪問できません"
+    if stop.windows is not None and all(closing - opening < stop.duration for opening, closing in stop.windows):
+        return "営業時間内に滞在時間を確保できません"
+    if problem.evaluate([node]) is None:
+        return "営業時間または終了時刻までに訪問できません"
+    return None
+
+
+def _insert(problem: _Problem, route: List[int], candidates: List[int]) -> List[int]:
+    """挿入法（Solomon の I1 法）で candidates をできるだけ route に入れ、入れられなかった地点を返す
+
+    各位置の最も遅い到着時刻を先に求めておくことで、挿入の可否を O(1) で判定する。
+    """
+    travel = problem.travel
+    stops = problem.stops
+    remaining = list(candidates)
+    while remaining:
+        departures = problem.departures(route)
+        latest = problem.latest_arrivals(route)
+        best = None  # (優先度, 訪問先, 位置)
+        for node in remaining:
+            stop = stops[node]
+            row = travel[node]
+            best_cost = INF
+            best_position = -1
+            for position in range(len(route) + 1):
+                prev = route[position - 1] if position else 0
+                leg_in = travel[prev][node]
+                start = service_start(departures[position] + leg_in, stop)
+                if start is None:
+                    continue
+                if position < len(route):
+                    next_node = route[position]
+                    leg_out = row[next_node]
+                    removed = travel[prev][next_node]
+                else:
+                    leg_out = problem.leg_to_end(node)
+                    removed = problem.leg_to_end(prev)
+                if start + stop.duration + leg_out > latest[position]:
+                    continue
+                # 追加の移動時間と待ち時間
+                cost = leg_in + leg_out - removed + (start - departures[position] - leg_in)
+                if cost < best_cost:
+                    best_cost = cost
+                    best_position = position
+            if best_position < 0:
+                continue
+            priority = INSERTION_DISTANCE_WEIGHT * travel[0][node] - best_cost
+            if best is None or priority > best[0]:
+                best = (priority, node, best_position)
+        if best is None:
+            break
+        _, node, position = best
+        route.insert(position, node)
+        remaining.remove(node)
+    return remaining
+
+
+def _improve(problem: _Problem, route: List[int], deadline: float) -> List[int]:
+    """移動（relocate）と区間反転（2-opt）の局所探索で終了時刻・移動時間を短くする"""
+    best_cost = problem.evaluate(route)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        size = len(route)
+        for i in range(size):
+            for j in range(size):
+                if i == j:
+                    continue
+                candidate = route[:i] + route[i + 1:]
+                candidate.insert(j, route[i])
+                cost = problem.evaluate(candidate)
+                if cost is not None and cost < best_cost:
+                    route, best_cost, improved = candidate, cost, True
+                    break
+            if improved or time.perf_counter() >= deadline:
+                break
+        if improved:
+            continue
+        for i in range(size - 1):
+            for j in range(i + 2, size + 1):
+                candidate = route[:i] + route[i:j][::-1] + route[j:]
+                cost = problem.evaluate(candidate)
+                if cost is not None and cost < best_cost:
+                    route, best_cost, improved = candidate, cost, True
+                    break
+            if improved or time.perf_counter() >= deadline:
+                break
+    return route
+
+
+def schedule_visits(
+    travel: Sequence[Sequence[float]],
+    stops: Sequence[Stop],
+    start_minute: int,
+    end_minute: Optional[int] = None,
+    return_to_start: bool = True,
+    optimize: bool = True,
+    time_limit: float = SCHEDULER_TIME_LIMIT,
+) -> Schedule:
+    """営業時間（時間枠）と滞在時間を考慮して訪問スケジュールを作成する
+
+    travel はインデックス0を出発地、1..n を stops とする移動時間行列（分）。
+    optimize が True の場合は挿入法で訪問順序を決めてから局所探索で改善し、
+    False の場合は stops の順に訪問する（間に合わない地点は飛ばす）。
+    どちらの場合も訪問できなかった地点は (インデックス, 理由) として infeasible に入る。
+    """
+    started = time.perf_counter()
+    problem = _Problem(travel, stops, start_minute, end_minute, return_to_start)
+    nodes = list(range(1, len(stops) + 1))
+
+    infeasible = []
+    candidates = []
+    for node in nodes:
+        reason = _infeasible_reason(problem, node)
+        if reason:
+            infeasible.append((node, reason))
+        else:
+            candidates.append(node)
+
+    route: List[int] = []
+    if optimize:
+        remaining = _insert(problem, route, candidates)
+        route = _improve(problem, route, started + time_limit)
+        if remaining:
+            # 改善で空いた時間に入れられる地点があれば追加する
+            remaining = _insert(problem, route, remaining)
+        solver = "insertion+local-search"
+    else:
+        remaining = []
+        for node in candidates:
+            if problem.evaluate(route + [node]) is None:
+                remaining.append(node)
+            else:
+                route.append(node)
+        solver = "fixed-order"
+
+    infeasible += [(node, "時間内に訪問できる順序が見つかりません") for node in remaining]
+    schedule = problem.timeline(route)
+    schedule.infeasible = sorted(infeasible)
+    schedule.solver = solver
+    return schedule
+
+
+def minute_to_datetime(day: datetime, minute: int) -> datetime:
+    """出発日の0時からの分を datetime に変換する"""
+    return day.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(minutes=minute)
+
+
+if __name__ == "__main__":
+    # 営業時間の解釈の確認（曜日は datetime.weekday() の値：月=0 … 日=6）
+    free_text = {"毎日": "9:00-17:00（月曜定休）"}
+    assert opening_windows(free_text, 0) == [] and opening_windows(free_text, 1) == [(540, 1020)]
+    assert opening_windows(parse_opening_hours_text("9:00-17:00（月曜定休）"), 2) == [(540, 1020)]
+    assert parse_hours("10時～18時 水曜休み", 2) == [] and parse_hours("10時～18時 水曜休み", 3) == [(600, 1080)]
+    assert parse_hours("11:00-20:00 定休日:月・火", 1) == [] and parse_hours("11:00-20:00 定休日:月・火", 2) == [(660, 1200)]
+    assert parse_hours("10:00-18:00（日・祝休み）", 6) == [] and parse_hours("10:00-18:00（日・祝休み）", 5) == [(600, 1080)]
+    assert parse_hours("10:00-17:00 closed mondays", 0) == [] and parse_hours("10:00-17:00 closed mondays", 4) == [(600, 1020)]
+    assert parse_hours("9:00-17:00（第3火曜休み）", 1) == [(540, 1020)]
+    assert parse_hours("10:00-19:00（不定休）", 3) == [(600, 1140)]
+    assert parse_hours("9:00-17:00（月曜定休）") == [(540, 1020)]
+    assert parse_hours("定休日") == [] and parse_hours("不定休") is None
+    assert parse_hours("月曜定休", 0) == [] and parse_hours("月曜定休", 1) is None
+    assert parse_hours("24時間（火曜休み）", 1) == [] and parse_hours("24時間（火曜休み）", 2) == [(0, MINUTES_PER_DAY)]
+    assert parse_hours("22:00-2:00") == [(1320, 1560)]
+
+    # 30地点のスケジュール作成時間のベンチマーク
+    import random
+
+    from distance_matrix import haversine_matrix, travel_time_matrix
+
+    random.seed(0)
+    hours_choices = [None, "9:00-17:00", "10:00-18:00", "11:00-14:00, 17:00-21:00", "24時間", "13:00-20:00", "定休日"]
+    for n in (10, 20, 30):
+        elapsed = []
+        scheduled = []
+        for trial in range(20):
+            points = [(35.73, 139.65)] + [
+                (35.70 + random.random() * 0.08, 139.57 + random.random() * 0.12) for _ in range(n)
+            ]
+            travel = travel_time_matrix(haversine_matrix(points), "cycling").tolist()
+            stops = [
+                Stop(random.choice([30, 45, 60, 90]), parse_hours(random.choice(hours_choices)))
+                for _ in range(n)
+            ]
+            started = time.perf_counter()
+            schedule = schedule_visits(travel, stops, start_minute=9 * 60, end_minute=21 * 60)
+            elapsed.append((time.perf_counter() - started) * 1000)
+            scheduled.append(len(schedule.order))
+        elapsed.sort()
+        print(f"{n:3d} spots: median {elapsed[len(elapsed) // 2]:6.1f}ms  max {elapsed[-1]:6.1f}ms  "
+              f"scheduled {sum(scheduled) / len(scheduled):.1f}/{n}")
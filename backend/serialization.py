@@ -0,0 +1,187 @@
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+# orjson があれば高速な JSON エンコーダを使う（なければ標準の json）
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# MessagePack は任意（pip install msgpack で Accept: application/msgpack に対応）
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+
+def _default(value: Any) -> Any:
+    """エンコーダが扱えない値（Pydantic モデルや Decimal など）を変換する"""
+    return jsonable_encoder(value)
+
+
+def dumps_json(content: Any) -> bytes:
+    """JSON の UTF-8 バイト列に変換する"""
+    if orjson is not None:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY,
+        )
+    return json.dumps(
+        content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def dumps_msgpack(content: Any) -> bytes:
+    """MessagePack のバイト列に変換する"""
+    return msgpack.packb(content, default=_default, use_bin_type=True)
+
+
+class FastJSONResponse(JSONResponse):
+    """orjson でシリアライズする JSON レスポンス（アプリの既定のレスポンスクラス）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_json(content)
+
+
+def _accept_qualities(accept: str) -> Dict[str, float]:
+    """Accept ヘッダーのメディアタイプごとの q 値（q 以外のパラメータは無視する）"""
+    qualities: Dict[str, float] = {}
+    for item in accept.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type.lower()] = quality
+    return qualities
+
+
+def negotiate_media_type(request: Request) -> str:
+    """Accept ヘッダーから返す表現を決める
+
+    MessagePack は明示的に q > 0 で要求され、JSON（application/json・application/*・*/*）より
+    q 値が低くない場合のみ返す。q=0 は拒否として扱う。
+    """
+    if msgpack is None:
+        return JSON_MEDIA_TYPE
+    qualities = _accept_qualities(request.headers.get("accept", ""))
+    msgpack_quality = max(qualities.get(media_type, 0.0) for media_type in MSGPACK_MEDIA_TYPES)
+    if msgpack_quality <= 0:
+        return JSON_MEDIA_TYPE
+    json_quality = next(
+        (qualities[media_type] for media_type in (JSON_MEDIA_TYPE, "application/*", "*/*") if media_type in qualities),
+        0.0,
+    )
+    return MSGPACK_MEDIA_TYPE if msgpack_quality >= json_quality else JSON_MEDIA_TYPE
+
+
+def render(content: Any, media_type: str) -> bytes:
+    """指定した表現のバイト列に変換する"""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return dumps_msgpack(content)
+    return dumps_json(content)
+
+
+def negotiated_response(
+    request: Request,
+    content: Any,
+    status_code: int = 200,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """Accept ヘッダーに応じて JSON か MessagePack でレスポンスを返す"""
+    media_type = negotiate_media_type(request)
+    response_headers = {**(headers or {}), "Vary": "Accept"}
+    return Response(
+        content=render(content, media_type),
+        status_code=status_code,
+        media_type=media_type,
+        headers=response_headers,
+    )
+
+
+if __name__ == "__main__":
+    # シリアライズ時間と転送量（圧縮後のバイト数）のベンチマーク
+    import gzip
+    import random
+    import time
+    from datetime import datetime
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    random.seed(0)
+    spots = [
+        {
+            "id": i,
+            "name": f"スポット{i}",
+            "address": f"東京都練馬区豊玉北{i % 6 + 1}丁目{i % 20 + 1}-{i % 9 + 1}",
+            "latitude": 35.70 + random.random() * 0.08,
+            "longitude": 139.57 + random.random() * 0.12,
+            "description": "練馬区の魅力的なスポットです。" * 3,
+            "plan": random.choice(["まったり", "わくわく", "観光"]),
+            "image_url": f"https://example.com/images/{i}.jpg",
+            "visit_duration": 30,
+            "created_at": datetime(2025, 9, 6, 8, 18, 29),
+            "updated_at": datetime(2025, 9, 6, 8, 18, 29),
+        }
+        for i in range(5000)
+    ]
+    route_geojson = {
+        "type": "FeatureCollection",
+        "features": [{
+            "type": "Feature",
+            "properties": {"summary": {"distance": 12345.6, "duration": 9876.5}},
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [
+                    [139.57 + i * 0.00005 + random.random() * 1e-5, 35.70 + i * 0.00003 + random.random() * 1e-5]
+                    for i in range(5000)
+                ],
+            },
+        }],
+    }
+
+    def stdlib_json(content):
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False).encode("utf-8")
+
+    def measure(func, content, repeat=5):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = func(content)
+            best = min(best, time.perf_counter() - started)
+        return body, best
+
+    for label, content in (("spots x5000", spots), ("route geojson", route_geojson)):
+        print(label)
+        encoders = [("json (stdlib)", stdlib_json), ("json (fast)", dumps_json)]
+        if msgpack is not None:
+            encoders.append(("msgpack", dumps_msgpack))
+        for name, func in encoders:
+            body, seconds = measure(func, content)
+            sizes = [f"raw={len(body) / 1024:7.1f}KB"]
+            started = time.perf_counter()
+            sizes.append(f"gzip={len(gzip.compress(body, compresslevel=6)) / 1024:6.1f}KB "
+                         f"({(time.perf_counter() - started) * 1000:5.1f}ms)")
+            if brotli is not None:
+                started = time.perf_counter()
+                sizes.append(f"br={len(brotli.compress(body, quality=5)) / 1024:6.1f}KB "
+                             f"({(time.perf_counter() - started) * 1000:5.1f}ms)")
+            print(f"  {name:14s} {seconds * 1000:7.1f}ms  " + "  ".join(sizes))
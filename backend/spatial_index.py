@@ -0,0 +1,236 @@
+import math
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# グリッドのセルサイズ（km）と経度方向の換算に使う基準緯度（練馬区付近）
+SPATIAL_INDEX_CELL_KM = float(os.getenv("SPATIAL_INDEX_CELL_KM", "0.2"))
+REFERENCE_LATITUDE = 35.73
+
+# 近傍検索で返すスポットの最大距離（km）。半径・件数のどちらで検索してもこれより遠いものは返さない
+SPATIAL_INDEX_MAX_RADIUS_KM = float(os.getenv("SPATIAL_INDEX_MAX_RADIUS_KM", "50"))
+
+EARTH_RADIUS_KM = 6371  # 地球の半径（km）
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """2点間の距離（km）"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    a = math.sin((lat2_rad - lat1_rad) / 2) ** 2 + \
+        math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+class SpotIndex:
+    """スポットの緯度経度をグリッドのバケットに分けて保持するメモリ内空間インデックス"""
+
+    def __init__(self, cell_km: float = SPATIAL_INDEX_CELL_KM, max_radius_km: float = SPATIAL_INDEX_MAX_RADIUS_KM):
+        self.cell_km = cell_km
+        self.max_radius_km = max_radius_km
+        self.cell_lat = cell_km / KM_PER_DEGREE
+        self.cell_lng = cell_km / (KM_PER_DEGREE * math.cos(math.radians(REFERENCE_LATITUDE)))
+        # セル -> {spot_id: (lat, lng, plan)}
+        self._cells: Dict[Tuple[int, int], Dict[int, Tuple[float, float, Optional[str]]]] = {}
+        self._spot_cells: Dict[int, Tuple[int, int]] = {}
+        # 使用中セルの範囲（削除時は縮めない。走査範囲の上限にのみ使う）
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._spot_cells)
+
+    def _cell_of(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_lat), math.floor(lng / self.cell_lng)
+
+    def rebuild(self, spots: Iterable[Tuple[int, Optional[float], Optional[float], Optional[str]]]) -> None:
+        """(id, lat, lng, plan) の列からインデックスを作り直す"""
+        with self._lock:
+            self._cells.clear()
+            self._spot_cells.clear()
+            self._bounds = None
+            for spot_id, lat, lng, plan in spots:
+                self._insert(spot_id, lat, lng, plan)
+
+    def upsert(self, spot_id: int, lat: Optional[float], lng: Optional[float], plan: Optional[str]) -> None:
+        """スポットを追加・更新する（座標が未設定ならインデックスから外す）"""
+        with self._lock:
+            self._remove(spot_id)
+            self._insert(spot_id, lat, lng, plan)
+
+    def remove(self, spot_id: int) -> None:
+        """スポットをインデックスから削除する"""
+        with self._lock:
+            self._remove(spot_id)
+
+    def _insert(self, spot_id: int, lat: Optional[float], lng: Optional[float], plan: Optional[str]) -> None:
+        if lat is None or lng is None:
+            return
+        cell = self._cell_of(lat, lng)
+        self._cells.setdefault(cell, {})[spot_id] = (lat, lng, plan)
+        self._spot_cells[spot_id] = cell
+        row, col = cell
+        if self._bounds is None:
+            self._bounds = (row, row, col, col)
+        else:
+            min_row, max_row, min_col, max_col = self._bounds
+            self._bounds = (min(min_row, row), max(max_row, row), min(min_col, col), max(max_col, col))
+
+    def _remove(self, spot_id: int) -> None:
+        cell = self._spot_cells.pop(spot_id, None)
+        if cell is None:
+            return
+        bucket = self._cells[cell]
+        bucket.pop(spot_id, None)
+        if not bucket:
+            del self._cells[cell]
+
+    def nearby(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: Optional[float] = None,
+        k: Optional[int] = None,
+        plan: Optional[str] = None,
+    ) -> List[Tuple[float, int]]:
+        """近い順に (距離km, spot_id) を返す
+
+        radius_km を指定すると半径内のスポットに限定し、k を指定すると上位 k 件に絞る。
+        どちらの場合も SPATIAL_INDEX_MAX_RADIUS_KM より遠いスポットは返さない。
+        セルを中心から同心の正方形リング状に（使用中セルの範囲に切り詰めて）走査し、
+        残りのリングが結果を変えない時点で打ち切る。
+        """
+        if radius_km is None and k is None:
+            raise ValueError("radius_km と k のどちらかを指定してください")
+        search_km = min(radius_km, self.max_radius_km) if radius_km is not None else self.max_radius_km
+
+        center_row, center_col = self._cell_of(lat, lng)
+
+        with self._lock:
+            if not self._cells:
+                return []
+            bounds = self._bounds
+            min_row, max_row, min_col, max_col = bounds
+            # 経度方向のセル幅は高緯度ほど狭いため、クエリ地点とデータのうち最も極に近い緯度で下限を見積もる
+            extreme_lat = min(90.0, max(abs(lat), abs(min_row * self.cell_lat), abs((max_row + 1) * self.cell_lat)))
+            ring_km = min(
+                self.cell_lat * KM_PER_DEGREE,
+                self.cell_lng * KM_PER_DEGREE * math.cos(math.radians(extreme_lat)),
+            )
+            # データのある範囲に届かない内側のリングは空なので飛ばす
+            first_ring = max(min_row - center_row, center_row - max_row, min_col - center_col, center_col - max_col, 0)
+            last_ring = max(
+                abs(center_row - min_row), abs(center_row - max_row),
+                abs(center_col - min_col), abs(center_col - max_col),
+            )
+
+            found: List[Tuple[float, int]] = []
+            for ring in range(first_ring, last_ring + 1):
+                # リング ring のセルの点は、中心セル内のどこから測っても少なくとも (ring - 1) セル分離れている
+                if (ring - 1) * ring_km > search_km:
+                    break
+
+                for cell in self._ring_cells(center_row, center_col, ring, bounds):
+                    bucket = self._cells.get(cell)
+                    if not bucket:
+                        continue
+                    for spot_id, (spot_lat, spot_lng, spot_plan) in bucket.items():
+                        if plan is not None and spot_plan != plan:
+                            continue
+                        distance = _haversine(lat, lng, spot_lat, spot_lng)
+                        if distance > search_km:
+                            continue
+                        found.append((distance, spot_id))
+
+                # 走査済みのリングより外側の点は少なくとも ring セル分離れている
+                if k is not None and len(found) >= k:
+                    found.sort()
+                    del found[k:]
+                    if found[k - 1][0] <= ring * ring_km:
+                        break
+
+        found.sort()
+        return found[:k] if k is not None else found
+
+    @staticmethod
+    def _ring_cells(center_row: int, center_col: int, ring: int, bounds: Tuple[int, int, int, int]):
+        """中心セルからチェビシェフ距離 ring にあるセルのうち、使用中セルの範囲（bounds）に入るものを列挙する"""
+        if ring == 0:
+            yield center_row, center_col
+            return
+        min_row, max_row, min_col, max_col = bounds
+        col_start, col_end = max(center_col - ring, min_col), min(center_col + ring, max_col)
+        for row in (center_row - ring, center_row + ring):
+            if min_row <= row <= max_row:
+                for col in range(col_start, col_end + 1):
+                    yield row, col
+        row_start, row_end = max(center_row - ring + 1, min_row), min(center_row + ring - 1, max_row)
+        for col in (center_col - ring, center_col + ring):
+            if min_col <= col <= max_col:
+                for row in range(row_start, row_end + 1):
+                    yield row, col
+
+
+# アプリ全体で共有するスポットの空間インデックス
+spot_index = SpotIndex()
+
+
+if __name__ == "__main__":
+    # 10万スポットでのクエリ時間のベンチマーク
+    import random
+    import time
+
+    random.seed(0)
+    index = SpotIndex()
+    spots = [
+        (i, 35.70 + random.random() * 0.08, 139.57 + random.random() * 0.12, random.choice(["散歩", "グルメ", None]))
+        for i in range(100_000)
+    ]
+    started = time.perf_counter()
+    index.rebuild(spots)
+    print(f"build: {(time.perf_counter() - started) * 1000:.1f}ms for {len(index)} spots")
+
+    queries = [(35.70 + random.random() * 0.08, 139.57 + random.random() * 0.12) for _ in range(1000)]
+    for label, kwargs in (
+        ("k=10", {"k": 10}),
+        ("k=10 plan", {"k": 10, "plan": "散歩"}),
+        ("radius=0.3km", {"radius_km": 0.3}),
+        ("radius=1km k=20", {"radius_km": 1.0, "k": 20}),
+    ):
+        started = time.perf_counter()
+        for lat, lng in queries:
+            index.nearby(lat, lng, **kwargs)
+        elapsed = (time.perf_counter() - started) / len(queries)
+        print(f"{label:16s}: {elapsed * 1e6:8.1f}us/query")
+
+    # 全件走査との一致確認（セルの境界付近も含む 1,000 クエリ × 複数の条件）
+    def brute_force(lat, lng, radius_km=None, k=None, plan=None):
+        limit = min(radius_km, index.max_radius_km) if radius_km is not None else index.max_radius_km
+        found = sorted(
+            (distance, spot_id)
+            for spot_id, spot_lat, spot_lng, spot_plan in spots
+            if plan is None or spot_plan == plan
+            for distance in [_haversine(lat, lng, spot_lat, spot_lng)]
+            if distance <= limit
+        )
+        return found[:k] if k is not None else found
+
+    small = SpotIndex()
+    spots = spots[:2000]
+    small.rebuild(spots)
+    index = small
+    mismatches = 0
+    cases = [{"k": 1}, {"k": 5}, {"radius_km": 0.05}, {"radius_km": 0.15}, {"k": 5, "radius_km": 0.15}, {"k": 3, "plan": "散歩"}]
+    for lat, lng in queries:
+        for kwargs in cases:
+            if small.nearby(lat, lng, **kwargs) != brute_force(lat, lng, **kwargs):
+                mismatches += 1
+    print(f"brute force: {mismatches} mismatches in {len(queries) * len(cases)} queries")
+    assert mismatches == 0
+
+    # データから遠い地点のクエリ（走査するリングを使用中セルの範囲に限定している）
+    for lat, lng in ((34.0, 139.6), (30.0, 139.6), (0.0, 0.0), (89.9, 139.6)):
+        started = time.perf_counter()
+        result = small.nearby(lat, lng, k=5)
+        print(f"far query ({lat}, {lng}): {(time.perf_counter() - started) * 1000:.2f}ms, {len(result)} results")
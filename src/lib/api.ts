@@ -9,7 +9,7 @@ const getApiBaseUrl = () => {
   return process.env.NEXT_PUBLIC_API_BASE_URL || 'http://192.168.1.47:8000';
 };
 
-const API_BASE_URL = getApiBaseUrl();
+export const API_BASE_URL = getApiBaseUrl();
 
 console.log('API_BASE_URL:', API_BASE_URL);
 console.log('Environment:', process.env.NODE_ENV);
@@ -243,8 +243,13 @@ export const api = {
   
   // 観光スポット関連
   spots: {
-    getAll: (limit?: number, offset?: number) => 
-      apiClient.get<Spot[]>(`/api/spots?limit=${limit || 100}&offset=${offset || 0}`),
+    getAll: (limit?: number, cursor?: number) => {
+      const searchParams = new URLSearchParams();
+      if (limit) searchParams.append('limit', limit.toString());
+      if (cursor) searchParams.append('cursor', cursor.toString());
+      const query = searchParams.toString();
+      return apiClient.get<Spot[]>(query ? `/api/spots?${query}` : '/api/spots');
+    },
     getSpots: () => apiClient.get<Spot[]>('/api/spots'), // SQLite対応のエンドポイント
     getById: (id: string) => apiClient.get<Spot>(`/api/spots/${id}`),
     create: (spot: SpotCreate) => apiClient.post<Spot>('/api/spots', spot),
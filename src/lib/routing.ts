@@ -1,9 +1,74 @@
+import { API_BASE_URL } from './api';
+
 export type LatLng = [number, number]; // [lat, lng]
 
 // OSRM (Open Source Routing Machine) を使用 - 無料で利用可能
 const OSRM_BASE_URL = 'https://router.project-osrm.org/route/v1';
 
-export async function fetchOrsRoute(coords: LatLng[], profile = "foot-walking") {
+// Google のエンコード済みポリラインを [lng, lat] の配列に戻す
+export function decodePolyline(encoded: string, precision = 5): [number, number][] {
+  const factor = Math.pow(10, precision);
+  const coordinates: [number, number][] = [];
+  let index = 0;
+  let lat = 0;
+  let lng = 0;
+  while (index < encoded.length) {
+    const deltas = [0, 0];
+    for (let k = 0; k < 2; k++) {
+      let result = 0;
+      let shift = 0;
+      let byte;
+      do {
+        byte = encoded.charCodeAt(index++) - 63;
+        result |= (byte & 0x1f) << shift;
+        shift += 5;
+      } while (byte >= 0x20);
+      deltas[k] = result & 1 ? ~(result >> 1) : result >> 1;
+    }
+    lat += deltas[0];
+    lng += deltas[1];
+    coordinates.push([lng / factor, lat / factor]);
+  }
+  return coordinates;
+}
+
+// エンコード済みのジオメトリを通常の GeoJSON に戻す
+function decodeRouteGeometry(data: any) {
+  for (const feature of data.features || []) {
+    const geometry = feature.geometry;
+    if (geometry && geometry.encoding === 'polyline') {
+      feature.geometry = {
+        type: 'LineString',
+        coordinates: decodePolyline(geometry.coordinates, geometry.precision),
+      };
+    }
+  }
+  return data;
+}
+
+export async function fetchOrsRoute(coords: LatLng[], profile = "foot-walking", zoom = 16) {
+  // まずバックエンドのキャッシュ付き ORS プロキシを使用
+  // 表示するズームで見分けられない頂点は間引き、エンコード済みポリラインで受け取る
+  try {
+    const response = await fetch(`${API_BASE_URL}/routing/ors`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ coordinates: coords, profile, zoom, geometry_format: 'polyline' }),
+    });
+
+    if (response.ok) {
+      const data = decodeRouteGeometry(await response.json());
+      if (data.features && data.features.length > 0) {
+        return data;
+      }
+    }
+    console.warn(`ORS proxy unavailable (${response.status}), falling back to OSRM`);
+  } catch (error) {
+    console.warn('ORS proxy error, falling back to OSRM:', error);
+  }
+
   try {
     // OSRMの形式に合わせて座標を変換 [lng,lat]の形式
     const coordinates = coords.map(coord => `${coord[1]},${coord[0]}`).join(';');